@@ -0,0 +1,117 @@
+"""Process-wide registry for the Presidio analyzer engine.
+
+Loading ``ru_core_news_lg`` takes seconds and hundreds of megabytes, so the
+analyzer is built once per process and reused by every request. When it is
+warmed in the gunicorn master (see ``gunicorn.conf.py``) the forked workers
+share the model memory copy-on-write.
+
+ANALYZER_BACKEND=stub builds a deterministic analyzer without the spaCy model instead
+(personal_data_recognizer.initialize_stub_analyzer), for load tests of the service.
+"""
+
+import gc
+import os
+import threading
+import time
+
+import personal_data_recognizer
+import text_preprocessor
+
+ANALYZER_BACKEND = os.environ.get('ANALYZER_BACKEND', 'presidio')
+ANALYZER_BACKENDS = ('presidio', 'stub')
+
+_lock = threading.Lock()
+_analyzer = None
+_load_seconds = None
+_loading = False
+
+
+def _reset_lock_in_child():
+    """Re-create the lock in a forked child in case the parent held it."""
+    global _lock  # pylint: disable=global-statement
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lock_in_child)
+
+
+def get_analyzer():
+    """
+    Return the shared analyzer engine, building it on first use.
+
+    Returns:
+        AnalyzerEngine: Analyzer engine shared by all requests of the process.
+    """
+    global _analyzer, _load_seconds, _loading  # pylint: disable=global-statement
+    if _analyzer is not None:
+        return _analyzer
+    with _lock:
+        if _analyzer is None:
+            _loading = True
+            try:
+                started = time.perf_counter()
+                text_preprocessor.warm_up()
+                if ANALYZER_BACKEND not in ANALYZER_BACKENDS:
+                    raise ValueError(f'Unknown analyzer backend: {ANALYZER_BACKEND}')
+                if ANALYZER_BACKEND == 'stub':
+                    _analyzer = personal_data_recognizer.initialize_stub_analyzer()
+                else:
+                    _analyzer = personal_data_recognizer.initialize_analyzer()
+                _load_seconds = time.perf_counter() - started
+            finally:
+                _loading = False
+    return _analyzer
+
+
+def warm_up(background=False, freeze=False):
+    """
+    Load the analyzer ahead of the first request.
+
+    Args:
+        background (bool): Load in a daemon thread and return immediately.
+        freeze (bool): Move the loaded objects to the permanent GC generation so that
+            forked workers do not touch (and copy) their pages during collection.
+    """
+    if background:
+        if not is_ready() and not _loading:
+            threading.Thread(target=get_analyzer, name='analyzer-warm-up', daemon=True).start()
+        return
+    get_analyzer()
+    if freeze:
+        gc.freeze()
+
+
+def model_name():
+    """Return the name of the model the analyzer is built from, for use in cache keys."""
+    if ANALYZER_BACKEND == 'stub':
+        return personal_data_recognizer.STUB_MODEL_NAME
+    return personal_data_recognizer.MODEL_NAME
+
+
+def is_ready():
+    """Return True if the analyzer is loaded in this process."""
+    return _analyzer is not None
+
+
+def status():
+    """
+    Describe the registry state for the readiness endpoint.
+
+    Returns:
+        dict: Readiness flag, loading flag, model name, model load time and process id.
+    """
+    return {
+        'ready': is_ready(),
+        'model': model_name(),
+        'loading': _loading,
+        'load_seconds': _load_seconds,
+        'pid': os.getpid(),
+    }
+
+
+def reset():
+    """Drop the cached analyzer so that the next call loads it again."""
+    global _analyzer, _load_seconds  # pylint: disable=global-statement
+    with _lock:
+        _analyzer = None
+        _load_seconds = None
@@ -1,106 +1,35 @@
 """ Flask application to upload and anonymize documents containing personal data. """
 
 import os
-import shutil
+import unicodedata
+from urllib.parse import quote
 
-import cv2
-import fitz  # PyMuPDF
-from PIL import Image
 from flask import Flask, send_file, render_template, redirect, url_for, send_from_directory
-from flask import request
-from pytesseract import pytesseract
-
-import image_anonymizer
-import personal_data_recognizer
+from flask import request, jsonify, Response, stream_with_context
+
+import analyzer_registry
+import bulk
+import document_processor
+import jobs
+import metrics
+import pdf_redactor
+import result_packager
+import storage
 import text_recognizer
-import format_converter as converter
-import zipfile
-import nltk
-
-try:
-    nltk.download('stopwords', download_dir='/root/nltk_data')
-except Exception as e:
-    print(f"Failed to download: {e}")
-
-try:
-    nltk.download('wordnet', download_dir='/root/nltk_data')
-except Exception as e:
-    print(f"Failed to download: {e}")
-
-try:
-    nltk.download('punkt', download_dir='/root/nltk_data')
-except Exception as e:
-    print(f"Failed to download: {e}")
-
-
-# Directory setup for file uploads and anonymized results
-UPLOAD_FOLDER = 'uploads/'
-ANONYMIZED_FOLDER = 'anonymized/'
-TEMP_FOLDER = 'temp/'
-PDF_TO_JPG_FOLDER = 'pdf2jpg/'
-
-# Create directories if they do not exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(ANONYMIZED_FOLDER, exist_ok=True)
-os.makedirs(TEMP_FOLDER, exist_ok=True)
-os.makedirs(PDF_TO_JPG_FOLDER, exist_ok=True)
-
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['ANONYMIZED_FOLDER'] = ANONYMIZED_FOLDER
-app.config['PDF_2_JPG_FOLDER'] = PDF_TO_JPG_FOLDER
-app.config['TEMP_FOLDER'] = TEMP_FOLDER
-
-def recognize_text(image_path):
-    """ Extracts text from given image.
-
-    Args:
-        image_path (str): The path to the image file.
-
-    Returns:
-        str: The extracted text from the image.
-    """
-    text = text_recognizer.extract_text_from_image(image_path, lang='rus')
-    return text
-
-
-def find_content_to_anonymize(file_path):
-    """ Extracts personal data from document.
-
-    Args:
-        file_path (str): The path to the file (PDF or image).
-
-    Returns:
-        list: A list of anonymized strings found in the document.
-    """
-    analyzer = personal_data_recognizer.initialize_analyzer()
-    text = ""
-    if file_path.lower().endswith('.pdf'):
-        doc = fitz.open(file_path)
-        for page in doc:
-            text += page.get_text()
-    else:
-        text = text_recognizer.extract_text_from_image(file_path, lang='rus')
-    personal_data = personal_data_recognizer.find_personal_data(text, analyzer)
-    return personal_data
 
-def zip_anonymized_images(images, pdf_path):
-    filename = os.path.splitext(os.path.basename(pdf_path))[0]
-    zip_filename = f'{filename}.zip'
-    zip_filepath = os.path.join(app.config['ANONYMIZED_FOLDER'], zip_filename)
 
-    with zipfile.ZipFile(zip_filepath, 'w') as zipf:
-            for i,processed_image in enumerate(images):
-                temp_filename = os.path.join(app.config['ANONYMIZED_FOLDER'], f'temp_image_{i}.jpg')
-                im = Image.fromarray(processed_image)
-                im.save(temp_filename)
-
-                arcname = f'Image_{i}.jpg'
-                zipf.write(temp_filename, arcname)
-
-                # Optionally, remove the temporary file after adding it to the zip archive
-                os.remove(temp_filename)
-    return zip_filepath
+app = Flask(__name__)
+app.config['UPLOAD_FOLDER'] = document_processor.UPLOAD_FOLDER
+app.config['ANONYMIZED_FOLDER'] = document_processor.ANONYMIZED_FOLDER
+
+# Результаты хранятся RESULT_TTL секунд, загрузки удаляются сразу после обработки;
+# уборщик запускается в каждом воркере, но папки убирает только один из них
+storage.start_janitor({
+    'results': app.config['ANONYMIZED_FOLDER'],
+    'jobs': jobs.JOBS_FOLDER,
+    'bulk': bulk.BULK_FOLDER,
+    'debug': text_recognizer.TEMP_FOLDER,
+})
 
 @app.route('/anonymized/<path:filename>')
 def anonymized_folder_files(filename):
@@ -113,6 +42,32 @@ def upload_folder_files(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 
+@app.before_request
+def start_request_metrics():
+    """Start collecting stage timings of the request for the Server-Timing header."""
+    metrics.start_request()
+
+@app.after_request
+def add_server_timing(response):
+    """Report the stages timed while handling the request (METRICS_SERVER_TIMING=1)."""
+    server_timing = metrics.server_timing_header()
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage latencies and document sizes in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once the analyzer model is loaded, 503 while it is loading."""
+    if not analyzer_registry.is_ready():
+        analyzer_registry.warm_up(background=True)
+    status = analyzer_registry.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
 @app.route('/')
 def index():
     """ Главная страница с формой для загрузки файлов. """
@@ -120,88 +75,143 @@ def index():
 
 @app.route('/results/<filename>')
 def results(filename):
-    """Отображает страницу с результатами обработки."""
+    """Отображает страницу с результатами обработки или отдаёт результат задания."""
+    if jobs.is_job_id(filename):
+        return job_result(filename)
+    if document_processor.is_docx(filename) or (
+            filename.lower().endswith('.pdf') and pdf_redactor.PDF_REDACTION_MODE == 'native'):
+        return send_file(os.path.join(app.config['ANONYMIZED_FOLDER'], filename), as_attachment=True)
     if filename.lower().endswith('.pdf'):
-        original_pdf_path = os.path.join(app.config['ANONYMIZED_FOLDER'], f'{os.path.splitext(filename)[0]}.zip')
-        return send_file(original_pdf_path, as_attachment=True)
+        result_name = document_processor.raster_result_name(filename)
+        return send_file(os.path.join(app.config['ANONYMIZED_FOLDER'], result_name), as_attachment=True)
     else:
-        original_image_path = os.path.join('/uploads', filename)
+        # Загруженный оригинал удалён после обработки, показываем только результат
         processed_image_path = os.path.join('/anonymized', filename)
-        return render_template('/result_page.html', original_image_path=original_image_path, processed_image_path=processed_image_path)
+        return render_template('/result_page.html', processed_image_path=processed_image_path)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """ Handles file uploads and sends back anonymized content. """
     test_all = request.form.get('test_all', '').lower() == 'on'
     if test_all:
-        file_list = os.listdir(app.config['UPLOAD_FOLDER'])
-        for filename in file_list:
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            process_and_anonymize_file(file_path, filename)
-        return 'All files processed', 200
+        # Образцы обрабатываются в фоне, как запуск /bulk: запрос не занимает воркер gunicorn
+        try:
+            manifest = bulk.start(bulk.collect_files([app.config['UPLOAD_FOLDER']]))
+        except bulk.QueueFullError as e:
+            return jsonify(error=str(e)), 429, {'Retry-After': '5'}
+        return jsonify(manifest), 202, {'Location': url_for('bulk_status', bulk_id=manifest['id'])}
     else:
         if 'file' not in request.files:
             return 'No file part', 400
         file = request.files['file']
         if file.filename == '':
             return 'No selected file', 400
-        filename = file.filename
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        process_and_anonymize_file(file_path, filename)
+        filename = os.path.basename(file.filename)
+        scratch = storage.Scratch()
+        try:
+            file_path = scratch.save(file, filename, request.content_length)
+            if document_processor.is_raster_pdf(filename):
+                # Страницы упаковываются и отправляются клиенту по мере готовности, без записи на диск;
+                # загрузка удаляется, когда ответ отдан
+                chunks = document_processor.stream_anonymized_pdf(file_path)
+                response = _attachment(chunks, document_processor.raster_result_name(filename),
+                                       result_packager.mimetype())
+                response.call_on_close(scratch.close)
+                return response
+        except storage.QuotaExceededError as e:
+            scratch.close()
+            return jsonify(error=str(e)), 413
+        except BaseException:
+            scratch.close()
+            raise
+        with scratch:
+            document_processor.process_and_anonymize_file(file_path, filename)
         return redirect(url_for('results', filename=filename))
 
-def process_and_anonymize_file(file_path, filename):
-    """Process and anonymize a single file."""
-    content_to_anonymize = find_content_to_anonymize(file_path)
-    anonymized_path = os.path.join(app.config['ANONYMIZED_FOLDER'], filename)
-    if file_path.lower().endswith('.pdf'):
-        # преобразовать в JPG
-        anonymized_path = process_pdf(file_path, content_to_anonymize, app.config['PDF_2_JPG_FOLDER'])
-    else:
-        image = image_anonymizer.anonymize_image(file_path, "temp/preprocessed_image.jpg", content_to_anonymize)
-        cv2.imwrite(anonymized_path, image)
-
-    # with open(anonymized_path, 'w', encoding='utf-8') as f:
-    #     f.write(" ".join(anonymized_content))
-
-    return send_file(anonymized_path, as_attachment=True)
-    # return 'File processed', 200  # Ensure consistent return behavior
-
-
-def process_pdf(file_path, content_to_anonymize, pdf_to_jpg_folder):
-    """Process PDF file by converting to JPG and anonymizing each page."""
-
-    # Convert PDF to JPG
+def _attachment(chunks, download_name, mimetype):
+    """ Streams the chunks to the client as a file download. """
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
     try:
-        converter.convert_pdf_to_jpg(file_path, pdf_to_jpg_folder)
-
-        images_to_process = os.listdir(pdf_to_jpg_folder)
-        processed_images = []
-
-        for image in images_to_process:
-            image_path = os.path.join(pdf_to_jpg_folder, image)
-            processed_image = image_anonymizer.anonymize_image(image_path, image_path, content_to_anonymize)
-            processed_images.append(processed_image)
-
-        # Zip the anonymized images and return the zip path
-        return zip_anonymized_images(processed_images, file_path)
-    finally:
-        clean_directory(pdf_to_jpg_folder)
-
-def clean_directory(directory):
-    """Remove all files in the specified directory."""
-
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
-
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print(f'Failed to delete {file_path}. Reason: {e}')
+        download_name.encode('ascii')
+        names = {'filename': download_name}
+    except UnicodeEncodeError:
+        ascii_name = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': ascii_name, 'filename*': f"UTF-8''{quote(download_name)}"}
+    response.headers.set('Content-Disposition', 'attachment', **names)
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """ Queues an uploaded file for asynchronous anonymization and returns the job id. """
+    if 'file' not in request.files:
+        return 'No file part', 400
+    file = request.files['file']
+    if file.filename == '':
+        return 'No selected file', 400
+    try:
+        status = jobs.submit(file, request.content_length)
+    except jobs.QueueFullError as e:
+        return jsonify(error=str(e)), 429, {'Retry-After': '5'}
+    except storage.QuotaExceededError as e:
+        return jsonify(error=str(e)), 413
+    return jsonify(status), 202, {'Location': url_for('job_status', job_id=status['id'])}
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """ Returns the state and per-stage progress of a job. """
+    status = jobs.get_status(job_id)
+    if status is None:
+        return 'No such job', 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/wait')
+def job_wait(job_id):
+    """ Long-polls until the job finishes or `timeout` seconds (at most 60) pass. """
+    timeout = min(request.args.get('timeout', 30, type=float), 60)
+    status = jobs.wait(job_id, timeout)
+    if status is None:
+        return 'No such job', 404
+    return jsonify(status)
+
+@app.route('/bulk', methods=['POST'])
+def create_bulk():
+    """ Queues many documents (the `files` field; zip archives are unpacked) for parallel anonymization. """
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return 'No selected file', 400
+    try:
+        manifest = bulk.submit(files, request.content_length)
+    except bulk.QueueFullError as e:
+        return jsonify(error=str(e)), 429, {'Retry-After': '5'}
+    except storage.QuotaExceededError as e:
+        return jsonify(error=str(e)), 413
+    return jsonify(manifest), 202, {'Location': url_for('bulk_status', bulk_id=manifest['id'])}
+
+@app.route('/bulk/<bulk_id>')
+def bulk_status(bulk_id):
+    """ Returns the manifest of a bulk run: per-file outcomes and throughput. """
+    manifest = bulk.get_manifest(bulk_id)
+    if manifest is None:
+        return 'No such run', 404
+    return jsonify(manifest)
+
+@app.route('/bulk/<bulk_id>/files/<path:name>')
+def bulk_file(bulk_id, name):
+    """ Sends one result of a bulk run; `name` is the `result` field of the manifest. """
+    if not bulk.is_bulk_id(bulk_id):
+        return 'No such run', 404
+    return send_from_directory(bulk.output_folder(bulk_id), name, as_attachment=True)
+
+def job_result(job_id):
+    """ Sends the result of a finished job. """
+    status = jobs.get_status(job_id)
+    if status is None:
+        return 'No such job', 404
+    result_path = jobs.result_path(job_id)
+    if result_path is None:
+        return jsonify(status), 409
+    download_name = os.path.splitext(status['filename'])[0] + os.path.splitext(result_path)[1]
+    return send_file(result_path, as_attachment=True, download_name=download_name)
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1 @@
+"""Benchmarks over the sample documents in uploads/; run from the project folder."""
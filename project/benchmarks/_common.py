@@ -0,0 +1,11 @@
+"""Sample documents shared by the benchmarks."""
+
+import glob
+
+IMAGE_PATTERNS = ('uploads/Test-*.jpg', 'uploads/Test-*.png')
+UPLOADS_PATTERNS = IMAGE_PATTERNS + ('uploads/Test-*.pdf',)
+
+
+def sample_documents(patterns=UPLOADS_PATTERNS):
+    """Return the document paths matching the glob patterns, sorted by name."""
+    return sorted({path for pattern in patterns for path in glob.glob(pattern)})
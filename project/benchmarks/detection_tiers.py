@@ -0,0 +1,112 @@
+"""Compare the full and tiered detection modes on the sample documents in uploads/.
+
+The text of every document is recognized once. Then personal data is detected in both
+modes ``--repeat`` times after an untimed warm-up call; the report shows the median time
+of each mode, the share of lines the tiered mode sent through NER, the speedup and the
+words the tiered mode missed (found by the full mode only) or added.
+
+Run from the project folder:
+    python -m benchmarks.detection_tiers --repeat 3 --json detection_tiers.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+import analyzer_registry
+import pdf_redactor
+import personal_data_recognizer
+import text_recognizer
+from benchmarks._common import sample_documents
+
+
+def document_text(path):
+    """Return the recognized text of an image or a PDF."""
+    if path.lower().endswith('.pdf'):
+        return pdf_redactor.extract_text(path).text
+    return text_recognizer.recognize_image(path).text
+
+
+def _timed_detection(text, analyzer, mode, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        found = personal_data_recognizer.find_personal_data(text, analyzer, mode=mode)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), found
+
+
+def compare_document(text, analyzer, repeat):
+    """
+    Detect personal data in one text in both modes.
+
+    Args:
+        text (str): The recognized document text.
+        analyzer: The loaded analyzer.
+        repeat (int): Timed detections per mode.
+
+    Returns:
+        dict: Line counts, median time per mode and the differences of the found words.
+    """
+    sentences = personal_data_recognizer._sentence_strings(text)  # pylint: disable=protected-access
+    clues = [personal_data_recognizer.clue_matcher.index(sentence) for sentence in sentences]
+    selected = personal_data_recognizer.select_ner_lines(text.split('\n'), clues)
+
+    full_s, full = _timed_detection(text, analyzer, 'full', repeat)
+    tiered_s, tiered = _timed_detection(text, analyzer, 'tiered', repeat)
+    return {
+        'lines': sum(1 for sentence in sentences if sentence),
+        'ner_lines': sum(1 for i in selected if sentences[i]),
+        'full_s': full_s,
+        'tiered_s': tiered_s,
+        'found': len(full),
+        'missed': sorted(full - tiered),
+        'extra': sorted(tiered - full),
+    }
+
+
+def main():
+    """Run the comparison and print a summary table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='timed detections per mode')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    analyzer = analyzer_registry.get_analyzer()
+    texts = {os.path.basename(path): document_text(path) for path in sample_documents()}
+    personal_data_recognizer.find_personal_data('Пациент Иванов Иван', analyzer)
+
+    files = {name: compare_document(text, analyzer, args.repeat) for name, text in texts.items()}
+    full_s = sum(file['full_s'] for file in files.values())
+    tiered_s = sum(file['tiered_s'] for file in files.values())
+    found = sum(file['found'] for file in files.values())
+    missed = sum(len(file['missed']) for file in files.values())
+    results = {
+        'full_s': full_s,
+        'tiered_s': tiered_s,
+        'speedup': full_s / tiered_s if tiered_s else None,
+        'lines': sum(file['lines'] for file in files.values()),
+        'ner_lines': sum(file['ner_lines'] for file in files.values()),
+        'recall': (found - missed) / found if found else 1.0,
+        'files': files,
+    }
+
+    print(f"full {full_s:.3f}s, tiered {tiered_s:.3f}s, speedup {results['speedup'] or 0:.2f}x, "
+          f"NER on {results['ner_lines']}/{results['lines']} lines, "
+          f"recall vs full {results['recall']:.1%}")
+    for name, file in files.items():
+        print(f"  {name:<12} full {file['full_s']:7.3f}s  tiered {file['tiered_s']:7.3f}s  "
+              f"NER lines {file['ner_lines']:3d}/{file['lines']:3d}  found {file['found']:3d}  "
+              f"missed {len(file['missed']):2d}  extra {len(file['extra']):2d}")
+        for word in file['missed']:
+            print(f'    missed: {word}')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+"""Load test of the web service: concurrent uploads against /upload.
+
+``--concurrency`` clients send documents drawn from ``uploads/`` to ``/upload`` (the single
+file form; ``--test-all-share`` of the requests use the ``test_all`` path instead) until
+``--requests`` requests are sent or ``--duration`` seconds pass. The report shows the
+throughput, latency percentiles, error and timeout rates per request kind and, when the
+server's process id is known, the RSS of the gunicorn master and its workers over time.
+
+``--serve`` starts gunicorn from ``gunicorn.conf.py`` on a local port for the run.
+``--stub`` makes that server use the deterministic stand-ins for Tesseract
+(OCR_BACKEND=stub) and the spaCy analyzer (ANALYZER_BACKEND=stub), whose latency is set with
+``--ocr-latency`` and ``--ner-latency``, so the web and queueing layers are measured on
+their own on a machine without the models. The OCR cache of the started server is enabled
+only with ``--cache``, since the same documents are sent again and again.
+
+Run from the project folder:
+    python -m benchmarks.load --serve --stub --workers 4 --concurrency 8 --duration 60
+    python -m benchmarks.load --url http://127.0.0.1:5000 --server-pid 1234 --requests 200
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from benchmarks._common import UPLOADS_PATTERNS, sample_documents
+
+DOCUMENT_PATTERNS = UPLOADS_PATTERNS + ('uploads/Test-*.docx',)
+PERCENTILES = (50, 90, 95, 99)
+MEMORY_SAMPLE_INTERVAL = 1.0
+READY_POLL_INTERVAL = 0.5
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                     f'{value}\r\n'.encode('utf-8'))
+    for name, (filename, payload) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                     f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'
+                     .encode('utf-8'))
+        parts.append(payload)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('ascii'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def _request(url, method, path, body=None, headers=None, timeout=None):
+    address = urlsplit(url)
+    connection_class = (http.client.HTTPSConnection if address.scheme == 'https'
+                        else http.client.HTTPConnection)
+    connection = connection_class(address.hostname, address.port, timeout=timeout)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        # Ответ читается целиком: растровые PDF отдаются потоком по мере обработки страниц
+        payload = response.read()
+        return response.status, payload
+    finally:
+        connection.close()
+
+
+def upload(url, document, index, test_all=False, timeout=None):
+    """
+    Send one request to /upload.
+
+    Args:
+        url (str): Base URL of the service.
+        document (Tuple[str, bytes]): File name and content of the document.
+        index (int): Number of the request; it prefixes the uploaded file name so that
+            concurrent requests do not overwrite each other's upload.
+        test_all (bool): Use the test_all path (the server queues a bulk run over its uploads
+            folder and answers 202, or 429 when its bulk queue is full).
+        timeout (float): Socket timeout in seconds.
+
+    Returns:
+        dict: Kind, outcome (``ok``, ``error`` or ``timeout``), HTTP status, latency and
+        response size of the request.
+    """
+    if test_all:
+        body, content_type = _multipart({'test_all': 'on'}, {})
+    else:
+        name, payload = document
+        body, content_type = _multipart({}, {'file': (f'load-{index}-{name}', payload)})
+    record = {'kind': 'test_all' if test_all else 'single',
+              'document': None if test_all else document[0],
+              'outcome': 'ok', 'status': None, 'bytes': 0}
+    started = time.perf_counter()
+    try:
+        status, payload = _request(url, 'POST', '/upload', body,
+                                   {'Content-Type': content_type}, timeout)
+        record.update(status=status, bytes=len(payload))
+        # Одиночная загрузка изображения отвечает редиректом на страницу результата
+        if status >= 400:
+            record['outcome'] = 'error'
+    except socket.timeout:
+        record['outcome'] = 'timeout'
+    except (OSError, http.client.HTTPException) as e:
+        record.update(outcome='error', error=f'{type(e).__name__}: {e}')
+    record['latency_s'] = time.perf_counter() - started
+    return record
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children', 'r', encoding='ascii') as file:
+            return [int(child) for child in file.read().split()]
+    except OSError:
+        return []
+
+
+def _rss(pid):
+    try:
+        with open(f'/proc/{pid}/statm', 'r', encoding='ascii') as file:
+            return int(file.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return None
+
+
+def process_tree_rss(pid):
+    """Return the RSS in bytes of the process and all its descendants, by process id."""
+    usage = {}
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        rss = _rss(current)
+        if rss is not None:
+            usage[current] = rss
+            pending.extend(_children(current))
+    return usage
+
+
+class MemorySampler(threading.Thread):
+    """Samples the RSS of a server process tree (gunicorn master and workers) in the background."""
+
+    def __init__(self, pid, interval=MEMORY_SAMPLE_INTERVAL):
+        super().__init__(name='memory-sampler', daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._origin = time.perf_counter()
+
+    def run(self):
+        while True:
+            usage = process_tree_rss(self.pid)
+            self.samples.append({'t_s': time.perf_counter() - self._origin,
+                                 'total_bytes': sum(usage.values()),
+                                 'processes': {str(pid): rss for pid, rss in usage.items()}})
+            if self._stop_event.wait(self.interval):
+                return
+
+    def stop(self):
+        """Stop sampling and wait for the thread."""
+        self._stop_event.set()
+        self.join()
+
+
+def run_load(url, documents, concurrency, requests=None, duration=None, test_all_share=0.0,
+             timeout=None, seed=0):
+    """
+    Send requests from ``concurrency`` threads until the request count or the duration is
+    reached.
+
+    Args:
+        url (str): Base URL of the service.
+        documents (List[str]): Paths of the documents to send; request i sends one of them
+            chosen by a random generator seeded with ``seed``, so runs are repeatable.
+        concurrency (int): Number of clients sending requests at the same time.
+        requests (int): Total number of requests.
+        duration (float): Seconds after which no new requests are sent.
+        test_all_share (float): Share of the requests that use the test_all path.
+        timeout (float): Socket timeout of a request in seconds.
+        seed (int): Seed of the document mix.
+
+    Returns:
+        Tuple[List[dict], float]: The request records and the wall time of the run.
+    """
+    payloads = []
+    for path in documents:
+        with open(path, 'rb') as file:
+            payloads.append((os.path.basename(path), file.read()))
+    generator = random.Random(seed)
+    limit = requests if requests is not None else sys.maxsize
+    schedule_lock = threading.Lock()
+    counter = iter(range(limit))
+    records = []
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+
+    def next_request():
+        with schedule_lock:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            index = next(counter, None)
+            if index is None:
+                return None
+            return index, generator.choice(payloads), generator.random() < test_all_share
+
+    def client():
+        while True:
+            planned = next_request()
+            if planned is None:
+                return
+            index, document, test_all = planned
+            record = upload(url, document, index, test_all, timeout)
+            record['finished_s'] = time.perf_counter() - started
+            records.append(record)
+
+    threads = [threading.Thread(target=client, name=f'load-client-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - started
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(records, seconds):
+    """
+    Summarize request records.
+
+    Args:
+        records (List[dict]): Records returned by upload.
+        seconds (float): Wall time of the run.
+
+    Returns:
+        dict: Request count, throughput of successful requests, error and timeout rates and
+        latency percentiles of the successful requests.
+    """
+    count = len(records)
+    ok = [record for record in records if record['outcome'] == 'ok']
+    latencies = sorted(record['latency_s'] for record in ok)
+    errors = sum(record['outcome'] == 'error' for record in records)
+    timeouts = sum(record['outcome'] == 'timeout' for record in records)
+    summary = {
+        'requests': count,
+        'ok': len(ok),
+        'throughput_rps': len(ok) / seconds if seconds else None,
+        'error_rate': errors / count if count else 0.0,
+        'timeout_rate': timeouts / count if count else 0.0,
+        'latency_mean_s': sum(latencies) / len(latencies) if latencies else None,
+        'latency_max_s': latencies[-1] if latencies else None,
+    }
+    for percent in PERCENTILES:
+        summary[f'latency_p{percent}_s'] = _percentile(latencies, percent)
+    return summary
+
+
+def wait_ready(url, timeout):
+    """
+    Wait until /ready answers 200.
+
+    Raises:
+        TimeoutError: If the service is not ready within ``timeout`` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if _request(url, 'GET', '/ready', timeout=READY_POLL_INTERVAL * 4)[0] == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(READY_POLL_INTERVAL)
+    raise TimeoutError(f'{url} is not ready after {timeout:g}s')
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(args):
+    """Start gunicorn with gunicorn.conf.py on a free local port; return (process, url)."""
+    port = _free_port()
+    env = dict(os.environ, GUNICORN_BIND=f'127.0.0.1:{port}',
+               GUNICORN_WORKERS=str(args.workers))
+    if args.server_timeout is not None:
+        env['GUNICORN_TIMEOUT'] = str(args.server_timeout)
+    env['OCR_CACHE_ENABLED'] = '1' if args.cache else '0'
+    if args.stub:
+        env.update(OCR_BACKEND='stub', ANALYZER_BACKEND='stub',
+                   STUB_OCR_LATENCY=str(args.ocr_latency), STUB_NER_LATENCY=str(args.ner_latency))
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'], env=env)
+    return process, f'http://127.0.0.1:{port}'
+
+
+def _print_summary(name, summary):
+    if not summary['requests']:
+        return
+    percentiles = '  '.join(f"p{percent} {summary[f'latency_p{percent}_s'] or 0:6.2f}s"
+                            for percent in PERCENTILES)
+    print(f"  {name:<8} {summary['requests']:5d} req  {summary['throughput_rps'] or 0:6.2f} req/s  "
+          f"errors {summary['error_rate']:6.1%}  timeouts {summary['timeout_rate']:6.1%}  "
+          f"{percentiles}  max {summary['latency_max_s'] or 0:6.2f}s")
+
+
+def main():
+    """Run the load test and print a summary."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='base URL of a running service')
+    parser.add_argument('--server-pid', type=int,
+                        help='pid of the gunicorn master of --url, to sample its memory')
+    parser.add_argument('--serve', action='store_true', help='start gunicorn for the run')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers with --serve')
+    parser.add_argument('--server-timeout', type=int, help='gunicorn worker timeout with --serve')
+    parser.add_argument('--stub', action='store_true',
+                        help='use the stub OCR backend and analyzer with --serve')
+    parser.add_argument('--ocr-latency', type=float, default=0.2,
+                        help='seconds per OCR call of the stub backend')
+    parser.add_argument('--ner-latency', type=float, default=0.002,
+                        help='seconds per line of the stub analyzer')
+    parser.add_argument('--cache', action='store_true', help='enable the OCR cache of the server')
+    parser.add_argument('--startup-timeout', type=float, default=120,
+                        help='seconds to wait for /ready')
+    parser.add_argument('--concurrency', type=int, default=4, help='simultaneous clients')
+    parser.add_argument('--requests', type=int, help='total requests (default 100 without --duration)')
+    parser.add_argument('--duration', type=float, help='seconds to send requests for')
+    parser.add_argument('--test-all-share', type=float, default=0.0,
+                        help='share of requests sent with test_all')
+    parser.add_argument('--timeout', type=float, default=360, help='request timeout in seconds')
+    parser.add_argument('--files', nargs='+', default=DOCUMENT_PATTERNS,
+                        help='glob patterns of the documents to send')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the document mix')
+    parser.add_argument('--memory-interval', type=float, default=MEMORY_SAMPLE_INTERVAL,
+                        help='seconds between memory samples')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    if not args.serve and not args.url:
+        parser.error('either --url or --serve is required')
+    if args.requests is None and args.duration is None:
+        args.requests = 100
+
+    documents = sample_documents(args.files)
+    if not documents:
+        parser.error(f'no documents match {args.files}')
+
+    server = None
+    url, server_pid = args.url, args.server_pid
+    if args.serve:
+        server, url = start_server(args)
+        server_pid = server.pid
+    sampler = None
+    try:
+        wait_ready(url, args.startup_timeout)
+        if server_pid:
+            sampler = MemorySampler(server_pid, args.memory_interval)
+            sampler.start()
+        records, seconds = run_load(url, documents, args.concurrency, args.requests,
+                                    args.duration, args.test_all_share, args.timeout, args.seed)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results = {
+        'url': url,
+        'workers': args.workers if args.serve else None,
+        'stub': args.stub,
+        'concurrency': args.concurrency,
+        'seconds': seconds,
+        'documents': [os.path.basename(path) for path in documents],
+        'summary': summarize(records, seconds),
+        'by_kind': {kind: summarize([record for record in records if record['kind'] == kind],
+                                    seconds)
+                    for kind in ('single', 'test_all')},
+        'memory': sampler.samples if sampler is not None else [],
+        'requests': records,
+    }
+
+    summary = results['summary']
+    print(f"{summary['requests']} requests in {seconds:.1f}s with concurrency {args.concurrency}"
+          f"{' (stub OCR/NER)' if args.stub else ''}: {summary['throughput_rps'] or 0:.2f} req/s")
+    _print_summary('all', summary)
+    for kind, kind_summary in results['by_kind'].items():
+        _print_summary(kind, kind_summary)
+    if results['memory']:
+        totals = [sample['total_bytes'] for sample in results['memory']]
+        workers = max(len(sample['processes']) for sample in results['memory'])
+        print(f"  memory   {workers} processes, RSS start {totals[0] / 2**20:.0f}MB, "
+              f"peak {max(totals) / 2**20:.0f}MB, end {totals[-1] / 2**20:.0f}MB")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Compare the OCR backends on the sample images in uploads/.
+
+Every image is preprocessed once; then each backend given with ``--backends`` (by default
+every real backend, without the ``stub`` stand-in) recognizes it ``--repeat`` times. The first call of a backend is reported separately because it includes loading the
+traineddata.
+
+Run from the project folder:
+    python -m benchmarks.ocr_backends --repeat 3 --json ocr_backends.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+import text_recognizer
+from benchmarks._common import IMAGE_PATTERNS, sample_documents
+from ocr_backends import BACKENDS, get_ocr_backend
+
+# Заглушка для тестов без Tesseract не сравнивается с настоящими бэкендами
+DEFAULT_BACKENDS = tuple(name for name in BACKENDS if name != 'stub')
+
+
+def benchmark_backend(backend, images, repeat):
+    """
+    Time a backend on preprocessed images.
+
+    Args:
+        backend: The OCR backend.
+        images (Dict[str, np.ndarray]): Preprocessed images by file path.
+        repeat (int): Number of recognitions per image.
+
+    Returns:
+        dict: First call time and per-file median time and word count.
+    """
+    first_image = next(iter(images.values()))
+    started = time.perf_counter()
+    backend.image_to_data(first_image, 'rus', text_recognizer.OCR_CONFIG)
+    first_call = time.perf_counter() - started
+
+    files = {}
+    for path, image in images.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            data = backend.image_to_data(image, 'rus', text_recognizer.OCR_CONFIG)
+            timings.append(time.perf_counter() - started)
+        files[os.path.basename(path)] = {
+            'median_s': statistics.median(timings),
+            'words': sum(1 for word in data['text'] if str(word).strip()),
+        }
+    return {
+        'first_call_s': first_call,
+        'total_median_s': sum(file['median_s'] for file in files.values()),
+        'files': files,
+    }
+
+
+def main():
+    """Run the benchmark and print a summary table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='recognitions per image')
+    parser.add_argument('--backends', nargs='+', choices=tuple(BACKENDS), default=DEFAULT_BACKENDS,
+                        help='backends to compare')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    images = {path: text_recognizer.preprocess_image(path)
+              for path in sample_documents(IMAGE_PATTERNS)}
+    results = {}
+    for name in args.backends:
+        try:
+            backend = get_ocr_backend(name)
+        except ImportError as e:
+            print(f'{name}: skipped ({e})')
+            continue
+        results[name] = benchmark_backend(backend, images, args.repeat)
+
+    for name, result in results.items():
+        print(f"{name}: first call {result['first_call_s']:.2f}s, "
+              f"total median {result['total_median_s']:.2f}s")
+        for filename, file in result['files'].items():
+            print(f"  {filename:<12} {file['median_s']:7.3f}s {file['words']:5d} words")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
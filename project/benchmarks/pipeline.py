@@ -0,0 +1,292 @@
+"""Time every stage of the anonymization pipeline on the sample documents in uploads/.
+
+Stages: ``render`` (PDF pages to JPG with format_converter.convert_pdf_to_jpg), ``preprocess``
+(text_recognizer.preprocess_with_layout), ``ocr`` (the rest of text_recognizer.extract_words
+as the service calls it: resampling to OCR_TARGET_TEXT_HEIGHT and recognition of the whole
+page or of its text regions, depending on OCR_MODE), ``text_preprocess``
+(text_preprocessor.preprocess), ``detect`` (personal_data_recognizer.find_personal_data, which
+runs its own text preprocessing as well), ``redact`` and ``package`` (encoding the pages and
+packing them with result_packager). For every stage and file the wall time, CPU time
+(including child processes such as the tesseract executable) and peak RSS of this process are
+reported.
+
+``preprocess`` runs inside extract_words, so its wall time is the ``preprocess`` stage that
+the metrics module records there and is subtracted from ``ocr``; its CPU time is the share of
+the CPU time of extract_words in proportion to the wall time, and its peak RSS is that of
+extract_words.
+
+``--mode cold`` measures a fresh process: the model load is timed as its own stage and the
+first pass over the corpus is reported. ``--mode warm`` loads the model and makes one
+untimed pass first, so the numbers show the steady state. The OCR cache is disabled.
+
+Run from the project folder:
+    python -m benchmarks.pipeline --mode warm --repeat 3 --json pipeline.json
+    python -m benchmarks.pipeline --mode warm --compare pipeline.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import analyzer_registry
+import format_converter as converter
+import image_anonymizer
+import metrics
+import ocr_cache
+import personal_data_recognizer
+import result_packager
+import text_preprocessor
+import text_recognizer
+from benchmarks._common import sample_documents
+from ocr_backends import get_ocr_backend
+
+STAGES = ('render', 'preprocess', 'ocr', 'text_preprocess', 'detect', 'redact', 'package')
+RSS_SAMPLE_INTERVAL = 0.005
+
+
+def _current_rss():
+    try:
+        with open('/proc/self/statm', 'r', encoding='ascii') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Нет /proc: берём пик за всё время жизни процесса (в КБ на Linux, в байтах на macOS)
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if platform.system() == 'Darwin' else max_rss * 1024
+
+
+def _cpu_time():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+class StageTimer:
+    """Context manager measuring wall time, CPU time and peak RSS of a block of code."""
+
+    def __init__(self):
+        self.wall_s = self.cpu_s = 0.0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, _current_rss())
+
+    def __enter__(self):
+        self.peak_rss = _current_rss()
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._cpu = _cpu_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_s = time.perf_counter() - self._wall
+        self.cpu_s = _cpu_time() - self._cpu
+        self._stop.set()
+        self._sampler.join()
+        self.peak_rss = max(self.peak_rss, _current_rss())
+
+    def result(self):
+        """Return the measurement as a JSON-serializable dict."""
+        return {'wall_s': self.wall_s, 'cpu_s': self.cpu_s, 'peak_rss_mb': self.peak_rss / 2 ** 20}
+
+
+class StageRecorder:
+    """Accumulates the measurements of the stages of one document."""
+
+    def __init__(self):
+        self.stages = {}
+        self._last = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the block and add the measurement to the stage."""
+        with StageTimer() as timer:
+            yield
+        self._add(name, timer.wall_s, timer.cpu_s, timer.peak_rss)
+        self._last[name] = timer
+
+    def split(self, name, part, wall_s):
+        """
+        Move ``wall_s`` seconds of the last block measured as ``name`` to the stage ``part``,
+        with the same share of its CPU time; both keep the peak RSS of the block.
+        """
+        timer = self._last[name]
+        wall_s = min(wall_s, timer.wall_s)
+        cpu_s = timer.cpu_s * wall_s / timer.wall_s if timer.wall_s else 0.0
+        self._add(part, wall_s, cpu_s, timer.peak_rss)
+        self.stages[name]['wall_s'] -= wall_s
+        self.stages[name]['cpu_s'] -= cpu_s
+
+    def _add(self, name, wall_s, cpu_s, peak_rss):
+        totals = self.stages.setdefault(name, {'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': 0.0})
+        totals['wall_s'] += wall_s
+        totals['cpu_s'] += cpu_s
+        totals['peak_rss_mb'] = max(totals['peak_rss_mb'], peak_rss / 2 ** 20)
+
+
+def _anonymize_page(image, analyzer, recorder):
+    with recorder.stage('ocr'), metrics.collect_timings() as timings:
+        ocr_words = text_recognizer.extract_words(image, lang='rus')
+        text = ocr_words.text()
+    recorder.split('ocr', 'preprocess', timings.get('preprocess', 0.0))
+    with recorder.stage('text_preprocess'):
+        text_preprocessor.preprocess(text)
+    with recorder.stage('detect'):
+        words = personal_data_recognizer.find_personal_data(text, analyzer)
+    with recorder.stage('redact'):
+        image = image_anonymizer.anonymize_image(image, words, ocr_words)
+    with recorder.stage('package'):
+        encoded = result_packager.encode_page(image)
+    return encoded
+
+
+def benchmark_document(path, analyzer):
+    """
+    Run the pipeline stage by stage on one document.
+
+    Args:
+        path (str): Path to the image or PDF.
+        analyzer: The loaded analyzer.
+
+    Returns:
+        dict: Page count and the measurement of every stage.
+    """
+    recorder = StageRecorder()
+    if path.lower().endswith('.pdf'):
+        with tempfile.TemporaryDirectory(prefix='benchmark-') as folder:
+            with recorder.stage('render'):
+                converter.convert_pdf_to_jpg(path, folder)
+            pages = sorted(glob.glob(os.path.join(folder, '*.jpg')),
+                           key=lambda page: int(page.rsplit('_', 1)[1].split('.')[0]))
+            encoded = [_anonymize_page(text_recognizer.load_image(page), analyzer, recorder)
+                       for page in pages]
+        with recorder.stage('package'):
+            for _ in result_packager.iter_package(iter(encoded), path):
+                pass
+        page_count = len(pages)
+    else:
+        _anonymize_page(text_recognizer.load_image(path), analyzer, recorder)
+        page_count = 1
+    return {'pages': page_count, 'stages': recorder.stages}
+
+
+def _median_runs(runs):
+    stages = {}
+    for name in STAGES:
+        measured = [run['stages'][name] for run in runs if name in run['stages']]
+        if measured:
+            stages[name] = {
+                'wall_s': statistics.median(stage['wall_s'] for stage in measured),
+                'cpu_s': statistics.median(stage['cpu_s'] for stage in measured),
+                'peak_rss_mb': max(stage['peak_rss_mb'] for stage in measured),
+            }
+    return {'pages': runs[0]['pages'], 'stages': stages}
+
+
+def _stage_totals(files):
+    totals = {}
+    for file in files.values():
+        for name, stage in file['stages'].items():
+            total = totals.setdefault(name, {'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': 0.0})
+            total['wall_s'] += stage['wall_s']
+            total['cpu_s'] += stage['cpu_s']
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], stage['peak_rss_mb'])
+    return {name: totals[name] for name in STAGES if name in totals}
+
+
+def run_benchmark(documents, mode='warm', repeat=1):
+    """
+    Benchmark the pipeline on the documents.
+
+    Args:
+        documents (List[str]): Paths to the documents.
+        mode (str): ``cold`` or ``warm``, see the module docstring.
+        repeat (int): Timed passes in warm mode; the median of every stage is reported.
+
+    Returns:
+        dict: Settings, model load measurement, per-file and per-stage results.
+    """
+    ocr_cache.CACHE_ENABLED = False
+    # Время предобработки берётся из замеров модуля metrics
+    metrics.METRICS_ENABLED = True
+    with StageTimer() as model_load:
+        analyzer = analyzer_registry.get_analyzer()
+
+    passes = 1 if mode == 'cold' else repeat
+    if mode == 'warm':
+        for path in documents:
+            benchmark_document(path, analyzer)
+
+    runs = {path: [] for path in documents}
+    for _ in range(passes):
+        for path in documents:
+            runs[path].append(benchmark_document(path, analyzer))
+
+    files = {os.path.basename(path): _median_runs(path_runs) for path, path_runs in runs.items()}
+    return {
+        'mode': mode,
+        'repeat': passes,
+        'ocr_backend': get_ocr_backend().name,
+        'ocr_mode': text_recognizer.OCR_MODE,
+        'ocr_target_text_height': text_recognizer.OCR_TARGET_TEXT_HEIGHT,
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'model_load': model_load.result(),
+        'files': files,
+        'stages': _stage_totals(files),
+    }
+
+
+def _print_stages(stages, baseline=None):
+    for name, stage in stages.items():
+        line = (f"  {name:<16} wall {stage['wall_s']:8.3f}s  cpu {stage['cpu_s']:8.3f}s  "
+                f"peak rss {stage['peak_rss_mb']:8.1f} MB")
+        if baseline and name in baseline and baseline[name]['wall_s']:
+            change = stage['wall_s'] / baseline[name]['wall_s'] - 1
+            line += f'  ({change:+.1%} wall)'
+        print(line)
+
+
+def main():
+    """Run the benchmark and print per-stage and per-file summaries."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('cold', 'warm'), default='warm',
+                        help='cold: fresh process, model load timed; warm: after a warm-up pass')
+    parser.add_argument('--repeat', type=int, default=1, help='timed passes in warm mode')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results of an earlier run to compare the stages with')
+    args = parser.parse_args()
+
+    results = run_benchmark(sample_documents(), args.mode, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+
+    model_load = results['model_load']
+    print(f"{results['mode']} run, OCR {results['ocr_backend']}: "
+          f"model load {model_load['wall_s']:.2f}s, peak rss {model_load['peak_rss_mb']:.1f} MB")
+    _print_stages(results['stages'], baseline and baseline['stages'])
+    for filename, file in results['files'].items():
+        print(f"{filename} ({file['pages']} pages):")
+        baseline_file = baseline and baseline['files'].get(filename)
+        _print_stages(file['stages'], baseline_file and baseline_file['stages'])
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Measure the adaptive OCR resolution against recognition at the original resolution.
+
+Every sample image and every page of the sample PDFs (rendered as in the raster pipeline)
+is recognized ``--repeat`` times at its original resolution (OCR_TARGET_TEXT_HEIGHT=0) and
+with the resolution policy. The report shows the estimated text height, the chosen scale,
+the OCR time of both runs and how well the adaptive run agrees with the original one: the
+F1 score of the recognized words and the share of common words whose boxes, mapped back to
+the original resolution, overlap the original boxes (IoU >= 0.5). The OCR cache is disabled.
+
+Run from the project folder:
+    python -m benchmarks.resolution --repeat 3 --json resolution.json
+    python -m benchmarks.resolution --target 24 --max-upscale 2
+"""
+
+import argparse
+import collections
+import json
+import os
+import statistics
+import time
+
+import format_converter as converter
+import ocr_cache
+import text_recognizer
+import word_matcher
+from benchmarks._common import sample_documents
+
+MIN_BOX_IOU = 0.5
+
+
+def sample_pages():
+    """Yield (name, BGR image) for every sample image and PDF page, sorted by file name."""
+    for path in sample_documents():
+        name = os.path.basename(path)
+        if path.lower().endswith('.pdf'):
+            for page_number in range(1, converter.get_pdf_page_count(path) + 1):
+                yield f'{name}#{page_number}', converter.render_pdf_page_bgr(path, page_number)
+        else:
+            yield name, text_recognizer.load_image(path)
+
+
+def _iou(first, second):
+    x0, y0 = max(first[0], second[0]), max(first[1], second[1])
+    x1, y1 = min(first[2], second[2]), min(first[3], second[3])
+    intersection = max(0, x1 - x0) * max(0, y1 - y0)
+    union = ((first[2] - first[0]) * (first[3] - first[1])
+             + (second[2] - second[0]) * (second[3] - second[1]) - intersection)
+    return intersection / union if union else 0.0
+
+
+def agreement(reference, adaptive):
+    """
+    Compare the words of the adaptive run with the words recognized at the original resolution.
+
+    Args:
+        reference (WordTable): Words of the original resolution run.
+        adaptive (WordTable): Words of the adaptive run, in original coordinates.
+
+    Returns:
+        dict: Word F1 and the share of common words with overlapping boxes.
+    """
+    reference_words = word_matcher.words_from_table(reference)
+    adaptive_words = word_matcher.words_from_table(adaptive)
+    common = sum((collections.Counter(word.text for word in reference_words)
+                  & collections.Counter(word.text for word in adaptive_words)).values())
+    precision = common / len(adaptive_words) if adaptive_words else 1.0
+    recall = common / len(reference_words) if reference_words else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    boxes = collections.defaultdict(list)
+    for word in adaptive_words:
+        boxes[word.text].append(word.box)
+    aligned = 0
+    for word in reference_words:
+        candidates = boxes.get(word.text)
+        if candidates:
+            best = max(candidates, key=lambda box: _iou(box, word.box))
+            if _iou(best, word.box) >= MIN_BOX_IOU:
+                aligned += 1
+                candidates.remove(best)
+    return {'word_f1': f1, 'box_agreement': aligned / common if common else 1.0}
+
+
+def _timed_ocr(image, target, repeat):
+    text_recognizer.OCR_TARGET_TEXT_HEIGHT = target
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        words = text_recognizer.extract_words(image)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), words
+
+
+def measure_page(image, target, repeat):
+    """
+    Recognize one page at the original and at the adaptive resolution.
+
+    Args:
+        image (np.ndarray): The BGR page.
+        target (float): OCR_TARGET_TEXT_HEIGHT of the adaptive run.
+        repeat (int): Timed recognitions per run.
+
+    Returns:
+        dict: Text height, scale, pixel counts, times and agreement of the runs.
+    """
+    text_recognizer.OCR_TARGET_TEXT_HEIGHT = target
+    scale = text_recognizer.ocr_scale(image)
+    original_s, reference = _timed_ocr(image, 0, repeat)
+    adaptive_s, adaptive = _timed_ocr(image, target, repeat)
+    pixels = image.shape[0] * image.shape[1]
+    return {
+        'text_height': text_recognizer.estimate_text_height(image),
+        'scale': scale,
+        'pixels': pixels,
+        'ocr_pixels': round(pixels * scale * scale),
+        'original_s': original_s,
+        'adaptive_s': adaptive_s,
+        **agreement(reference, adaptive),
+    }
+
+
+def main():
+    """Run the measurement and print a summary table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='timed recognitions per run')
+    parser.add_argument('--target', type=float, default=text_recognizer.OCR_TARGET_TEXT_HEIGHT,
+                        help='target text height in pixels')
+    parser.add_argument('--max-upscale', type=float, default=text_recognizer.OCR_MAX_UPSCALE,
+                        help='maximum upscale of small text')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    ocr_cache.CACHE_ENABLED = False
+    text_recognizer.OCR_MAX_UPSCALE = args.max_upscale
+    pages = {name: measure_page(image, args.target, args.repeat) for name, image in sample_pages()}
+    original_s = sum(page['original_s'] for page in pages.values())
+    adaptive_s = sum(page['adaptive_s'] for page in pages.values())
+    results = {
+        'target': args.target,
+        'max_upscale': args.max_upscale,
+        'original_s': original_s,
+        'adaptive_s': adaptive_s,
+        'speedup': original_s / adaptive_s if adaptive_s else None,
+        'word_f1': statistics.mean(page['word_f1'] for page in pages.values()) if pages else None,
+        'pages': pages,
+    }
+
+    print(f"target {args.target:g}px, max upscale {args.max_upscale:g}: "
+          f"original {original_s:.2f}s, adaptive {adaptive_s:.2f}s, "
+          f"speedup {results['speedup'] or 0:.2f}x, mean word F1 {results['word_f1'] or 0:.3f}")
+    for name, page in pages.items():
+        height = page['text_height']
+        print(f"  {name:<14} height {height or 0:5.1f}px  scale {page['scale']:4.2f}  "
+              f"{page['pixels'] / 1e6:5.1f}->{page['ocr_pixels'] / 1e6:5.1f}MP  "
+              f"{page['original_s']:6.2f}s -> {page['adaptive_s']:6.2f}s  "
+              f"F1 {page['word_f1']:.3f}  boxes {page['box_agreement']:.3f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Measure the cold start of a worker and check it against a budget.
+
+Every run starts a fresh interpreter that imports ``app`` the way a gunicorn worker does,
+records the import time and which heavy modules (spaCy, Presidio, NLTK) the import pulled
+in, and with ``--with-model`` also loads the analyzer. The median of the runs is compared
+with the budgets; the exit code is 1 if a budget is exceeded or a heavy module is imported
+eagerly, so the check can run in CI.
+
+Run from the project folder:
+    python -m benchmarks.startup --repeat 5 --max-import-seconds 2
+    python -m benchmarks.startup --with-model --max-model-seconds 30 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('spacy', 'presidio_analyzer', 'nltk')
+IMPORT_BUDGET = float(os.environ.get('STARTUP_IMPORT_BUDGET', '2'))
+
+_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+result = {{'import_s': time.perf_counter() - started,
+          'heavy_modules': [name for name in {heavy!r} if name in sys.modules]}}
+if {with_model!r}:
+    import analyzer_registry
+    started = time.perf_counter()
+    analyzer_registry.warm_up()
+    result['model_s'] = time.perf_counter() - started
+print(json.dumps(result))
+'''
+
+
+def measure_once(with_model=False):
+    """
+    Start a fresh interpreter, import the application and report the timings.
+
+    Args:
+        with_model (bool): Also load the analyzer after the import.
+
+    Returns:
+        dict: Process wall time, import time, eagerly imported heavy modules and, with
+        with_model, the model load time.
+    """
+    probe = _PROBE.format(heavy=HEAVY_MODULES, with_model=with_model)
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', probe], check=True, capture_output=True,
+                            text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_s'] = time.perf_counter() - started
+    return result
+
+
+def main():
+    """Run the measurement, print the medians and exit with 1 if a budget is exceeded."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='number of fresh interpreters')
+    parser.add_argument('--with-model', action='store_true', help='also load the analyzer')
+    parser.add_argument('--max-import-seconds', type=float, default=IMPORT_BUDGET,
+                        help='budget for the median import time of app')
+    parser.add_argument('--max-model-seconds', type=float, help='budget for the median model load')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    runs = [measure_once(args.with_model) for _ in range(args.repeat)]
+    results = {
+        'runs': runs,
+        'import_s': statistics.median(run['import_s'] for run in runs),
+        'process_s': statistics.median(run['process_s'] for run in runs),
+        'heavy_modules': sorted({name for run in runs for name in run['heavy_modules']}),
+    }
+    if args.with_model:
+        results['model_s'] = statistics.median(run['model_s'] for run in runs)
+
+    print(f"import app: {results['import_s']:.2f}s (process {results['process_s']:.2f}s), "
+          f"budget {args.max_import_seconds:.2f}s")
+    if args.with_model:
+        print(f"model load: {results['model_s']:.2f}s")
+
+    failures = []
+    if results['import_s'] > args.max_import_seconds:
+        failures.append(f"import time {results['import_s']:.2f}s exceeds {args.max_import_seconds:.2f}s")
+    if results['heavy_modules']:
+        failures.append(f"imported eagerly: {', '.join(results['heavy_modules'])}")
+    if args.with_model and args.max_model_seconds and results['model_s'] > args.max_model_seconds:
+        failures.append(f"model load {results['model_s']:.2f}s exceeds {args.max_model_seconds:.2f}s")
+    results['failures'] = failures
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
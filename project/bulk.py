@@ -0,0 +1,487 @@
+"""Bulk anonymization for regression sweeps and backfills.
+
+Documents are spread over a process pool in groups of at most DETECTION_BATCH_DOCUMENTS
+(smaller when there are too few documents to keep every process busy); every pool process
+loads its own analyzer once in the pool initializer, recognizes the documents of a group and
+finds their personal data with one batched NER pass, then redacts them one by one. Results
+keep the relative paths of their inputs inside the output folder, and ``manifest.json`` next
+to them lists the outcome of every document and the throughput of the run. A document that
+fails is recorded in the manifest and the run goes on.
+
+Runs submitted over HTTP share one pool per gunicorn worker; a worker accepts at most
+BULK_QUEUE_SIZE unfinished runs and rejects the rest with QueueFullError. Their uploads and
+unpacked archives live in a storage.Scratch folder with a quota of BULK_MAX_BYTES, and an
+archive may hold at most BULK_MAX_FILES documents.
+
+Run from the project folder (directories are walked, zip archives are unpacked):
+    python bulk.py uploads/ scans.zip --output bulk/sweep --workers 8
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import analyzer_registry
+import document_processor
+import format_converter as converter
+import storage
+
+BULK_FOLDER = 'bulk/'
+BULK_WORKERS = int(os.environ.get('BULK_WORKERS', str(os.cpu_count() or 1)))
+BULK_QUEUE_SIZE = int(os.environ.get('BULK_QUEUE_SIZE', '2'))
+BULK_MAX_FILES = int(os.environ.get('BULK_MAX_FILES', '1000'))
+BULK_MAX_BYTES = int(os.environ.get('BULK_MAX_BYTES', str(2**30)))
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.pdf', '.docx')
+MANIFEST_NAME = 'manifest.json'
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_BULK_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+
+
+class QueueFullError(Exception):
+    """Raised when this worker already runs BULK_QUEUE_SIZE bulk runs."""
+
+
+def _get_executor():
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=BULK_WORKERS, initializer=_init_worker)
+        return _executor
+
+
+def _reset_executor(broken):
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        # Пул мог быть уже заменён другим запуском, который заметил сбой раньше
+        if _executor is broken:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def is_supported(name):
+    """Return True if the file can be anonymized."""
+    return name.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def extract_archive(archive_path, folder, scratch=None, max_files=None):
+    """
+    Unpack the supported documents of a zip archive.
+
+    Args:
+        archive_path (str): Path to the zip archive.
+        folder (str): Folder to unpack into.
+        scratch (storage.Scratch): Scratch folder whose quotas the unpacked bytes count
+            against; no limit if omitted.
+        max_files (int): Maximum number of documents in the archive; no limit if omitted.
+
+    Returns:
+        List[Tuple[str, str]]: Paths of the unpacked files and their names inside the archive.
+
+    Raises:
+        storage.QuotaExceededError: If the archive holds too many documents or unpacks to
+            more than the quotas of the scratch folder.
+    """
+    files = []
+    with zipfile.ZipFile(archive_path) as archive:
+        members = []
+        for member in archive.infolist():
+            name = os.path.normpath(member.filename)
+            # Пропускаем каталоги и пути, выходящие за пределы папки распаковки
+            if member.is_dir() or os.path.isabs(name) or name.startswith('..') or not is_supported(name):
+                continue
+            members.append((member, name))
+        if max_files is not None and len(members) > max_files:
+            raise storage.QuotaExceededError(
+                f'Archive holds {len(members)} documents, at most {max_files} are accepted')
+        if scratch is not None:
+            # Заявленные размеры отсекают архив заранее, но им нельзя верить: при распаковке
+            # квота считается по фактически записанным байтам
+            declared = sum(member.file_size for member, _ in members)
+            scratch.check_quota(declared)
+            scratch.check_shared_quota(declared)
+
+        for member, name in members:
+            path = os.path.join(folder, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with archive.open(member) as source, open(path, 'wb') as target:
+                for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                    if scratch is not None:
+                        scratch.reserve(len(chunk))
+                    target.write(chunk)
+            files.append((path, name))
+    return files
+
+
+def collect_files(paths, scratch_folder=None):
+    """
+    Expand directories and zip archives into the list of documents to process.
+
+    Args:
+        paths (Iterable[str]): Files, directories and zip archives.
+        scratch_folder (str): Folder to unpack archives into; required if there are any.
+
+    Returns:
+        List[Tuple[str, str]]: Document paths and their names relative to the input.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    if is_supported(filename):
+                        file_path = os.path.join(root, filename)
+                        files.append((file_path, os.path.relpath(file_path, path)))
+        elif path.lower().endswith('.zip'):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            files.extend((file_path, os.path.join(stem, name)) for file_path, name
+                         in extract_archive(path, os.path.join(scratch_folder, stem)))
+        elif is_supported(path):
+            files.append((path, os.path.basename(path)))
+    return sorted(files, key=lambda file: file[1])
+
+
+def _init_worker():
+    analyzer_registry.warm_up()
+
+
+def _new_record(name):
+    return {'file': name, 'status': 'ok', 'result': None, 'pages': None, 'error': None,
+            'seconds': 0.0}
+
+
+def _fail(record, error):
+    record.update(status='failed', error=f'{type(error).__name__}: {error}')
+
+
+def process_group(group, output_folder):
+    """
+    Anonymize a group of documents, finding their personal data with one batched NER pass
+    (document_processor.find_content_to_anonymize_batch); executed in a pool process.
+
+    Args:
+        group (List[Tuple[str, str]]): Document paths and names relative to the input; the
+            results keep their folders.
+        output_folder (str): Folder of the run.
+
+    Returns:
+        List[dict]: The manifest records of the documents.
+    """
+    records = []
+    recognized = []
+    for file_path, name in group:
+        started = time.perf_counter()
+        record = _new_record(name)
+        try:
+            record['pages'] = (converter.get_pdf_page_count(file_path)
+                               if file_path.lower().endswith('.pdf') else 1)
+            recognized.append((record, file_path, document_processor.recognize_document(file_path)))
+        except Exception as e:  # pylint: disable=broad-except
+            _fail(record, e)
+        record['seconds'] = time.perf_counter() - started
+        records.append(record)
+
+    started = time.perf_counter()
+    try:
+        contents = document_processor.find_content_to_anonymize_batch(
+            [file_path for _, file_path, _ in recognized],
+            [ocr_result for _, _, ocr_result in recognized])
+    except Exception:  # pylint: disable=broad-except
+        # Один неудачный документ не должен провалить группу: данные ищутся по отдельности
+        contents = [None] * len(recognized)
+    detection_share = (time.perf_counter() - started) / max(len(recognized), 1)
+
+    for (record, file_path, ocr_result), content_to_anonymize in zip(recognized, contents):
+        started = time.perf_counter()
+        try:
+            result_folder = os.path.join(output_folder, os.path.dirname(record['file']))
+            os.makedirs(result_folder, exist_ok=True)
+            result_path = document_processor.process_and_anonymize_file(
+                file_path, os.path.basename(record['file']), result_folder,
+                ocr_result=ocr_result, content_to_anonymize=content_to_anonymize)
+            record['result'] = os.path.relpath(result_path, output_folder)
+        except Exception as e:  # pylint: disable=broad-except
+            _fail(record, e)
+        record['seconds'] += detection_share + time.perf_counter() - started
+    return records
+
+
+def group_size(documents, workers):
+    """Return how many documents go into one group: at most DETECTION_BATCH_DOCUMENTS, but
+    few enough that every pool process gets a group."""
+    per_worker = -(-documents // max(workers, 1))
+    return max(1, min(document_processor.DETECTION_BATCH_DOCUMENTS, per_worker))
+
+
+def _summary(records, seconds, workers):
+    done = [record for record in records if record['status'] == 'ok']
+    pages = sum(record['pages'] or 0 for record in done)
+    return {
+        'documents': len(records),
+        'failed': len(records) - len(done),
+        'pages': pages,
+        'workers': workers,
+        'seconds': seconds,
+        'docs_per_second': len(done) / seconds if seconds else None,
+        'pages_per_second': pages / seconds if seconds else None,
+    }
+
+
+def write_manifest(output_folder, manifest):
+    """Atomically replace the manifest of a run."""
+    fd, temp_path = tempfile.mkstemp(dir=output_folder, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    os.replace(temp_path, os.path.join(output_folder, MANIFEST_NAME))
+
+
+def run(files, output_folder, workers=BULK_WORKERS, manifest=None, executor=None, progress=None):
+    """
+    Anonymize documents in parallel, updating the manifest after every group of documents.
+
+    Args:
+        files (List[Tuple[str, str]]): Document paths and names, see collect_files.
+        output_folder (str): Folder for the results and the manifest.
+        workers (int): Number of pool processes.
+        manifest (dict): Extra fields to keep in the manifest, e.g. the run id.
+        executor (ProcessPoolExecutor): Pool to run on, with _init_worker as its initializer
+            and ``workers`` processes; a pool of its own is started for the run if omitted.
+        progress (Callable[[], None]): Called after every group of documents.
+
+    Returns:
+        dict: The final manifest.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = dict(manifest or {}, state=RUNNING, files=[])
+    started = time.perf_counter()
+    write_manifest(output_folder, dict(manifest, summary=_summary([], 0, workers)))
+
+    size = group_size(len(files), workers)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    try:
+        futures = {executor.submit(process_group, files[start:start + size], output_folder):
+                   files[start:start + size] for start in range(0, len(files), size)}
+        for future in as_completed(futures):
+            try:
+                records = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                # Процесс пула упал (например, из-за нехватки памяти): документы группы считаем проваленными
+                if isinstance(e, BrokenProcessPool):
+                    _reset_executor(executor)
+                records = []
+                for _, name in futures[future]:
+                    records.append(dict(_new_record(name), seconds=None))
+                    _fail(records[-1], e)
+            manifest['files'].extend(records)
+            manifest['summary'] = _summary(manifest['files'], time.perf_counter() - started, workers)
+            write_manifest(output_folder, manifest)
+            if progress is not None:
+                progress()
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    manifest['files'].sort(key=lambda record: record['file'])
+    manifest.update(state=DONE, summary=_summary(
+        manifest['files'], time.perf_counter() - started, workers))
+    write_manifest(output_folder, manifest)
+    return manifest
+
+
+def is_bulk_id(value):
+    """Return True if the value looks like a bulk run id."""
+    return bool(_BULK_ID_PATTERN.match(value))
+
+
+def output_folder(bulk_id):
+    """Return the absolute path to the results of a bulk run."""
+    return os.path.abspath(os.path.join(BULK_FOLDER, bulk_id, 'output'))
+
+
+def get_manifest(bulk_id):
+    """
+    Read the manifest of a bulk run.
+
+    Args:
+        bulk_id (str): The id returned by submit.
+
+    Returns:
+        Optional[dict]: The manifest, or None if there is no such run.
+    """
+    if not is_bulk_id(bulk_id):
+        return None
+    return _read_manifest(output_folder(bulk_id))
+
+
+def _read_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def _acquire():
+    global _pending  # pylint: disable=global-statement
+    with _executor_lock:
+        if _pending >= BULK_QUEUE_SIZE:
+            raise QueueFullError(f'Bulk queue is full ({BULK_QUEUE_SIZE} runs)')
+        _pending += 1
+
+
+def _release():
+    global _pending  # pylint: disable=global-statement
+    with _executor_lock:
+        _pending -= 1
+
+
+def pending_count():
+    """Return the number of unfinished bulk runs accepted by this worker."""
+    return _pending
+
+
+def submit(file_storages, expected_size=None):
+    """
+    Store uploaded documents or zip archives and process them in the background.
+
+    Args:
+        file_storages (List[werkzeug.datastructures.FileStorage]): The uploaded files.
+        expected_size (int): Size announced by the client (the request content length),
+            checked against the scratch quotas before anything is written.
+
+    Returns:
+        dict: The initial manifest.
+
+    Raises:
+        QueueFullError: If this worker already has BULK_QUEUE_SIZE unfinished runs.
+        storage.QuotaExceededError: If the uploads or the unpacked archives exceed
+            BULK_MAX_BYTES or the shared scratch quota, or an archive holds more than
+            BULK_MAX_FILES documents.
+    """
+    _acquire()
+    scratch = None
+    try:
+        scratch = storage.Scratch(max_bytes=BULK_MAX_BYTES, prefix='bulk-')
+        scratch.check_quota(expected_size or 0)
+        scratch.check_shared_quota(expected_size or 0)
+        paths = []
+        for i, file_storage in enumerate(file_storages):
+            # Имя файла пользователя не используется в пути: оно может содержать каталоги
+            extension = os.path.splitext(file_storage.filename)[1].lower()
+            paths.append((scratch.save(file_storage, f'{i}{extension}'),
+                          os.path.basename(file_storage.filename)))
+
+        files = []
+        for path, filename in paths:
+            if path.endswith('.zip'):
+                stem = os.path.splitext(filename)[0]
+                files.extend((file_path, os.path.join(stem, name)) for file_path, name
+                             in extract_archive(path, os.path.splitext(path)[0], scratch,
+                                                BULK_MAX_FILES - len(files)))
+            elif is_supported(path):
+                files.append((path, filename))
+        if len(files) > BULK_MAX_FILES:
+            raise storage.QuotaExceededError(f'At most {BULK_MAX_FILES} documents are accepted')
+        return _start(files, scratch)
+    except BaseException:
+        if scratch is not None:
+            scratch.close()
+        _release()
+        raise
+
+
+def start(files):
+    """
+    Process documents that are already on disk (e.g. the samples in ``uploads/``) in the
+    background, like submit; the documents are kept.
+
+    Args:
+        files (List[Tuple[str, str]]): Document paths and names, see collect_files.
+
+    Returns:
+        dict: The initial manifest.
+
+    Raises:
+        QueueFullError: If this worker already has BULK_QUEUE_SIZE unfinished runs.
+    """
+    _acquire()
+    try:
+        return _start(files, None)
+    except BaseException:
+        _release()
+        raise
+
+
+def _start(files, scratch):
+    bulk_id = uuid.uuid4().hex
+    manifest = {'id': bulk_id, 'state': RUNNING, 'files': [],
+                'summary': _summary([], 0, BULK_WORKERS)}
+    os.makedirs(output_folder(bulk_id))
+    write_manifest(output_folder(bulk_id), manifest)
+    threading.Thread(target=_run_and_clean, args=(files, output_folder(bulk_id), scratch),
+                     kwargs={'manifest': {'id': bulk_id}}, name=f'bulk-{bulk_id}', daemon=True).start()
+    return manifest
+
+
+def _run_and_clean(files, output, scratch, manifest):
+    executor = None
+    try:
+        executor = _get_executor()
+        # Отметка времени на папке после каждой группы не даёт уборщику принять её за брошенную
+        run(files, output, manifest=manifest, executor=executor,
+            progress=scratch.touch if scratch is not None else None)
+    except Exception as e:  # pylint: disable=broad-except
+        if isinstance(e, BrokenProcessPool):
+            _reset_executor(executor)
+        manifest = dict(_read_manifest(output) or dict(manifest, files=[]))
+        manifest.update(state=FAILED, error=f'{type(e).__name__}: {e}')
+        write_manifest(output, manifest)
+    finally:
+        # Загруженные документы и распакованные архивы не хранятся после обработки
+        if scratch is not None:
+            scratch.close()
+        _release()
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Anonymize many documents in parallel.')
+    parser.add_argument('paths', nargs='+', help='files, directories or zip archives')
+    parser.add_argument('--output', default=None, help='results folder (default: bulk/<timestamp>)')
+    parser.add_argument('--workers', type=int, default=BULK_WORKERS, help='pool processes')
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.join(BULK_FOLDER, time.strftime('%Y%m%d-%H%M%S'))
+    with tempfile.TemporaryDirectory(prefix='bulk-') as scratch_folder:
+        files = collect_files(args.paths, scratch_folder)
+        manifest = run(files, output, args.workers)
+    summary = manifest['summary']
+    print(f"{summary['documents']} documents, {summary['failed']} failed, {summary['pages']} pages "
+          f"in {summary['seconds']:.1f} s: {summary['docs_per_second'] or 0:.2f} docs/s, "
+          f"{summary['pages_per_second'] or 0:.2f} pages/s")
+    for record in manifest['files']:
+        if record['status'] != 'ok':
+            print(f"failed: {record['file']}: {record['error']}")
+    print(f'manifest: {os.path.join(output, MANIFEST_NAME)}')
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
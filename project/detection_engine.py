@@ -0,0 +1,202 @@
+"""Compiled matchers for the regex patterns and context clues of personal_data_recognizer.
+
+The regex patterns are compiled once. A line is first searched with all of them joined into
+one alternation; most lines match none and are scanned only once. Lines with a match are
+scanned by every pattern on its own from the first match, so patterns that match
+overlapping text each report their match, as separate ``re.findall`` calls do. Context clues are found with an
+Aho-Corasick automaton in a single pass over the line; their positions are kept sorted per
+entity type, so checking whether a clue is within CLUE_DISTANCE characters of an entity
+takes a binary search instead of compiling two regexes per (clue, entity) pair.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+CLUE_DISTANCE = 50
+
+
+class PatternSet:
+    """Named regex patterns searched together, each reporting its own matches."""
+
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns (Dict[str, str]): Regex patterns by name.
+        """
+        self.patterns = {name: re.compile(pattern) for name, pattern in patterns.items()}
+        self._any = re.compile('|'.join(f'(?:{pattern})' for pattern in patterns.values()))
+
+    def finditer(self, text):
+        """
+        Find the matches of every pattern, pattern by pattern in the order of the patterns.
+
+        Args:
+            text (str): The text to search.
+
+        Yields:
+            Tuple[str, re.Match]: Pattern name and match; matches of different patterns may
+            overlap.
+        """
+        first = self._any.search(text)
+        if first is None:
+            return
+        # Совпадение любого шаблона не может начаться раньше первого совпадения их объединения;
+        # границы слов \b у позиции начала поиска проверяются по всему тексту
+        for name, pattern in self.patterns.items():
+            for match in pattern.finditer(text, first.start()):
+                yield name, match
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher that finds all (overlapping) occurrences in one pass."""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for index, pattern in enumerate(self.patterns):
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[node][char] = next_node
+                node = next_node
+            self._output[node].append(index)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail_target = self._goto[fail].get(char, 0)
+                self._fail[next_node] = fail_target if fail_target != next_node else 0
+                self._output[next_node] = self._output[next_node] + self._output[self._fail[next_node]]
+
+    def finditer(self, text):
+        """
+        Find every occurrence of every pattern.
+
+        Args:
+            text (str): The text to search.
+
+        Yields:
+            Tuple[int, int, int]: Start, end and pattern index of each occurrence.
+        """
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for index in self._output[node]:
+                yield position + 1 - len(self.patterns[index]), position + 1, index
+
+
+class LineClues:
+    """Positions of the context clues found in one line, sorted per entity type."""
+
+    def __init__(self, text, starts, ends):
+        self.text = text
+        self._starts = starts
+        self._ends = ends
+
+    def has(self, entity_type):
+        """Return True if the line contains any clue of the entity type."""
+        return bool(self._starts.get(entity_type))
+
+    def has_any(self):
+        """Return True if the line contains a clue of any entity type."""
+        return bool(self._starts)
+
+    def near(self, entity_type, element, distance=CLUE_DISTANCE):
+        """
+        Check whether a clue of the entity type ends at most ``distance`` characters before an
+        occurrence of the element or starts at most ``distance`` characters after it.
+
+        Args:
+            entity_type (str): The entity type whose clues are checked.
+            element (str): The entity text.
+            distance (int): Maximum number of characters between the clue and the element.
+
+        Returns:
+            bool: True if such a clue exists.
+        """
+        starts = self._starts.get(entity_type)
+        element = element.lower()
+        if not starts or not element:
+            return False
+        ends = self._ends[entity_type]
+        position = self.text.find(element)
+        while position != -1:
+            element_end = position + len(element)
+            before = bisect_right(ends, position)
+            if before and position - ends[before - 1] <= distance:
+                return True
+            after = bisect_left(starts, element_end)
+            if after < len(starts) and starts[after] - element_end <= distance:
+                return True
+            position = self.text.find(element, position + 1)
+        return False
+
+
+class ClueMatcher:
+    """Finds the context clues of all entity types in a line with one automaton."""
+
+    def __init__(self, clues_by_type):
+        patterns = []
+        self._pattern_types = []
+        for entity_type, clues in clues_by_type.items():
+            for clue in dict.fromkeys(clue.lower() for clue in clues):
+                patterns.append(clue)
+                self._pattern_types.append(entity_type)
+        self._automaton = AhoCorasick(patterns)
+
+    def index(self, line):
+        """
+        Find all clues in a line.
+
+        Args:
+            line (str): The line to index.
+
+        Returns:
+            LineClues: Sorted clue positions per entity type.
+        """
+        text = line.lower()
+        starts = {}
+        ends = {}
+        for start, end, index in self._automaton.finditer(text):
+            entity_type = self._pattern_types[index]
+            starts.setdefault(entity_type, []).append(start)
+            ends.setdefault(entity_type, []).append(end)
+        for entity_type in starts:
+            starts[entity_type].sort()
+        return LineClues(text, starts, ends)
+
+    def contains_clue(self, entity_type, element):
+        """Return True if the element itself contains a clue of the entity type."""
+        return self.index(element).has(entity_type)
+
+    def is_contextualized(self, entity_type, element, line_clues, prev_line_clues):
+        """
+        Decide whether an entity found in a line is supported by its context.
+
+        Args:
+            entity_type (str): The entity type.
+            element (str): The entity text.
+            line_clues (LineClues): Clues of the line with the entity.
+            prev_line_clues (LineClues): Clues of the previous line.
+
+        Returns:
+            bool: True if a clue is near the entity, inside it or in the previous line.
+        """
+        return (line_clues.near(entity_type, element)
+                or self.contains_clue(entity_type, element)
+                or prev_line_clues.has(entity_type))
@@ -0,0 +1,285 @@
+""" Document anonymization pipeline shared by the web application and the job workers. """
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+import cv2
+import fitz  # PyMuPDF
+
+import analyzer_registry
+import docx_redactor
+import format_converter as converter
+import image_anonymizer
+import metrics
+import ocr_cache
+import pdf_pipeline
+import pdf_redactor
+import personal_data_recognizer
+import result_packager
+import text_recognizer
+
+# Directory setup for the sample documents (test_all) and anonymized results; uploads of
+# single files go to the scratch folder of the request (see storage)
+UPLOAD_FOLDER = 'uploads/'
+ANONYMIZED_FOLDER = 'anonymized/'
+
+# Сколько документов пакетной обработки (bulk) отправляется в NER одним пакетом
+DETECTION_BATCH_DOCUMENTS = int(os.environ.get('DETECTION_BATCH_DOCUMENTS', '16'))
+
+# Create directories if they do not exist
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(ANONYMIZED_FOLDER, exist_ok=True)
+
+
+def _no_progress(stage, done=None, total=None):
+    """Default progress callback that ignores the reports."""
+
+
+def recognize_text(image_path):
+    """ Extracts text from given image.
+
+    Args:
+        image_path (str): The path to the image file.
+
+    Returns:
+        str: The extracted text from the image.
+    """
+    text = text_recognizer.extract_text_from_image(image_path, lang='rus')
+    return text
+
+
+def find_content_to_anonymize(file_path, ocr_result=None):
+    """ Extracts personal data from document.
+
+    Args:
+        file_path (str): The path to the file (PDF or image).
+        ocr_result (text_recognizer.OcrResult | pdf_redactor.PdfText): Text already recognized
+            for the file. The file is read again only if it is missing.
+
+    Returns:
+        list: A list of anonymized strings found in the document.
+    """
+    return find_content_to_anonymize_batch([file_path], [ocr_result])[0]
+
+
+@metrics.timed('find_content_to_anonymize')
+def find_content_to_anonymize_batch(file_paths, ocr_results=None):
+    """ Extracts personal data from several documents with one batched NER pass.
+
+    Args:
+        file_paths (List[str]): The paths to the files (PDF or image).
+        ocr_results (List[text_recognizer.OcrResult | pdf_redactor.PdfText]): Text already
+            recognized for each file, or None items for files that have to be read.
+
+    Returns:
+        List[set]: Strings to anonymize, one set per document.
+    """
+    ocr_results = ocr_results or [None] * len(file_paths)
+    cache = ocr_cache.get_cache()
+    cache_keys = [None] * len(file_paths)
+    found = [None] * len(file_paths)
+    if cache is not None:
+        for i, file_path in enumerate(file_paths):
+            cache_keys[i] = _personal_data_cache_key(file_path)
+            cached = cache.get(cache_keys[i])
+            if cached is not None:
+                found[i] = set(cached)
+
+    missing = [i for i, personal_data in enumerate(found) if personal_data is None]
+    if not missing:
+        return found
+
+    analyzer = analyzer_registry.get_analyzer()
+    texts = [_document_text(file_paths[i], ocr_results[i]) for i in missing]
+    for i, personal_data in zip(
+            missing, personal_data_recognizer.find_personal_data_batch(texts, analyzer)):
+        found[i] = personal_data
+        metrics.observe(metrics.DETECTED_ENTITIES, len(personal_data))
+        if cache is not None:
+            cache.put(cache_keys[i], sorted(personal_data))
+    return found
+
+
+def _personal_data_cache_key(file_path):
+    return ocr_cache.make_key(
+        ocr_cache.file_digest(file_path), 'personal_data_phrases', analyzer_registry.model_name(),
+        personal_data_recognizer.DETECTION_MODE,
+        *text_recognizer.ocr_settings('rus'),
+        pdf_redactor.PDF_REDACTION_MODE if file_path.lower().endswith('.pdf') else None)
+
+
+def _document_text(file_path, ocr_result):
+    text = ""
+    if ocr_result is not None:
+        text = ocr_result.text
+    elif is_docx(file_path):
+        text = docx_redactor.document_text(file_path)
+    elif file_path.lower().endswith('.pdf'):
+        doc = fitz.open(file_path)
+        for page in doc:
+            text += page.get_text()
+    else:
+        text = text_recognizer.extract_text_from_image(file_path, lang='rus')
+    return text
+
+
+def recognize_document(file_path, image=None):
+    """ Recognizes the text of a document the way process_and_anonymize_file needs it.
+
+    Args:
+        file_path (str): The path to the file (PDF or image).
+        image (np.ndarray): The image already loaded from an image file.
+
+    Returns:
+        text_recognizer.OcrResult | pdf_redactor.PdfText | None: The OCR result for an image,
+        the text layer for a PDF in native mode, None for a PDF in raster mode and for DOCX.
+    """
+    if is_docx(file_path):
+        return None
+    if not file_path.lower().endswith('.pdf'):
+        return text_recognizer.recognize_image(
+            image if image is not None else file_path, lang='rus')
+    if pdf_redactor.PDF_REDACTION_MODE == 'native':
+        return pdf_redactor.extract_text(file_path)
+    return None
+
+
+def is_docx(filename):
+    """ Returns True if the file is a DOCX document, redacted natively into a DOCX. """
+    return filename.lower().endswith('.docx')
+
+def is_raster_pdf(filename):
+    """ Returns True if the PDF is anonymized page by page as images (not in native mode). """
+    return filename.lower().endswith('.pdf') and pdf_redactor.PDF_REDACTION_MODE != 'native'
+
+def raster_result_name(filename):
+    """ Returns the name of the packaged result of a raster PDF, e.g. ``doc.zip``. """
+    return os.path.splitext(filename)[0] + result_packager.extension()
+
+@metrics.timed('process_and_anonymize_file')
+def process_and_anonymize_file(file_path, filename, output_folder=ANONYMIZED_FOLDER, progress=None,
+                               ocr_result=None, content_to_anonymize=None):
+    """Process and anonymize a single file.
+
+    Args:
+        file_path (str): The path to the uploaded file.
+        filename (str): The original file name; the result is named after it.
+        output_folder (str): The folder to write the result to.
+        progress (Callable): Called as progress(stage, done=None, total=None) when a stage
+            starts or advances.
+        ocr_result: Result of recognize_document if it was already made for the file.
+        content_to_anonymize (set): Personal data if it was already found for the file.
+
+    Returns:
+        str: The path to the anonymized file (an image, a PDF, a DOCX or the packaged pages
+        of a PDF).
+    """
+    progress = progress or _no_progress
+    anonymized_path = os.path.join(output_folder, filename)
+    if is_docx(file_path):
+        # Текст DOCX проверяется по частям прямо при закрашивании, OCR — только для картинок
+        with _atomic_output(anonymized_path) as temp_path:
+            docx_redactor.redact_docx(file_path, temp_path, content_to_anonymize, progress)
+    elif file_path.lower().endswith('.pdf') and pdf_redactor.PDF_REDACTION_MODE == 'native':
+        with _atomic_output(anonymized_path) as temp_path:
+            process_pdf_native(file_path, temp_path, progress, ocr_result, content_to_anonymize)
+    elif file_path.lower().endswith('.pdf'):
+        progress('detect')
+        if content_to_anonymize is None:
+            content_to_anonymize = find_content_to_anonymize(file_path)
+        anonymized_path = process_pdf(
+            file_path, content_to_anonymize,
+            os.path.join(output_folder, raster_result_name(filename)), progress)
+    else:
+        # Один проход OCR: текст для поиска данных и координаты слов для закрашивания.
+        # Изображение читается с диска один раз и дальше передаётся между этапами в памяти.
+        image = text_recognizer.load_image(file_path)
+        progress('ocr')
+        if ocr_result is None:
+            ocr_result = text_recognizer.recognize_image(image, lang='rus')
+        progress('detect')
+        if content_to_anonymize is None:
+            content_to_anonymize = find_content_to_anonymize(file_path, ocr_result)
+        progress('redact')
+        image = image_anonymizer.anonymize_image(image, content_to_anonymize, ocr_result.words)
+        with _atomic_output(anonymized_path) as temp_path:
+            if not cv2.imwrite(temp_path, image):
+                raise OSError(f'Could not write {anonymized_path}')
+
+    return anonymized_path
+
+
+@contextmanager
+def _atomic_output(path):
+    """ Yields a temporary path in the folder of ``path`` that replaces ``path`` when the block
+    succeeds and is removed when it fails, so a failed run never leaves a truncated result. """
+    folder, name = os.path.split(path)
+    # Расширение сохраняется: по нему cv2.imwrite выбирает формат
+    fd, temp_path = tempfile.mkstemp(dir=folder or '.', prefix=f'.{name}.',
+                                     suffix=os.path.splitext(name)[1])
+    os.close(fd)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def iter_pdf_result(file_path, content_to_anonymize, progress=None):
+    """ Anonymizes PDF file page by page and packages the pages as they are produced.
+
+    Args:
+        file_path (str): The path to the PDF file.
+        content_to_anonymize (set): Personal data to cover.
+        progress (Callable): Progress callback, reports the redacted pages.
+
+    Returns:
+        Iterator[bytes]: Consecutive chunks of the result (see result_packager).
+    """
+    progress = progress or _no_progress
+    page_count = converter.get_pdf_page_count(file_path)
+    metrics.observe(metrics.DOCUMENT_PAGES, page_count)
+
+    def encoded_pages(pages):
+        for page_number, encoded in pages:
+            progress('redact', page_number, page_count)
+            yield encoded
+
+    progress('redact', 0, page_count)
+    pages = pdf_pipeline.iter_anonymized_pages(file_path, content_to_anonymize)
+    return result_packager.iter_package(encoded_pages(pages), file_path)
+
+def stream_anonymized_pdf(file_path):
+    """ Finds personal data in a raster PDF and returns its result as a stream of chunks,
+    without writing it to disk. Detection runs before the first chunk is requested. """
+    content_to_anonymize = find_content_to_anonymize(file_path)
+    return iter_pdf_result(file_path, content_to_anonymize)
+
+@metrics.timed('process_pdf')
+def process_pdf(file_path, content_to_anonymize, output_path, progress=None):
+    """Process PDF file page by page and write the packaged pages to output_path; nothing is
+    left at output_path if a page fails."""
+    with _atomic_output(output_path) as temp_path, open(temp_path, 'wb') as file:
+        for chunk in iter_pdf_result(file_path, content_to_anonymize, progress):
+            file.write(chunk)
+    return output_path
+
+@metrics.timed('process_pdf_native')
+def process_pdf_native(file_path, anonymized_path, progress=None, pdf_text=None,
+                       content_to_anonymize=None):
+    """Redact PDF file through its text layer, running OCR only on scanned pages."""
+    progress = progress or _no_progress
+
+    progress('ocr')
+    if pdf_text is None:
+        pdf_text = pdf_redactor.extract_text(file_path)
+    progress('detect')
+    if content_to_anonymize is None:
+        content_to_anonymize = find_content_to_anonymize(file_path, pdf_text)
+    progress('redact')
+    return pdf_redactor.redact_pdf(file_path, content_to_anonymize, anonymized_path, pdf_text)
@@ -0,0 +1,426 @@
+"""Native DOCX redaction through the WordprocessingML text.
+
+python-docx loads the whole package, so memory grows with the size of the document; what
+stays bounded is the text sent to personal_data_recognizer.find_personal_data at once, which
+gets the paragraphs of the body (including tables, nested tables and text boxes), headers,
+footers, footnotes, endnotes and comments in chunks of DOCX_CHUNK_PARAGRAPHS paragraphs.
+Every paragraph is read in three layers that are checked and masked separately: the visible
+text, the text of tracked deletions (``w:delText``) and the field codes (``w:instrText``,
+``w:fldSimple``, e.g. ``HYPERLINK "mailto:..."``); the targets of external hyperlinks are
+handled the same way. The found phrases are matched to the words of each layer by word_matcher
+and masked in place inside the XML elements: run formatting, pictures and everything else in
+the document are kept, and the result is a ``.docx`` again. OCR runs only on the embedded
+raster images, which are redacted like uploaded images and written back into the package.
+
+The metadata that names people is blanked: the core properties (author, last modified by,
+title and the like), the company and manager in the application properties, the custom
+properties, the authors of tracked changes and comments, and the thumbnail of the first page
+is dropped.
+"""
+
+import os
+import re
+from typing import Iterator, List, NamedTuple, Pattern, Set, Tuple
+
+import cv2
+import docx
+import numpy as np
+from docx.opc.constants import CONTENT_TYPE, RELATIONSHIP_TYPE
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from docx.parts.image import ImagePart
+from lxml import etree
+
+import analyzer_registry
+import image_anonymizer
+import metrics
+import personal_data_recognizer
+import text_recognizer
+import word_matcher
+
+DOCX_CHUNK_PARAGRAPHS = int(os.environ.get('DOCX_CHUNK_PARAGRAPHS', '200'))
+MASK_CHAR = '█'
+
+_TEXT_PARTS = {CONTENT_TYPE.WML_DOCUMENT_MAIN, CONTENT_TYPE.WML_HEADER, CONTENT_TYPE.WML_FOOTER,
+               CONTENT_TYPE.WML_FOOTNOTES, CONTENT_TYPE.WML_ENDNOTES, CONTENT_TYPE.WML_COMMENTS}
+_PEOPLE_PART = 'application/vnd.openxmlformats-officedocument.wordprocessingml.people+xml'
+_IMAGE_EXTENSIONS = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/bmp': '.bmp',
+                     'image/tiff': '.tiff'}
+_CORE_PROPERTIES = ('author', 'category', 'comments', 'content_status', 'identifier', 'keywords',
+                    'last_modified_by', 'subject', 'title', 'version')
+_APP_PROPERTIES = {'Company', 'Manager', 'HyperlinkBase'}
+# Атрибуты с именами и учётными записями авторов правок и примечаний (w:ins, w:del,
+# w:comment, w15:person и w15:presenceInfo)
+_AUTHOR_ATTRIBUTES = {'author', 'initials', 'userId', 'providerId'}
+
+_PARAGRAPH = qn('w:p')
+_TEXT, _DELETED_TEXT, _TAB, _BREAKS = qn('w:t'), qn('w:delText'), qn('w:tab'), (qn('w:br'), qn('w:cr'))
+_FIELD_CODE, _SIMPLE_FIELD, _INSTRUCTION = qn('w:instrText'), qn('w:fldSimple'), qn('w:instr')
+_TOKEN = re.compile(r'\S+')
+# Коды полей и адреса ссылок делятся на слова ещё и по кавычкам и двоеточиям (mailto:адрес)
+_LINK_TOKEN = re.compile(r'[^\s":]+')
+
+Segment = Tuple[object, int]
+
+
+class Layer(NamedTuple):
+    """Text of a paragraph that is checked and masked as one piece."""
+    text: str
+    segments: List[Segment]  # элемент с текстом и смещение его текста в text
+    token: Pattern
+
+
+def text_roots(document) -> List[Tuple[object, object]]:
+    """
+    Return the XML roots of every text part of the document.
+
+    Parts python-docx keeps as bytes (footnotes, endnotes) are parsed here; store_roots writes
+    them back.
+
+    Args:
+        document (docx.document.Document): The opened document.
+
+    Returns:
+        List[Tuple[Part, Element]]: Parts of the body, headers, footers, footnotes, endnotes
+        and comments with their root elements, in package order.
+    """
+    return [(part, part.element if hasattr(part, 'element') else parse_xml(part.blob))
+            for part in document.part.package.iter_parts() if part.content_type in _TEXT_PARTS]
+
+
+def store_roots(roots: List[Tuple[object, object]]):
+    """Write the roots parsed by text_roots back into the parts that keep bytes."""
+    for part, root in roots:
+        if not hasattr(part, 'element'):
+            # У частей без разбора XML нет публичного способа заменить содержимое
+            part._blob = serialize_part_xml(root)  # pylint: disable=protected-access
+
+
+def iter_paragraphs(roots) -> Iterator:
+    """
+    Yield the ``w:p`` elements of the text parts in document order.
+
+    Args:
+        roots (List[Tuple[Part, Element]]): The result of text_roots.
+
+    Returns:
+        Iterator: Paragraph elements, including the ones of tables and text boxes.
+    """
+    for _, root in roots:
+        yield from root.iter(_PARAGRAPH)
+
+
+def _own_elements(paragraph, *tags) -> Iterator:
+    # Элементы самого абзаца, без абзацев вложенных в него надписей: у них свой проход
+    for element in paragraph.iter(*tags):
+        if next(element.iterancestors(_PARAGRAPH)) is paragraph:
+            yield element
+
+
+def _element_text(element) -> str:
+    if element.tag == _SIMPLE_FIELD:
+        return element.get(_INSTRUCTION) or ''
+    if element.tag == _TAB:
+        return '\t'
+    if element.tag in _BREAKS:
+        return '\n'
+    return element.text or ''
+
+
+def _layer(elements, token: Pattern) -> Layer:
+    parts = []
+    segments = []
+    length = 0
+    for element in elements:
+        text = _element_text(element)
+        if element.tag not in (_TAB, *_BREAKS):
+            segments.append((element, length))
+        parts.append(text)
+        length += len(text)
+    return Layer(''.join(parts), segments, token)
+
+
+def paragraph_layers(paragraph) -> List[Layer]:
+    """
+    Read the visible text, the deleted text and the field codes of a paragraph.
+
+    Args:
+        paragraph: A ``w:p`` element.
+
+    Returns:
+        List[Layer]: The three layers; tabs and line breaks are part of the visible text.
+    """
+    return [
+        _layer(_own_elements(paragraph, _TEXT, _TAB, *_BREAKS), _TOKEN),
+        _layer(_own_elements(paragraph, _DELETED_TEXT), _TOKEN),
+        _layer(_own_elements(paragraph, _FIELD_CODE, _SIMPLE_FIELD), _LINK_TOKEN),
+    ]
+
+
+def iter_links(roots) -> Iterator:
+    """Yield the relationships of the text parts that point to external hyperlinks."""
+    for part, _ in roots:
+        for relationship in part.rels.values():
+            if relationship.is_external and relationship.reltype == RELATIONSHIP_TYPE.HYPERLINK:
+                yield relationship
+
+
+def _iter_units(roots) -> Iterator[List[str]]:
+    # Строки каждого абзаца (по одной на непустой слой) и адреса ссылок
+    for paragraph in iter_paragraphs(roots):
+        yield [layer.text.strip() for layer in paragraph_layers(paragraph) if layer.text.strip()]
+    for relationship in iter_links(roots):
+        yield [relationship.target_ref]
+
+
+def iter_text_chunks(roots, size: int = DOCX_CHUNK_PARAGRAPHS) -> Iterator[str]:
+    """
+    Yield the text of the document in chunks of paragraphs, one paragraph layer per line.
+
+    Every chunk after the first starts with the last paragraph of the previous one, so the
+    context clues of a line ("ФИО:" and the like) still apply across the chunk border. The
+    targets of external hyperlinks come after the paragraphs.
+
+    Args:
+        roots (List[Tuple[Part, Element]]): The result of text_roots.
+        size (int): Paragraphs per chunk.
+
+    Returns:
+        Iterator[str]: The chunks.
+    """
+    units = []
+    pending = 0
+    for lines in _iter_units(roots):
+        if not lines:
+            continue
+        units.append(lines)
+        pending += 1
+        if pending >= size:
+            yield '\n'.join(line for unit in units for line in unit)
+            units = units[-1:]
+            pending = 0
+    if pending:
+        yield '\n'.join(line for unit in units for line in unit)
+
+
+def document_text(docx_path: str) -> str:
+    """Return the text of a DOCX file, one paragraph layer or hyperlink target per line."""
+    roots = text_roots(docx.Document(docx_path))
+    return '\n'.join(line for lines in _iter_units(roots) for line in lines)
+
+
+@metrics.timed('docx_detect')
+def find_personal_data(roots, analyzer, size: int = DOCX_CHUNK_PARAGRAPHS) -> Set[str]:
+    """
+    Find personal data in the text of the document, chunk by chunk.
+
+    Args:
+        roots (List[Tuple[Part, Element]]): The result of text_roots.
+        analyzer: Engine analyzer.
+        size (int): Paragraphs per chunk.
+
+    Returns:
+        Set[str]: Phrases consisting personal data.
+    """
+    found = set()
+    for chunk in iter_text_chunks(roots, size):
+        found |= personal_data_recognizer.find_personal_data(chunk, analyzer)
+    return found
+
+
+def _mask(text: str, start: int, end: int) -> str:
+    return text[:start] + ''.join(
+        char if char.isspace() else MASK_CHAR for char in text[start:end]) + text[end:]
+
+
+def find_spans(text: str, token: Pattern, matcher: word_matcher.PhraseMatcher) -> List[tuple]:
+    """
+    Find the character ranges of the matched phrases in a text.
+
+    Every word is a token of the text; its "box" is the character span (start, 0, end, 0)
+    without the punctuation around it, so merged boxes are the character ranges to mask.
+
+    Args:
+        text (str): The text.
+        token (Pattern): What a word is, e.g. a run of non-space characters.
+        matcher (PhraseMatcher): Matcher built for the detected phrases.
+
+    Returns:
+        List[tuple]: The ranges as (start, 0, end, 0).
+    """
+    words = []
+    for match in token.finditer(text):
+        value = match.group()
+        normalized = word_matcher.normalize(value)
+        if not normalized:
+            continue
+        start = match.start() + len(value) - len(value.lstrip(word_matcher.EDGE_PUNCTUATION))
+        end = match.end() - len(value) + len(value.rstrip(word_matcher.EDGE_PUNCTUATION))
+        words.append(word_matcher.Word(normalized, (0,), (start, 0, end, 0)))
+    return word_matcher.find_boxes(words, (), matcher)
+
+
+def redact_layer(layer: Layer, matcher: word_matcher.PhraseMatcher) -> int:
+    """
+    Mask the matched phrases of a paragraph layer in its elements.
+
+    Whitespace inside a range is kept, runs and their formatting are not touched.
+
+    Args:
+        layer (Layer): A layer returned by paragraph_layers.
+        matcher (PhraseMatcher): Matcher built for the detected phrases.
+
+    Returns:
+        int: Number of masked ranges.
+    """
+    spans = find_spans(layer.text, layer.token, matcher)
+    for element, offset in layer.segments:
+        element_text = _element_text(element)
+        masked = element_text
+        for start, _, end, _ in spans:
+            start, end = max(start - offset, 0), min(end - offset, len(element_text))
+            if start < end:
+                masked = _mask(masked, start, end)
+        if masked == element_text:
+            continue
+        if element.tag == _SIMPLE_FIELD:
+            element.set(_INSTRUCTION, masked)
+        else:
+            element.text = masked
+    return len(spans)
+
+
+def redact_links(roots, matcher: word_matcher.PhraseMatcher) -> int:
+    """Mask the matched phrases in the targets of external hyperlinks; return how many."""
+    redacted = 0
+    for relationship in iter_links(roots):
+        target = relationship.target_ref
+        spans = find_spans(target, _LINK_TOKEN, matcher)
+        for start, _, end, _ in spans:
+            target = _mask(target, start, end)
+        if spans:
+            # У связи нет публичного способа заменить адрес
+            relationship._target = target  # pylint: disable=protected-access
+            redacted += 1
+    return redacted
+
+
+def _clear_authors(root):
+    for element in root.iter():
+        for name in element.attrib:
+            if etree.QName(name).localname in _AUTHOR_ATTRIBUTES:
+                element.set(name, '')
+
+
+def clear_metadata(document, roots):
+    """
+    Blank the metadata that names people, see the module docstring.
+
+    Args:
+        document (docx.document.Document): The opened document.
+        roots (List[Tuple[Part, Element]]): The result of text_roots.
+    """
+    properties = document.core_properties
+    for name in _CORE_PROPERTIES:
+        setattr(properties, name, '')
+    for _, root in roots:
+        _clear_authors(root)
+
+    package = document.part.package
+    for part in package.iter_parts():
+        if part.content_type not in (CONTENT_TYPE.OFC_EXTENDED_PROPERTIES,
+                                     CONTENT_TYPE.OFC_CUSTOM_PROPERTIES, _PEOPLE_PART):
+            continue
+        root = etree.fromstring(part.blob)
+        if part.content_type == _PEOPLE_PART:
+            _clear_authors(root)
+        for child in list(root):
+            if (part.content_type == CONTENT_TYPE.OFC_CUSTOM_PROPERTIES
+                    or etree.QName(child).localname in _APP_PROPERTIES):
+                root.remove(child)
+        part._blob = serialize_part_xml(root)  # pylint: disable=protected-access
+    # Миниатюра первой страницы — картинка с её текстом; Word создаст новую при сохранении
+    for r_id, relationship in list(package.rels.items()):
+        if relationship.reltype == RELATIONSHIP_TYPE.THUMBNAIL:
+            del package.rels[r_id]
+
+
+@metrics.timed('docx_images')
+def redact_images(document, phrases: Set[str], analyzer, lang: str = 'rus') -> Set[str]:
+    """
+    OCR the embedded raster images and black out personal data on them.
+
+    Phrases found in the text of an image are added to the phrases redacted on it (and on the
+    images after it). Formats OpenCV cannot decode (EMF, WMF, SVG) are left as they are.
+
+    Args:
+        document (docx.document.Document): The opened document; its image parts are replaced.
+        phrases (Set[str]): Personal data found in the document text.
+        analyzer: Engine analyzer.
+        lang (str): OCR language.
+
+    Returns:
+        Set[str]: The phrases together with the ones found on the images.
+    """
+    phrases = set(phrases)
+    for part in document.part.package.iter_parts():
+        extension = _IMAGE_EXTENSIONS.get(part.content_type)
+        if not isinstance(part, ImagePart) or extension is None:
+            continue
+        image = cv2.imdecode(np.frombuffer(part.blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        ocr_result = text_recognizer.recognize_image(image, lang=lang)
+        if ocr_result.text.strip():
+            phrases |= personal_data_recognizer.find_personal_data(ocr_result.text, analyzer)
+        image_anonymizer.anonymize_image(image, phrases, ocr_result.words)
+        with metrics.stage('encode'):
+            encoded = cv2.imencode(extension, image)[1]
+        # У ImagePart нет публичного способа заменить содержимое
+        part._blob = encoded.tobytes()  # pylint: disable=protected-access
+    return phrases
+
+
+@metrics.timed('redact_docx')
+def redact_docx(docx_path: str, output_path: str, words_to_anonymize=None, progress=None,
+                lang: str = 'rus') -> str:
+    """
+    Write a copy of the DOCX file with personal data masked in its text, links and images,
+    and the metadata naming people blanked.
+
+    Args:
+        docx_path (str): Path to the source DOCX file.
+        output_path (str): Path of the redacted DOCX file.
+        words_to_anonymize (Set[str]): Personal data if it was already found for the file;
+            otherwise the text is sent to find_personal_data in chunks.
+        progress (Callable): Called as progress(stage) when a stage starts.
+        lang (str): OCR language of the embedded images.
+
+    Returns:
+        str: The output path.
+    """
+    progress = progress or (lambda stage, done=None, total=None: None)
+    document = docx.Document(docx_path)
+    roots = text_roots(document)
+    analyzer = analyzer_registry.get_analyzer()
+
+    progress('detect')
+    if words_to_anonymize is None:
+        words_to_anonymize = find_personal_data(roots, analyzer)
+        metrics.observe(metrics.DETECTED_ENTITIES, len(words_to_anonymize))
+    progress('ocr')
+    words_to_anonymize = redact_images(document, words_to_anonymize, analyzer, lang)
+
+    progress('redact')
+    matcher = word_matcher.PhraseMatcher(words_to_anonymize)
+    with metrics.stage('docx_redact_text'):
+        for paragraph in iter_paragraphs(roots):
+            for layer in paragraph_layers(paragraph):
+                redact_layer(layer, matcher)
+        redact_links(roots, matcher)
+        clear_metadata(document, roots)
+        store_roots(roots)
+    with metrics.stage('docx_save'):
+        document.save(output_path)
+    return output_path
@@ -1,16 +1,55 @@
 import os
 
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
 from pdf2image import convert_from_path
-import os
+
+import metrics
+
+PDF_RENDER_DPI = 200
+
+
+def get_pdf_page_count(pdf_path):
+    """Возвращает число страниц PDF файла."""
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def render_pdf_page(pdf_path, page_number, dpi=PDF_RENDER_DPI):
+    """Рендерит одну страницу PDF (нумерация с 1) в изображение PIL, не загружая остальные."""
+    return convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)[0]
+
+
+@metrics.timed('render')
+def render_pdf_page_bgr(pdf_path, page_number, dpi=PDF_RENDER_DPI):
+    """Рендерит одну страницу PDF (нумерация с 1) в массив BGR для OpenCV, без записи на диск."""
+    image = render_pdf_page(pdf_path, page_number, dpi).convert('RGB')
+    return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+
+def pixmap_to_bgr(pixmap):
+    """Преобразует fitz.Pixmap без альфа-канала в массив BGR для OpenCV."""
+    image = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(
+        pixmap.height, pixmap.width, pixmap.n)
+    if pixmap.n == 1:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+
+def iter_pdf_pages(pdf_path, dpi=PDF_RENDER_DPI):
+    """Лениво рендерит страницы PDF по одной, в порядке страниц: (номер страницы, изображение PIL)."""
+    for page_number in range(1, get_pdf_page_count(pdf_path) + 1):
+        yield page_number, render_pdf_page(pdf_path, page_number, dpi)
+
 
 def convert_pdf_to_jpg(pdf_path, output_folder):
     """Конвертирует PDF файл в изображения JPG, каждая страница становится отдельным файлом."""
-    images = convert_from_path(pdf_path)
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
-    for i, image in enumerate(images):
-        filename = os.path.splitext(os.path.basename(pdf_path))[0]
-        image.save(f'{output_folder}/{filename}_page_{i + 1}.jpg', 'JPEG')
+    filename = os.path.splitext(os.path.basename(pdf_path))[0]
+    for page_number, image in iter_pdf_pages(pdf_path):
+        image.save(f'{output_folder}/{filename}_page_{page_number}.jpg', 'JPEG')
 
 def convert_docx_to_pdf(docx_path, pdf_path):
     """Конвертирует DOCX файл в PDF. Требует установленного LibreOffice или Microsoft Office."""
@@ -22,4 +61,4 @@ def convert_docx_to_jpg(docx_path, output_folder):
     temp_pdf_path = f'{output_folder}/temp.pdf'
     convert_docx_to_pdf(docx_path, temp_pdf_path)
     convert_pdf_to_jpg(temp_pdf_path, output_folder)
-    os.remove(temp_pdf_path)
\ No newline at end of file
+    os.remove(temp_pdf_path)
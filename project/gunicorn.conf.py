@@ -0,0 +1,23 @@
+"""Gunicorn settings for AnonDocService."""
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '360'))
+
+# Load the analyzer in the master before forking so that workers share the
+# spaCy model memory copy-on-write instead of loading one copy each.
+ANALYZER_PRELOAD = os.environ.get('ANALYZER_PRELOAD', '1') == '1'
+
+
+def on_starting(server):
+    """Reset saved metrics and warm the analyzer registry in the master process."""
+    import metrics  # pylint: disable=import-outside-toplevel
+    metrics.clear_dir()
+    if not ANALYZER_PRELOAD:
+        return
+    import analyzer_registry  # pylint: disable=import-outside-toplevel
+    server.log.info('Loading analyzer model before forking workers')
+    analyzer_registry.warm_up(freeze=True)
+    server.log.info('Analyzer loaded: %s', analyzer_registry.status())
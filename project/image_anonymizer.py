@@ -1,40 +1,56 @@
-import cv2
-import pytesseract
-import platform
-from typing import List
-from text_recognizer import extract_data_from_image
+from typing import Iterable, Optional
 
-# Проверяем, является ли операционная система Ubuntu
-if platform.system() == 'Linux':
-    pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
+import numpy as np
 
+import metrics
+import word_matcher
+from text_recognizer import ImageSource, extract_words, load_image
+from word_table import WordTable
 
-def anonymize_image(image_path: str, preprocess_image_path: str, words_to_anonymize: List[str]):
+
+def fill_boxes(image: np.ndarray, boxes: np.ndarray, color=(0, 0, 0)) -> np.ndarray:
     """
-    Anonymize specified words on the image by covering them with black rectangles.
+    Fill boxes on the image.
+
+    The boxes are the merged spans of word_table.WordTable.span_boxes, so there are few of
+    them; each is filled with one slice assignment, which touches only the covered pixels
+    (a mask over the whole page costs time proportional to the page area instead).
 
     Args:
-        image_path (str): Path to the input image.
-        words_to_anonymize (List[str]): List of words to be anonymized.
-        output_path (str): Path to save the anonymized image.
+        image (np.ndarray): The image, modified in place.
+        boxes (np.ndarray): (k, 4) array of x0, y0, x1, y1.
+        color: Fill color.
+
+    Returns:
+        np.ndarray: The image.
     """
-    image = cv2.imread(image_path)
-    if image is None:
-        raise FileNotFoundError(f"The image at path '{image_path}' could not be found.")
-    preprocess_image = cv2.imread(preprocess_image_path)
-    if preprocess_image is None:
-        raise FileNotFoundError(f"The image at path '{preprocess_image_path}' could not be found.")
+    height, width = image.shape[:2]
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    boxes = np.clip(boxes, 0, [width, height, width, height])
+    for x0, y0, x1, y1 in boxes.tolist():
+        image[y0:y1, x0:x1] = color
+    return image
 
-    #todo: эти данные нужно где-то кешить(слова - координаты слова)
-    data = extract_data_from_image(image_path)
 
-    n_boxes = len(data['text'])
+@metrics.timed('anonymize_image')
+def anonymize_image(image: ImageSource, words_to_anonymize: Iterable[str],
+                    words: Optional[WordTable] = None):
+    """
+    Anonymize specified phrases on the image by covering them with black rectangles.
 
-    for i in range(n_boxes):
+    Args:
+        image (str | np.ndarray): Path to the input image or the BGR image itself. An array
+            is redacted in place.
+        words_to_anonymize (Iterable[str]): Detected personal data phrases. They are matched
+            to the recognized words by word_matcher; one rectangle covers a matched run of
+            words on a line.
+        words (Optional[WordTable]): Words from an OCR pass that was already made for this
+            image (see text_recognizer.recognize_image). OCR is run only if it is missing.
+    """
+    image = load_image(image)
 
-        word = data['text'][i]
-        if word.lower() in words_to_anonymize:
-            (x, y, w, h) = (data['left'][i], data['top'][i],
-                            data['width'][i], data['height'][i])
-            cv2.rectangle(image, (x, y), (x + w, y + h), (0, 0, 0), -1)
-    return image
+    if words is None:
+        words = extract_words(image)
+
+    selection = word_matcher.PhraseMatcher(words_to_anonymize).select(words)
+    return fill_boxes(image, words.span_boxes(selection))
@@ -0,0 +1,254 @@
+"""Asynchronous anonymization jobs.
+
+An upload is stored in a storage.Scratch folder, under the same quotas as ``/upload``, and
+handed to a local process pool; the HTTP request returns at once with the job id. The job state lives in ``status.json`` inside the
+job folder and is replaced atomically by the worker at every stage, so any gunicorn worker
+can answer status, long-poll and download requests. Each gunicorn worker accepts at most
+JOB_QUEUE_SIZE unfinished jobs and rejects the rest with QueueFullError. If a pool process
+dies, its job is marked failed and the pool is replaced.
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import document_processor
+import storage
+
+JOBS_FOLDER = 'jobs/'
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', '16'))
+WAIT_POLL_INTERVAL = 0.25
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED_STATES = (DONE, FAILED)
+
+_JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+os.makedirs(JOBS_FOLDER, exist_ok=True)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue of this worker is full."""
+
+
+def _get_executor():
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=JOB_WORKERS)
+        return _executor
+
+
+def _reset_executor(broken):
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        # Пул мог быть уже заменён при обработке другого задания
+        if _executor is broken:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _job_folder(job_id):
+    return os.path.join(JOBS_FOLDER, job_id)
+
+
+def _status_path(job_id):
+    return os.path.join(_job_folder(job_id), 'status.json')
+
+
+def _write_status(job_id, status):
+    fd, temp_path = tempfile.mkstemp(dir=_job_folder(job_id), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        json.dump(status, file, ensure_ascii=False)
+    os.replace(temp_path, _status_path(job_id))
+
+
+def is_job_id(value):
+    """Return True if the value looks like a job id."""
+    return bool(_JOB_ID_PATTERN.match(value))
+
+
+def get_status(job_id):
+    """
+    Read the current state of a job.
+
+    Args:
+        job_id (str): The job id returned by submit.
+
+    Returns:
+        Optional[dict]: The job status, or None if there is no such job.
+    """
+    if not is_job_id(job_id):
+        return None
+    try:
+        with open(_status_path(job_id), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def wait(job_id, timeout):
+    """
+    Block until the job finishes or the timeout expires.
+
+    Args:
+        job_id (str): The job id returned by submit.
+        timeout (float): Maximum number of seconds to wait.
+
+    Returns:
+        Optional[dict]: The last seen job status, or None if there is no such job.
+    """
+    deadline = time.monotonic() + timeout
+    status = get_status(job_id)
+    while status is not None and status['state'] not in FINISHED_STATES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(WAIT_POLL_INTERVAL, remaining))
+        status = get_status(job_id)
+    return status
+
+
+def result_path(job_id):
+    """Return the path to the result of a finished job, or None if it is not ready."""
+    status = get_status(job_id)
+    if status is None or status['state'] != DONE:
+        return None
+    return os.path.abspath(os.path.join(_job_folder(job_id), status['result']))
+
+
+def submit(file_storage, expected_size=None):
+    """
+    Store an uploaded file and queue it for anonymization.
+
+    Args:
+        file_storage (werkzeug.datastructures.FileStorage): The uploaded file.
+        expected_size (int): Size announced by the client (the request content length),
+            checked against the scratch quotas before anything is written.
+
+    Returns:
+        dict: The initial job status.
+
+    Raises:
+        QueueFullError: If this worker already has JOB_QUEUE_SIZE unfinished jobs.
+        storage.QuotaExceededError: If the upload does not fit into the scratch quotas.
+    """
+    global _pending  # pylint: disable=global-statement
+    with _executor_lock:
+        if _pending >= JOB_QUEUE_SIZE:
+            raise QueueFullError(f'Job queue is full ({JOB_QUEUE_SIZE} jobs)')
+        _pending += 1
+
+    scratch = None
+    try:
+        scratch = storage.Scratch(prefix='job-')
+        # Имя файла пользователя не используется в пути: сохраняем только расширение
+        extension = os.path.splitext(file_storage.filename)[1].lower()
+        input_path = scratch.save(file_storage, f'input{extension}', expected_size)
+        job_id = uuid.uuid4().hex
+        os.makedirs(_job_folder(job_id))
+
+        status = {
+            'id': job_id,
+            'filename': file_storage.filename,
+            'state': QUEUED,
+            'stage': None,
+            'progress': {},
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'error': None,
+            'result': None,
+        }
+        _write_status(job_id, status)
+        executor = _get_executor()
+        try:
+            future = executor.submit(run_job, job_id, input_path)
+        except BrokenProcessPool:
+            _reset_executor(executor)
+            executor = _get_executor()
+            future = executor.submit(run_job, job_id, input_path)
+    except BaseException:
+        if scratch is not None:
+            scratch.close()
+        _release()
+        raise
+    future.add_done_callback(lambda done: _finish(done, executor, job_id, scratch))
+    return status
+
+
+def _finish(future, executor, job_id, scratch):
+    try:
+        # run_job сам записывает исход задания; сюда доходят только сбои пула: процесс убит
+        # (нехватка памяти, segfault в OCR) или задание снято из очереди при замене пула
+        if future.cancelled():
+            error = 'CancelledError: the job pool was restarted'
+        else:
+            exception = future.exception()
+            error = exception and f'{type(exception).__name__}: {exception}'
+            if isinstance(exception, BrokenProcessPool):
+                _reset_executor(executor)
+        if error:
+            status = get_status(job_id)
+            if status is not None and status['state'] not in FINISHED_STATES:
+                status.update(state=FAILED, error=error, finished_at=time.time())
+                _write_status(job_id, status)
+    finally:
+        # Загрузка не хранится после обработки
+        scratch.close()
+        _release()
+
+
+def _release():
+    global _pending  # pylint: disable=global-statement
+    with _executor_lock:
+        _pending -= 1
+
+
+def pending_count():
+    """Return the number of unfinished jobs accepted by this worker."""
+    return _pending
+
+
+def run_job(job_id, input_path):
+    """
+    Run the anonymization pipeline for a job; executed in a pool process.
+
+    Args:
+        job_id (str): The job id.
+        input_path (str): Path to the stored upload; it is removed by the worker that
+            submitted the job.
+    """
+    status = get_status(job_id)
+    status.update(state=RUNNING, started_at=time.time())
+    _write_status(job_id, status)
+
+    def progress(stage, done=None, total=None):
+        status['stage'] = stage
+        status['progress'][stage] = {'done': done, 'total': total}
+        _write_status(job_id, status)
+
+    try:
+        anonymized_path = document_processor.process_and_anonymize_file(
+            input_path, f'result{os.path.splitext(input_path)[1]}',
+            output_folder=_job_folder(job_id), progress=progress)
+        status.update(state=DONE, result=os.path.basename(anonymized_path))
+    except Exception as e:  # pylint: disable=broad-except
+        status.update(state=FAILED, error=f'{type(e).__name__}: {e}')
+    finally:
+        status['finished_at'] = time.time()
+        _write_status(job_id, status)
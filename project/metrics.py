@@ -0,0 +1,338 @@
+"""Per-stage instrumentation of the pipeline, exposed in the Prometheus text format.
+
+Stages are timed with ``stage(name)`` or the ``timed(name)`` decorator; document sizes and
+counts are recorded with ``observe``. Measurements go into per-process histograms guarded
+by one lock, so recording costs a clock read and a few additions and can stay on under
+load. Stages that ran while a request was being handled are also collected for the
+``Server-Timing`` response header when METRICS_SERVER_TIMING is set.
+
+Every process (gunicorn worker, PDF, job or bulk pool process) has its own histograms. If
+METRICS_DIR is set, each process also saves them to ``<METRICS_DIR>/<pid>.json`` at most
+once per METRICS_FLUSH_INTERVAL seconds and on exit, and ``render`` sums the files of all
+processes; otherwise ``/metrics`` shows only the worker that answered the scrape.
+
+Gauges that describe shared state rather than one process (e.g. the disk usage of the stored
+documents) are not recorded: functions registered with ``register_collector`` compute them
+in the process that answers the scrape.
+"""
+
+import atexit
+import bisect
+import contextvars
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '1'))
+SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '0') == '1'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+PIXEL_BUCKETS = (1e5, 5e5, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6, 64e6)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1)
+SCALE_BUCKETS = (0.25, 0.5, 0.75, 0.99, 1, 1.5, 2, 4)
+
+STAGE_SECONDS = 'anondoc_stage_duration_seconds'
+STAGE_FAILURES = 'anondoc_stage_failures_total'
+DOCUMENT_PAGES = 'anondoc_document_pages'
+IMAGE_PIXELS = 'anondoc_image_pixels'
+OCR_WORDS = 'anondoc_ocr_words'
+OCR_SCALE = 'anondoc_ocr_scale'
+DETECTED_ENTITIES = 'anondoc_detected_entities'
+PIPELINE_QUEUE_DEPTH = 'anondoc_pdf_pipeline_queue_depth'
+PIPELINE_UTILIZATION = 'anondoc_pdf_pipeline_stage_utilization'
+STORAGE_EVICTIONS = 'anondoc_storage_evictions_total'
+STORAGE_QUOTA_REJECTIONS = 'anondoc_storage_quota_rejections_total'
+STORAGE_BYTES = 'anondoc_storage_bytes'
+STORAGE_FILES = 'anondoc_storage_files'
+
+HISTOGRAMS = {
+    STAGE_SECONDS: ('Duration of pipeline stages in seconds.', DURATION_BUCKETS),
+    DOCUMENT_PAGES: ('Pages per processed PDF document.', COUNT_BUCKETS),
+    IMAGE_PIXELS: ('Size in pixels of the images passed to OCR.', PIXEL_BUCKETS),
+    OCR_WORDS: ('Words recognized per OCR call.', COUNT_BUCKETS),
+    OCR_SCALE: ('Factor the images were resized by before OCR.', SCALE_BUCKETS),
+    DETECTED_ENTITIES: ('Personal data words found per document.', COUNT_BUCKETS),
+    PIPELINE_QUEUE_DEPTH: ('Pages waiting in the input queue of a PDF pipeline stage.', COUNT_BUCKETS),
+    PIPELINE_UTILIZATION: ('Busy share of the workers of a PDF pipeline stage per document.',
+                           RATIO_BUCKETS),
+}
+COUNTERS = {
+    STAGE_FAILURES: 'Pipeline stages that raised an exception.',
+    STORAGE_EVICTIONS: 'Stored documents and folders deleted, by area and reason.',
+    STORAGE_QUOTA_REJECTIONS: 'Uploads rejected because a scratch space quota was exceeded.',
+}
+GAUGES = {
+    STORAGE_BYTES: 'Bytes used by each storage area (in memory for ocr_cache_memory).',
+    STORAGE_FILES: 'Files in each storage area (records for ocr_cache_memory).',
+}
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+_collectors = []
+
+
+class Registry:
+    """Histograms and counters of one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._flushed_at = 0.0
+
+    def observe(self, name, value, labels=()):
+        """Add a value to a histogram; labels is a tuple of (name, value) pairs."""
+        buckets = HISTOGRAMS[name][1]
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            series = self._histograms.get((name, labels))
+            if series is None:
+                series = self._histograms[(name, labels)] = [0] * (len(buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def inc(self, name, labels=()):
+        """Increment a counter."""
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + 1
+
+    def snapshot(self):
+        """Return the current values in a JSON-serializable form."""
+        with self._lock:
+            return {
+                'histograms': [[name, list(labels), list(series)]
+                               for (name, labels), series in self._histograms.items()],
+                'counters': [[name, list(labels), value]
+                             for (name, labels), value in self._counters.items()],
+            }
+
+    def flush(self, force=False):
+        """Save the snapshot to METRICS_DIR if the flush interval has passed."""
+        if METRICS_DIR is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < METRICS_FLUSH_INTERVAL:
+            return
+        self._flushed_at = now
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=METRICS_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temp_path, os.path.join(METRICS_DIR, f'{os.getpid()}.json'))
+
+
+_registry = Registry()
+
+
+def _reset_in_child():
+    # Дочерний процесс начинает со своих нулевых значений: значения родителя остаются в его файле
+    global _registry  # pylint: disable=global-statement
+    _registry = Registry()
+
+
+os.register_at_fork(after_in_child=_reset_in_child)
+atexit.register(lambda: _registry.flush(force=True))
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def observe(name, value, **labels):
+    """
+    Record a value, e.g. the page count of a document.
+
+    Args:
+        name (str): One of the HISTOGRAMS names.
+        value (float): The value.
+        **labels: Label values of the series.
+    """
+    if METRICS_ENABLED:
+        _registry.observe(name, value, _labels(labels))
+
+
+def inc(name, **labels):
+    """
+    Increment a counter, e.g. the number of evicted files.
+
+    Args:
+        name (str): One of the COUNTERS names.
+        **labels: Label values of the series.
+    """
+    if METRICS_ENABLED:
+        _registry.inc(name, _labels(labels))
+
+
+def register_collector(collector):
+    """
+    Register a function computing gauges when the metrics are rendered.
+
+    Args:
+        collector (Callable): Returns an iterable of (name, labels dict, value) with names
+            from GAUGES.
+    """
+    _collectors.append(collector)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as a pipeline stage.
+
+    Args:
+        name (str): Stage label, e.g. ``ocr``.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    labels = (('stage', name),)
+    try:
+        yield
+    except BaseException:
+        _registry.inc(STAGE_FAILURES, labels)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _registry.observe(STAGE_SECONDS, duration, labels)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + duration
+        _registry.flush()
+
+
+def timed(name):
+    """Decorator timing every call of the function as the stage ``name``."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request():
+    """Start collecting the stages of the current request for the Server-Timing header."""
+    if SERVER_TIMING:
+        _request_timings.set({})
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collect the stages timed inside the block (in this thread or context), whether or not
+    METRICS_SERVER_TIMING is set.
+
+    Yields:
+        Dict[str, float]: Total seconds per stage, filled in as the stages finish.
+    """
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing_header():
+    """
+    Return the Server-Timing header value for the current request.
+
+    Returns:
+        Optional[str]: Total milliseconds per stage, or None if nothing was timed.
+    """
+    timings = _request_timings.get()
+    if not timings:
+        return None
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items())
+
+
+def clear_dir():
+    """Remove the saved values of all processes, e.g. when the server starts."""
+    if METRICS_DIR is None or not os.path.isdir(METRICS_DIR):
+        return
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith('.json'):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+
+def _snapshots():
+    if METRICS_DIR is None:
+        return [_registry.snapshot()]
+    _registry.flush(force=True)
+    snapshots = []
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), 'r', encoding='utf-8') as file:
+                snapshots.append(json.load(file))
+        except (FileNotFoundError, ValueError):
+            continue
+    return snapshots
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+def _format_bound(bound):
+    return f'{bound:g}' if isinstance(bound, float) else str(bound)
+
+
+def render():
+    """
+    Render the metrics of all processes in the Prometheus text exposition format.
+
+    Returns:
+        str: The exposition.
+    """
+    histograms = {}
+    counters = {}
+    for snapshot in _snapshots():
+        for name, labels, series in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            total = histograms.setdefault(key, [0] * len(series))
+            histograms[key] = [a + b for a, b in zip(total, series)]
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (series_name, labels), series in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, series):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", _format_bound(bound))])} '
+                             f'{cumulative}')
+            cumulative += series[len(buckets)]
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {series[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (series_name, labels), value in sorted(counters.items()):
+            if series_name == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    gauges = [(name, _labels(labels), value)
+              for collector in _collectors for name, labels, value in collector()]
+    for name, help_text in GAUGES.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for series_name, labels, value in sorted(gauges):
+            if series_name == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,255 @@
+"""OCR backends used by text_recognizer.
+
+``pytesseract`` starts a ``tesseract`` process for every call and passes the image through
+a temporary file, reloading the traineddata each time. ``tesserocr`` calls the Tesseract C
+API in-process: engines are created once per (language, config) and reused from a
+per-process pool, and images are handed over as numpy buffers without disk I/O.
+
+OCR_BACKEND selects the backend: ``tesserocr``, ``pytesseract`` or ``auto`` (tesserocr if
+it is installed, pytesseract otherwise). ``stub`` is a deterministic stand-in that needs no
+Tesseract at all; it is meant for load tests of the web and queueing layers
+(see benchmarks/load.py).
+"""
+
+import os
+import platform
+import queue
+import re
+import threading
+import time
+import zlib
+
+import cv2
+import numpy as np
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Проверяем, является ли операционная система Ubuntu
+if platform.system() == 'Linux':
+    pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
+
+OCR_BACKEND = os.environ.get('OCR_BACKEND', 'auto')
+OCR_POOL_SIZE = int(os.environ.get('OCR_POOL_SIZE', '2'))
+# Задержка бэкенда stub: секунды на вызов и дополнительно на мегапиксель изображения
+STUB_OCR_LATENCY = float(os.environ.get('STUB_OCR_LATENCY', '0.2'))
+STUB_OCR_LATENCY_PER_MP = float(os.environ.get('STUB_OCR_LATENCY_PER_MP', '0'))
+
+DATA_KEYS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+             'left', 'top', 'width', 'height', 'conf', 'text')
+_WORD_LEVEL = 5
+
+
+class PytesseractBackend:
+    """Runs the tesseract executable through pytesseract."""
+
+    name = 'pytesseract'
+
+    def image_to_string(self, image: np.ndarray, lang: str, config: str) -> str:
+        """Recognize the image and return its text."""
+        return pytesseract.image_to_string(image, lang=lang, config=config)
+
+    def image_to_data(self, image: np.ndarray, lang: str, config: str) -> dict:
+        """Recognize the image and return a pytesseract data dictionary."""
+        return pytesseract.image_to_data(
+            image, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+
+
+class TesserocrBackend:
+    """Runs Tesseract in-process through tesserocr with a pool of initialized engines."""
+
+    name = 'tesserocr'
+
+    def __init__(self, pool_size=OCR_POOL_SIZE):
+        self.pool_size = pool_size
+        self._pools = {}
+        self._created = {}
+        self._lock = threading.Lock()
+
+    def image_to_string(self, image: np.ndarray, lang: str, config: str) -> str:
+        """Recognize the image and return its text."""
+        with self._engine(lang, config) as api:
+            self._set_image(api, image)
+            return api.GetUTF8Text()
+
+    def image_to_data(self, image: np.ndarray, lang: str, config: str) -> dict:
+        """Recognize the image and return its words in the pytesseract data dictionary layout."""
+        data = {key: [] for key in DATA_KEYS}
+        with self._engine(lang, config) as api:
+            self._set_image(api, image)
+            api.Recognize()
+            iterator = api.GetIterator()
+            if iterator is None:
+                return data
+            block_num = par_num = line_num = word_num = 0
+            for word in tesserocr.iterate_level(iterator, tesserocr.RIL.WORD):
+                box = word.BoundingBox(tesserocr.RIL.WORD)
+                if box is None:
+                    continue
+                if word.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                    block_num, par_num, line_num = block_num + 1, 0, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.PARA):
+                    par_num, line_num = par_num + 1, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line_num, word_num = line_num + 1, 0
+                word_num += 1
+                left, top, right, bottom = box
+                row = (_WORD_LEVEL, 1, block_num, par_num, line_num, word_num,
+                       left, top, right - left, bottom - top,
+                       word.Confidence(tesserocr.RIL.WORD),
+                       word.GetUTF8Text(tesserocr.RIL.WORD) or '')
+                for key, value in zip(DATA_KEYS, row):
+                    data[key].append(value)
+        return data
+
+    @staticmethod
+    def _set_image(api, image):
+        image = np.ascontiguousarray(image)
+        if image.ndim == 3:
+            image = np.ascontiguousarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            bytes_per_pixel = 3
+        else:
+            bytes_per_pixel = 1
+        height, width = image.shape[:2]
+        api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+
+    def _engine(self, lang, config):
+        key = (lang, config)
+        with self._lock:
+            pool = self._pools.setdefault(key, queue.LifoQueue())
+            create = pool.empty() and self._created.get(key, 0) < self.pool_size
+            if create:
+                self._created[key] = self._created.get(key, 0) + 1
+        if not create:
+            return _PooledEngine(pool, pool.get())
+        try:
+            return _PooledEngine(pool, _create_engine(lang, config))
+        except Exception:
+            with self._lock:
+                self._created[key] -= 1
+            raise
+
+
+class _PooledEngine:
+    """Context manager returning an engine to its pool."""
+
+    def __init__(self, pool, api):
+        self._pool = pool
+        self._api = api
+
+    def __enter__(self):
+        return self._api
+
+    def __exit__(self, *exc_info):
+        self._api.Clear()
+        self._pool.put(self._api)
+
+
+def _create_engine(lang, config):
+    oem = re.search(r'--oem (\d+)', config)
+    psm = re.search(r'--psm (\d+)', config)
+    return tesserocr.PyTessBaseAPI(
+        lang=lang,
+        oem=int(oem.group(1)) if oem else tesserocr.OEM.DEFAULT,
+        psm=int(psm.group(1)) if psm else tesserocr.PSM.AUTO)
+
+
+class StubBackend:
+    """
+    Deterministic stand-in for Tesseract.
+
+    Words from STUB_WORDS are laid out on a fixed grid of lines over the image and picked by a
+    checksum of the image, so the same image always gives the same words and boxes. Every
+    call sleeps STUB_OCR_LATENCY seconds plus STUB_OCR_LATENCY_PER_MP per megapixel.
+    """
+
+    name = 'stub'
+    STUB_WORDS = ('Пациент', 'Иванов', 'Иван', 'Петрович', 'поступил', 'в', 'отделение',
+                  'с', 'жалобами', 'на', 'боль', 'Диагноз', 'Адрес', 'Москва', 'ул.',
+                  'Ленина', 'Врач', 'Петрова', 'дата', 'рождения', '01.02.1980')
+    LINE_HEIGHT = 32
+    LINE_SPACING = 64
+    WORD_WIDTH = 150
+    WORD_SPACING = 170
+
+    def __init__(self, latency=None, latency_per_mp=None):
+        self.latency = STUB_OCR_LATENCY if latency is None else latency
+        self.latency_per_mp = STUB_OCR_LATENCY_PER_MP if latency_per_mp is None else latency_per_mp
+
+    def image_to_string(self, image: np.ndarray, lang: str, config: str) -> str:
+        """Return the text of the stub words, one line per grid line."""
+        data = self.image_to_data(image, lang, config)
+        lines = {}
+        for line_num, text in zip(data['line_num'], data['text']):
+            lines.setdefault(line_num, []).append(text)
+        return '\n'.join(' '.join(words) for words in lines.values())
+
+    def image_to_data(self, image: np.ndarray, lang: str, config: str) -> dict:
+        """Return the stub words in the pytesseract data dictionary layout."""
+        height, width = image.shape[:2]
+        time.sleep(self.latency + self.latency_per_mp * height * width / 1e6)
+        seed = zlib.crc32(np.ascontiguousarray(image[::16, ::16]).tobytes())
+        data = {key: [] for key in DATA_KEYS}
+        tops = range(self.LINE_SPACING // 2, height - self.LINE_HEIGHT, self.LINE_SPACING)
+        for line_num, top in enumerate(tops, start=1):
+            lefts = range(self.WORD_SPACING // 4, width - self.WORD_WIDTH, self.WORD_SPACING)
+            for word_num, left in enumerate(lefts, start=1):
+                text = self.STUB_WORDS[(seed + line_num * 7 + word_num) % len(self.STUB_WORDS)]
+                row = (_WORD_LEVEL, 1, 1, 1, line_num, word_num,
+                       left, top, self.WORD_WIDTH, self.LINE_HEIGHT, 95.0, text)
+                for key, value in zip(DATA_KEYS, row):
+                    data[key].append(value)
+        return data
+
+
+BACKENDS = {
+    PytesseractBackend.name: PytesseractBackend,
+    TesserocrBackend.name: TesserocrBackend,
+    StubBackend.name: StubBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def _forget_backends_in_child():
+    # Движки Tesseract не переживают fork: в дочернем процессе создаём свои
+    global _backends_lock  # pylint: disable=global-statement
+    _backends_lock = threading.Lock()
+    _backends.clear()
+
+
+os.register_at_fork(after_in_child=_forget_backends_in_child)
+
+
+def get_ocr_backend(name=None):
+    """
+    Return the OCR backend of this process.
+
+    Args:
+        name (str): ``tesserocr``, ``pytesseract``, ``stub`` or ``auto``. Defaults to OCR_BACKEND.
+
+    Returns:
+        PytesseractBackend | TesserocrBackend | StubBackend: The backend instance, shared by
+        the process.
+
+    Raises:
+        ValueError: If the backend name is unknown.
+        ImportError: If ``tesserocr`` is selected but the tesserocr package is not installed.
+    """
+    name = name or OCR_BACKEND
+    if name == 'auto':
+        name = TesserocrBackend.name if tesserocr is not None else PytesseractBackend.name
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown OCR backend {name!r}, expected one of {', '.join(BACKENDS)} or auto")
+    if name == TesserocrBackend.name and tesserocr is None:
+        raise ImportError("OCR backend 'tesserocr' requires the optional tesserocr package: "
+                          "pip install -r requirements-tesserocr.txt (needs the Tesseract and "
+                          "Leptonica headers), or set OCR_BACKEND=auto to use pytesseract")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = BACKENDS[name]()
+        return _backends[name]
@@ -0,0 +1,293 @@
+"""Content-addressed cache for OCR word boxes and detected personal data.
+
+Records are keyed by the SHA-256 of the file content plus everything that changes the
+result (OCR language, Tesseract config, preprocessing version, model name). The cache has
+a bounded in-memory LRU tier and an optional on-disk tier in a directory shared by all
+gunicorn workers. Both tiers expire records after a TTL (a background thread of every process
+using the cache removes them every OCR_CACHE_EXPIRE_INTERVAL seconds, not only when they are
+read), the disk tier is also bounded by size, and every record can be erased with
+secure_delete. The storage janitor applies RESULT_TTL and STORAGE_MAX_BYTES to the disk tier
+as well and exports the size of both tiers.
+
+The records hold the recognized text of the documents and the personal data found in them,
+which the service otherwise deletes as soon as a document is processed, so the cache is off
+unless OCR_CACHE_ENABLED is set to ``1``.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_ENABLED = os.environ.get('OCR_CACHE_ENABLED', '0') == '1'
+CACHE_SIZE = int(os.environ.get('OCR_CACHE_SIZE', '128'))
+CACHE_DIR = os.environ.get('OCR_CACHE_DIR') or None
+CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+CACHE_TTL = float(os.environ.get('OCR_CACHE_TTL', '3600'))
+CACHE_EXPIRE_INTERVAL = float(os.environ.get('OCR_CACHE_EXPIRE_INTERVAL', '60'))
+
+_CHUNK_SIZE = 1024 * 1024
+_EXTENSIONS = ('.bin', '.json')
+
+
+def file_digest(file_path):
+    """
+    Compute the SHA-256 digest of a file's content.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        str: Hex digest of the content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def array_digest(array):
+    """
+    Compute the SHA-256 digest of an image array, including its shape and type.
+
+    Args:
+        array (np.ndarray): The image.
+
+    Returns:
+        str: Hex digest of the pixels.
+    """
+    digest = hashlib.sha256(f'{array.shape}{array.dtype}'.encode('ascii'))
+    digest.update(memoryview(array if array.flags.c_contiguous else array.copy()).cast('B'))
+    return digest.hexdigest()
+
+
+def make_key(content_digest, *settings):
+    """
+    Build a cache key from a content digest and the settings that affect the record.
+
+    Args:
+        content_digest (str): Digest returned by file_digest.
+        *settings: Values such as the record kind, language and OCR config.
+
+    Returns:
+        str: Key of the form ``<content digest>-<settings digest>``.
+    """
+    settings_digest = hashlib.sha256(repr(settings).encode('utf-8')).hexdigest()[:16]
+    return f'{content_digest}-{settings_digest}'
+
+
+def secure_delete(path):
+    """
+    Overwrite a file with zeros, flush it to disk and unlink it.
+
+    Args:
+        path (str): Path to the file. Missing files are ignored.
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'r+b') as file:
+            remaining = size
+            while remaining > 0:
+                written = file.write(b'\0' * min(remaining, _CHUNK_SIZE))
+                remaining -= written
+            file.flush()
+            os.fsync(file.fileno())
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ResultCache:
+    """Two-tier (memory LRU + optional shared directory) cache of JSON-serializable records
+    and of bytes (e.g. serialized word tables), which are stored on disk as they are."""
+
+    def __init__(self, max_entries=CACHE_SIZE, disk_dir=None, max_disk_bytes=CACHE_MAX_BYTES,
+                 ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        """Return the record stored under key, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+
+        value = self._read_disk(key, now)
+        if value is not None:
+            self._put_memory(key, value, now)
+        return value
+
+    def put(self, key, value):
+        """Store a record in both tiers."""
+        now = time.time()
+        self._put_memory(key, value, now)
+        if self.disk_dir:
+            self._write_disk(key, value)
+            self._evict_disk(now)
+
+    def delete(self, key):
+        """Remove a record from both tiers, erasing its disk copy."""
+        with self._lock:
+            self._memory.pop(key, None)
+        if self.disk_dir:
+            for extension in _EXTENSIONS:
+                secure_delete(self._disk_path(key, extension))
+
+    def forget(self, content_digest):
+        """Remove every record derived from the content with the given digest."""
+        prefix = f'{content_digest}-'
+        with self._lock:
+            for key in [key for key in self._memory if key.startswith(prefix)]:
+                del self._memory[key]
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.startswith(prefix):
+                    secure_delete(os.path.join(self.disk_dir, name))
+
+    def expire(self):
+        """Remove the expired records from both tiers, erasing their disk copies."""
+        now = time.time()
+        with self._lock:
+            for key in [key for key, (stored_at, _) in self._memory.items()
+                        if now - stored_at > self.ttl]:
+                del self._memory[key]
+        if self.disk_dir:
+            self._evict_disk(now)
+
+    def memory_usage(self):
+        """Return the approximate size in bytes and the number of the records held in memory."""
+        with self._lock:
+            values = [value for _, value in self._memory.values()]
+        size = sum(len(value) if isinstance(value, bytes)
+                   else len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+                   for value in values)
+        return size, len(values)
+
+    def clear(self):
+        """Remove every record from both tiers, erasing the disk copies."""
+        with self._lock:
+            self._memory.clear()
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                secure_delete(os.path.join(self.disk_dir, name))
+
+    def _put_memory(self, key, value, now):
+        with self._lock:
+            self._memory[key] = (now, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_path(self, key, extension='.json'):
+        return os.path.join(self.disk_dir, f'{key}{extension}')
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None
+        for extension in _EXTENSIONS:
+            path = self._disk_path(key, extension)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    secure_delete(path)
+                    return None
+                if extension == '.bin':
+                    with open(path, 'rb') as file:
+                        return file.read()
+                with open(path, 'r', encoding='utf-8') as file:
+                    return json.load(file)
+            except FileNotFoundError:
+                continue
+            except ValueError:
+                return None
+        return None
+
+    def _write_disk(self, key, value):
+        # Пишем во временный файл и атомарно переименовываем, чтобы другие воркеры
+        # не прочитали запись наполовину.
+        binary = isinstance(value, bytes)
+        fd, temp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        try:
+            if binary:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(value)
+            else:
+                with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                    json.dump(value, file, ensure_ascii=False)
+            os.replace(temp_path, self._disk_path(key, '.bin' if binary else '.json'))
+        except BaseException:
+            secure_delete(temp_path)
+            raise
+
+    def _evict_disk(self, now):
+        records = []
+        total_bytes = 0
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(_EXTENSIONS):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                secure_delete(path)
+                continue
+            records.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        records.sort()
+        for _, size, path in records:
+            if total_bytes <= self.max_disk_bytes:
+                break
+            secure_delete(path)
+            total_bytes -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_expiry_pid = None
+
+
+def _expire_periodically(cache):
+    while True:
+        time.sleep(CACHE_EXPIRE_INTERVAL)
+        cache.expire()
+
+
+def get_cache():
+    """
+    Return the process-wide cache configured from the OCR_CACHE_* environment variables.
+
+    Returns:
+        Optional[ResultCache]: The cache, or None if caching is disabled.
+    """
+    global _cache, _expiry_pid  # pylint: disable=global-statement
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None or _expiry_pid != os.getpid():
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(disk_dir=CACHE_DIR)
+            # Потоки не переживают fork, поэтому каждый процесс (воркер gunicorn, процесс
+            # пула заданий) запускает свой
+            if _expiry_pid != os.getpid():
+                _expiry_pid = os.getpid()
+                threading.Thread(target=_expire_periodically, args=(_cache,),
+                                 name='ocr-cache-expiry', daemon=True).start()
+    return _cache
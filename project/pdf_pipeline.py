@@ -0,0 +1,305 @@
+"""Streaming, parallel anonymization of PDF pages.
+
+Pages are rendered lazily one at a time, OCR'd and redacted in memory, and handed back as
+encoded bytes (see result_packager) in page order. At most ``window`` pages are in flight
+at once, so peak memory does not grow with the page count.
+
+PDF_PIPELINE selects how pages are processed in parallel:
+
+- ``staged`` (default): rendering, OCR with redaction and encoding are separate stages with
+  their own worker threads (PDF_RENDER_WORKERS, PDF_OCR_WORKERS, PDF_ENCODE_WORKERS) joined
+  by queues of at most PDF_QUEUE_SIZE pages, so page N+1 is rendered while page N is in
+  OCR. Poppler and Tesseract run as subprocesses and OpenCV releases the GIL, so the
+  threads overlap. Queue depths and the busy share of each stage are recorded in metrics
+  and passed to the ``report`` callback.
+- ``pool``: every page goes through all the steps in one process of a pool of PDF_WORKERS.
+"""
+
+import contextvars
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
+
+import format_converter as converter
+import image_anonymizer
+import metrics
+import result_packager
+
+PDF_PIPELINE = os.environ.get('PDF_PIPELINE', 'staged')
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', str(os.cpu_count() or 1)))
+PDF_WINDOW = int(os.environ.get('PDF_WINDOW', str(2 * PDF_WORKERS)))
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', '2'))
+PDF_OCR_WORKERS = int(os.environ.get('PDF_OCR_WORKERS', str(os.cpu_count() or 1)))
+PDF_ENCODE_WORKERS = int(os.environ.get('PDF_ENCODE_WORKERS', '1'))
+PDF_QUEUE_SIZE = int(os.environ.get('PDF_QUEUE_SIZE', '2'))
+
+# Как часто заблокированные потоки конвейера проверяют, не остановлен ли он
+_POLL_INTERVAL = 0.1
+_DONE = object()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process pool shared by all PDF requests of this worker, creating it lazily."""
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+        return _executor
+
+
+def _reset_executor():
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def anonymize_pdf_page(pdf_path, page_number, words_to_anonymize, image_format=None):
+    """
+    Render, OCR and redact a single PDF page in memory.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        page_number (int): Number of the page, starting from 1.
+        words_to_anonymize (Set[str]): Personal data phrases to cover on the page.
+        image_format (str): Page encoding, see result_packager.encode_page.
+
+    Returns:
+        bytes: The redacted page, encoded.
+    """
+    image = converter.render_pdf_page_bgr(pdf_path, page_number)
+    image = image_anonymizer.anonymize_image(image, words_to_anonymize)
+    return result_packager.encode_page(image, image_format)
+
+
+class StageReport(NamedTuple):
+    """Load of one stage of a staged run."""
+    name: str
+    workers: int
+    items: int
+    busy_s: float
+    utilization: float
+    max_queue: int
+    mean_queue: float
+
+
+class _Stage:
+    def __init__(self, name, function, workers, queue_size):
+        self.name = name
+        self.function = function
+        self.workers = max(workers, 1)
+        self.queue = queue.Queue(maxsize=max(queue_size, 1))
+        self.running = self.workers
+        self.items = 0
+        self.busy_s = 0.0
+        self.depths = []
+        self.lock = threading.Lock()
+
+    def report(self, wall_s):
+        return StageReport(
+            name=self.name, workers=self.workers, items=self.items, busy_s=self.busy_s,
+            utilization=self.busy_s / (wall_s * self.workers) if wall_s > 0 else 0.0,
+            max_queue=max(self.depths, default=0),
+            mean_queue=sum(self.depths) / len(self.depths) if self.depths else 0.0)
+
+
+def iter_staged(items, stages, queue_size=PDF_QUEUE_SIZE, window=PDF_WINDOW, report=None):
+    """
+    Pass items through a chain of stages, each run by its own worker threads.
+
+    Args:
+        items (Iterable): Inputs of the first stage.
+        stages (List[Tuple[str, Callable, int]]): Name, function and worker count of every
+            stage; a stage function gets the result of the previous one.
+        queue_size (int): Maximum number of items waiting in front of a stage.
+        window (int): Maximum number of items between the input and the consumer.
+        report (Callable): Called with the list of StageReport when the run ends.
+
+    Yields:
+        The results of the last stage, in the order of items.
+
+    Raises:
+        Exception: The first exception raised by a stage function; the run is stopped.
+    """
+    runners = [_Stage(name, function, workers, queue_size) for name, function, workers in stages]
+    results = queue.Queue()
+    stop = threading.Event()
+    slots = threading.Semaphore(max(window, 1))
+
+    def put(target, entry):
+        while not stop.is_set():
+            try:
+                target.put(entry, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def feed():
+        for index, item in enumerate(items):
+            while not slots.acquire(timeout=_POLL_INTERVAL):
+                if stop.is_set():
+                    return
+            put(runners[0].queue, (index, item))
+        for _ in range(runners[0].workers):
+            put(runners[0].queue, _DONE)
+
+    def work(position):
+        runner = runners[position]
+        following = runners[position + 1] if position + 1 < len(runners) else None
+        while not stop.is_set():
+            try:
+                entry = runner.queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if entry is _DONE:
+                break
+            depth = runner.queue.qsize()
+            index, value = entry
+            started = time.perf_counter()
+            try:
+                value = runner.function(value)
+            except BaseException as error:  # pylint: disable=broad-except
+                results.put((index, error))
+                stop.set()
+                return
+            with runner.lock:
+                runner.items += 1
+                runner.busy_s += time.perf_counter() - started
+                runner.depths.append(depth)
+            if following is None:
+                results.put((index, value))
+            else:
+                put(following.queue, (index, value))
+        if stop.is_set():
+            return
+        with runner.lock:
+            runner.running -= 1
+            last = runner.running == 0
+        if last and following is None:
+            results.put(_DONE)
+        elif last:
+            for _ in range(following.workers):
+                put(following.queue, _DONE)
+
+    # Каждый поток получает копию контекста запроса, чтобы этапы попали в Server-Timing
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(feed,), daemon=True)]
+    threads.extend(threading.Thread(target=contextvars.copy_context().run, args=(work, position),
+                                    daemon=True)
+                   for position, runner in enumerate(runners) for _ in range(runner.workers))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    finished = {}
+    next_index = 0
+    try:
+        while True:
+            entry = results.get()
+            if entry is _DONE:
+                break
+            index, value = entry
+            if isinstance(value, BaseException):
+                raise value
+            finished[index] = value
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+                slots.release()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        wall_s = time.perf_counter() - started
+        reports = [runner.report(wall_s) for runner in runners]
+        for runner, stage_report in zip(runners, reports):
+            metrics.observe(metrics.PIPELINE_UTILIZATION, stage_report.utilization, stage=runner.name)
+            for depth in runner.depths:
+                metrics.observe(metrics.PIPELINE_QUEUE_DEPTH, depth, stage=runner.name)
+        if report is not None:
+            report(reports)
+
+
+def iter_staged_pages(pdf_path, words_to_anonymize, window=PDF_WINDOW, image_format=None,
+                      report=None):
+    """
+    Anonymize the pages of a PDF in the render, OCR and encode stages (see iter_staged).
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        words_to_anonymize (Set[str]): Personal data phrases to cover on every page.
+        window (int): Maximum number of pages between rendering and the consumer.
+        image_format (str): Page encoding, see result_packager.encode_page.
+        report (Callable): Called with the list of StageReport when the run ends.
+
+    Yields:
+        Tuple[int, bytes]: Page number (from 1) and the encoded redacted page.
+    """
+    image_format = image_format or result_packager.page_format()
+    page_numbers = range(1, converter.get_pdf_page_count(pdf_path) + 1)
+    stages = [
+        ('render', lambda page_number: converter.render_pdf_page_bgr(pdf_path, page_number),
+         PDF_RENDER_WORKERS),
+        ('ocr', lambda image: image_anonymizer.anonymize_image(image, words_to_anonymize),
+         PDF_OCR_WORKERS),
+        ('encode', lambda image: result_packager.encode_page(image, image_format),
+         PDF_ENCODE_WORKERS),
+    ]
+    yield from zip(page_numbers, iter_staged(page_numbers, stages, window=window, report=report))
+
+
+def iter_anonymized_pages(pdf_path, words_to_anonymize, workers=PDF_WORKERS, window=PDF_WINDOW,
+                          image_format=None, pipeline=None, report=None):
+    """
+    Anonymize the pages of a PDF in parallel and yield them in page order.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        words_to_anonymize (Set[str]): Personal data phrases to cover on every page.
+        workers (int): Number of pool processes in ``pool`` mode; 1 processes pages in the
+            calling process.
+        window (int): Maximum number of pages rendered or processed at the same time.
+        image_format (str): Page encoding, see result_packager.encode_page.
+        pipeline (str): ``staged`` or ``pool``; defaults to PDF_PIPELINE.
+        report (Callable): In ``staged`` mode, called with the list of StageReport.
+
+    Yields:
+        Tuple[int, bytes]: Page number (from 1) and the encoded redacted page.
+    """
+    image_format = image_format or result_packager.page_format()
+    if (pipeline or PDF_PIPELINE) == 'staged':
+        yield from iter_staged_pages(pdf_path, words_to_anonymize, window, image_format, report)
+        return
+    page_count = converter.get_pdf_page_count(pdf_path)
+    if workers <= 1:
+        for page_number in range(1, page_count + 1):
+            yield page_number, anonymize_pdf_page(
+                pdf_path, page_number, words_to_anonymize, image_format)
+        return
+
+    executor = get_executor()
+    pending = deque()
+    next_page = 1
+    try:
+        while next_page <= page_count or pending:
+            while next_page <= page_count and len(pending) < max(window, 1):
+                future = executor.submit(
+                    anonymize_pdf_page, pdf_path, next_page, words_to_anonymize, image_format)
+                pending.append((next_page, future))
+                next_page += 1
+            page_number, future = pending.popleft()
+            yield page_number, future.result()
+    except BrokenProcessPool:
+        _reset_executor()
+        raise
+    finally:
+        for _, future in pending:
+            future.cancel()
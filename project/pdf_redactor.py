@@ -0,0 +1,103 @@
+"""Native PDF redaction through the PDF text layer.
+
+Born-digital pages are searched with PyMuPDF word coordinates and redacted with real
+redaction annotations, so the output is a small vector PDF with the covered text removed.
+Only pages without a text layer (scans) are rendered and OCR'd; their word boxes are
+mapped back onto the page and the image pixels under them are blacked out.
+"""
+
+import os
+from typing import Dict, NamedTuple
+
+import fitz  # PyMuPDF
+
+import format_converter as converter
+import metrics
+import text_recognizer
+import word_matcher
+from word_table import WordTable
+
+PDF_REDACTION_MODE = os.environ.get('PDF_REDACTION_MODE', 'native')
+OCR_DPI = 200
+
+
+class PdfText(NamedTuple):
+    """Text of a PDF document and the OCR word boxes of the pages that had no text layer."""
+    text: str
+    ocr_pages: Dict[int, WordTable]
+
+
+def has_text_layer(page):
+    """Return True if the page contains extractable words."""
+    return bool(page.get_text('words'))
+
+
+@metrics.timed('pdf_text')
+def extract_text(pdf_path, lang='rus'):
+    """
+    Extract the text of every page, running OCR only on pages without a text layer.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        lang (str): OCR language for scanned pages.
+
+    Returns:
+        PdfText: The document text and the OCR words of the scanned pages by page index.
+    """
+    texts = []
+    ocr_pages = {}
+    with fitz.open(pdf_path) as doc:
+        metrics.observe(metrics.DOCUMENT_PAGES, doc.page_count)
+        for page in doc:
+            if has_text_layer(page):
+                texts.append(page.get_text())
+                continue
+            with metrics.stage('render'):
+                image = converter.pixmap_to_bgr(page.get_pixmap(dpi=OCR_DPI))
+            ocr_result = text_recognizer.recognize_image(image, lang=lang)
+            ocr_pages[page.number] = ocr_result.words
+            texts.append(ocr_result.text + '\n')
+    return PdfText(text=''.join(texts), ocr_pages=ocr_pages)
+
+
+def _text_layer_rects(page, matcher):
+    words = word_matcher.words_from_pdf(page.get_text('words'))
+    return [fitz.Rect(box) for box in word_matcher.find_boxes(words, (), matcher)]
+
+
+def _ocr_rects(page, words, matcher):
+    # Координаты OCR даны в пикселях растра OCR_DPI повёрнутой страницы
+    scale = 72 / OCR_DPI
+    boxes = words.span_boxes(matcher.select(words)) * scale
+    return [fitz.Rect(*box) * page.derotation_matrix for box in boxes.tolist()]
+
+
+@metrics.timed('redact_pdf')
+def redact_pdf(pdf_path, words_to_anonymize, output_path, pdf_text):
+    """
+    Write a copy of the PDF with the given words redacted.
+
+    Args:
+        pdf_path (str): Path to the source PDF file.
+        words_to_anonymize (Set[str]): Detected personal data phrases to remove.
+        output_path (str): Path of the redacted PDF.
+        pdf_text (PdfText): Result of extract_text for the same file.
+
+    Returns:
+        str: The output path.
+    """
+    matcher = word_matcher.PhraseMatcher(words_to_anonymize)
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            ocr_words = pdf_text.ocr_pages.get(page.number)
+            if ocr_words is None:
+                rects = _text_layer_rects(page, matcher)
+            else:
+                rects = _ocr_rects(page, ocr_words, matcher)
+            if not rects:
+                continue
+            for rect in rects:
+                page.add_redact_annot(rect, fill=(0, 0, 0))
+            page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_PIXELS)
+        doc.save(output_path, garbage=3, deflate=True)
+    return output_path
@@ -1,12 +1,41 @@
-"""Module to anonymize personal data using Presidio Analyzer."""
-import re
+"""Module to anonymize personal data using Presidio Analyzer.
 
-from presidio_analyzer import AnalyzerEngine
-from presidio_analyzer.nlp_engine import SpacyNlpEngine, NerModelConfiguration
-from spacy.tokens import Doc
+Presidio and spaCy take over a second to import, so they are imported only when the
+analyzer is built or used, not when this module is imported.
+"""
+import os
+import re
+import time
 
+import metrics
+from detection_engine import ClueMatcher, PatternSet
 from text_preprocessor import preprocess
 
+MODEL_NAME = 'ru_core_news_lg'
+NER_BATCH_SIZE = int(os.environ.get('NER_BATCH_SIZE', '64'))
+NER_N_PROCESS = int(os.environ.get('NER_N_PROCESS', '1'))
+# 'full' отправляет в NER все строки; 'tiered' — только строки с подсказками контекста или
+# словами, похожими на части имени (см. name_hints; остальные строки проверяются только регулярками)
+DETECTION_MODE = os.environ.get('DETECTION_MODE', 'full')
+DETECTION_MODES = ('full', 'tiered')
+# Задержка NER заглушки (initialize_stub_analyzer) на одну строку, в секундах
+STUB_NER_LATENCY = float(os.environ.get('STUB_NER_LATENCY', '0.002'))
+STUB_MODEL_NAME = 'stub'
+# Заглушка NER помечает как фамилии слова с типичными окончаниями
+STUB_SURNAME_PATTERN = r'^[а-яё]{2,}(ов|ев|ин|ова|ева|ина|ский|ская)$'
+
+# Слова, из которых состоят имена: с заглавной буквы, целиком заглавными и инициалы
+_CAPITALIZED_WORD = re.compile(r'[А-ЯЁA-Z][а-яёa-z]{2,}')
+_UPPERCASE_WORD = re.compile(r'[А-ЯЁA-Z]{2,}$')
+_INITIALS = re.compile(r'[А-ЯЁA-Z]\.(?:[А-ЯЁA-Z]\.?)?$')
+_TOKEN_PUNCTUATION = '«»"\'()[]{},;'
+# Фамилия в начале предложения узнаётся только по окончанию (Петров, Иванова, Вишневский);
+# прилагательные на -ческий, -ческая фамилиями не бывают
+_SURNAME_ENDING = re.compile(
+    r'[а-яё](?:ов|ев|ёв|ин|ын|ова|ева|ёва|ина|ына|цкий|цкая)$|(?<!че)ск(?:ий|ая)$')
+# После этих знаков с заглавной буквы начинается предложение или значение поля формы
+_SENTENCE_ENDS = ('.', '!', '?', '…', ':')
+
 regex_patterns = {
     'PASSPORT': r'\b\d{2} \d{6}\b',
     'SNILS': r'\b\d{3}-\d{3}-\d{3}[- ]?[А-Яа-яA-Za-z0-9]{2}\b',
@@ -23,6 +52,9 @@ context_clues = {
     'OMS': ['полис', 'ОМС']
 }
 
+compiled_regex_patterns = PatternSet(regex_patterns)
+clue_matcher = ClueMatcher(context_clues)
+
 
 def initialize_analyzer():
     """
@@ -32,65 +64,294 @@ def initialize_analyzer():
       str: Analyzer engine.
     """
 
-    model_config = [{"lang_code": "ru", "model_name": "ru_core_news_lg"}]
+    # pylint: disable=import-outside-toplevel
+    from presidio_analyzer import AnalyzerEngine
+    from presidio_analyzer.nlp_engine import SpacyNlpEngine, NerModelConfiguration
+
+    model_config = [{"lang_code": "ru", "model_name": MODEL_NAME}]
     ner_model_configuration = NerModelConfiguration(default_score=0.9)
     nlp_engine = SpacyNlpEngine(models=model_config, ner_model_configuration=ner_model_configuration)
     return AnalyzerEngine(nlp_engine=nlp_engine, supported_languages=['ru'])
 
 
+def initialize_stub_analyzer(latency=None):
+    """
+    Initialize an analyzer engine that needs no spaCy model, for load tests.
+
+    A blank Russian spaCy pipeline tags every word matching STUB_SURNAME_PATTERN as a person
+    and sleeps ``latency`` seconds per line, so NER takes a configurable time and the results
+    are deterministic.
+
+    Args:
+        latency (float): Seconds per analyzed line. Defaults to STUB_NER_LATENCY.
+
+    Returns:
+        AnalyzerEngine: Analyzer engine with the stub pipeline.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import spacy
+    from spacy.language import Language
+    from presidio_analyzer import AnalyzerEngine
+    from presidio_analyzer.nlp_engine import SpacyNlpEngine, NerModelConfiguration
+
+    if not Language.has_factory('stub_latency'):
+        @Language.factory('stub_latency', default_config={'latency': 0.0})
+        def _stub_latency(nlp, name, latency):  # pylint: disable=unused-argument
+            def delay(doc):
+                time.sleep(latency)
+                return doc
+            return delay
+
+    nlp = spacy.blank('ru')
+    ruler = nlp.add_pipe('entity_ruler')
+    ruler.add_patterns([{'label': 'PER', 'pattern': [{'LOWER': {'REGEX': STUB_SURNAME_PATTERN}}]}])
+    nlp.add_pipe('stub_latency', config={
+        'latency': STUB_NER_LATENCY if latency is None else latency})
+
+    model_config = [{"lang_code": "ru", "model_name": STUB_MODEL_NAME}]
+    ner_model_configuration = NerModelConfiguration(default_score=0.9)
+    nlp_engine = SpacyNlpEngine(models=model_config, ner_model_configuration=ner_model_configuration)
+    # Модель не загружается: AnalyzerEngine не вызывает load(), если nlp уже задан
+    nlp_engine.nlp = {'ru': nlp}
+    return AnalyzerEngine(nlp_engine=nlp_engine, supported_languages=['ru'])
+
+
 def createc_doc_from_tokens(nlp, tokens):
+    from spacy.tokens import Doc  # pylint: disable=import-outside-toplevel
     doc = Doc(nlp.vocab, words=tokens)
     doc = nlp.get_pipe('ner')(doc)
     return doc
 
 
-def find_personal_data(text, analyzer):
+def find_personal_data(text, analyzer, batch_size=None, n_process=None, mode=None):
     """
     Anonymize personal data in the input text.
 
     Args:
         text (str): The input text containing personal data.
         analyzer: Engine analyzer
+        batch_size (int): Number of lines passed to the spaCy pipeline at once.
+        n_process (int): Number of processes used by the spaCy pipeline.
+        mode (str): ``full`` or ``tiered``, see find_personal_data_batch.
 
     Returns:
-        list: A list of found words consists personal data.
+        set: Phrases consisting personal data.
 
     Raises:
         ValueError: If the text is empty after preprocessing or if no entities are found.
     """
-    personal_data_found = []
-    token_sentences = preprocess(text)
+    return find_personal_data_batch([text], analyzer, batch_size, n_process, mode)[0]
+
+
+def find_personal_data_batch(texts, analyzer, batch_size=None, n_process=None, mode=None):
+    """
+    Find personal data in several documents, sending all their lines through NER in one batch.
+
+    Args:
+        texts (List[str]): Texts of the documents.
+        analyzer: Engine analyzer
+        batch_size (int): Number of lines passed to the spaCy pipeline at once.
+            Defaults to NER_BATCH_SIZE.
+        n_process (int): Number of processes used by the spaCy pipeline. Defaults to NER_N_PROCESS.
+        mode (str): ``full`` runs NER on every line; ``tiered`` runs it only on the lines chosen
+            by select_ner_lines. Regex patterns are checked on every line in both modes.
+            Defaults to DETECTION_MODE.
+
+    Returns:
+        List[set]: Phrases consisting personal data, one set per document. Multi-word
+        entities are kept whole and matched to the page words by word_matcher.
+    """
+    mode = mode or DETECTION_MODE
+    if mode not in DETECTION_MODES:
+        raise ValueError(f'Unknown detection mode: {mode}')
+    documents = [_sentence_strings(text) for text in texts]
+    clues = [[clue_matcher.index(sentence_str) for sentence_str in sentences]
+             for sentences in documents]
+
+    lines = []
+    for text, sentences, line_clues in zip(texts, documents, clues):
+        if mode == 'tiered':
+            selected = select_ner_lines(text.split('\n'), line_clues)
+            # Пустые строки analyze_lines_by_nlp_engine в spaCy не отправляет
+            lines.extend(sentence_str if i in selected else ''
+                         for i, sentence_str in enumerate(sentences))
+        else:
+            lines.extend(sentences)
+    nlp_results = iter(analyze_lines_by_nlp_engine(analyzer, lines, batch_size, n_process))
+
+    found_by_document = []
+    for sentences, document_clues in zip(documents, clues):
+        personal_data_found = []
+        prev_str = ""
+        prev_clues = clue_matcher.index(prev_str)
+        for sentence_str, line_clues in zip(sentences, document_clues):
+            personal_data_found.extend(
+                analyze_text_by_regex(sentence_str, prev_str, line_clues, prev_clues))
+            personal_data_found.extend(filter_nlp_results(
+                next(nlp_results), sentence_str, prev_str, line_clues, prev_clues))
+            prev_str, prev_clues = sentence_str, line_clues
+        found_by_document.append({phrase.strip() for phrase in personal_data_found if phrase.strip()})
+
+    return found_by_document
+
+
+def _name_token_kind(token):
+    token = token.strip(_TOKEN_PUNCTUATION)
+    if _CAPITALIZED_WORD.match(token):
+        return 'capitalized'
+    if _INITIALS.match(token):
+        return 'initials'
+    if _UPPERCASE_WORD.match(token):
+        return 'uppercase'
+    return None
 
-    prev_str = ""
-    for sentence in token_sentences:
+
+def name_hints(raw_line):
+    """
+    Find the words of a line that look like parts of a person's name.
+
+    A capitalized word counts if it does not start a sentence or the value of a form field
+    (the line start, or after ".", "!", "?" or ":"), since every sentence starts with one;
+    at the start it counts only with a surname ending (Петров, Иванова).
+    Anywhere in the line a word counts if the word next to it is a name word too: two
+    capitalized words, a word and initials, a word in capitals and a capitalized word
+    ("Иванов Иван", "Иванов И.И.", "ИВАНОВ Иван"). Words in capitals next to each other or
+    alone are mostly abbreviations and headings and do not count.
+
+    Args:
+        raw_line (str): A line of the document before preprocessing.
+
+    Returns:
+        Tuple[List[int], int]: Indexes of the name words among the whitespace-separated
+        tokens of the line, and the number of the tokens.
+    """
+    tokens = raw_line.split()
+    kinds = [_name_token_kind(token) for token in tokens]
+    # Пара слов не переходит через конец предложения или подпись поля, кроме инициалов (И.И. Иванов)
+    joined = [kind == 'initials' or not token.endswith(_SENTENCE_ENDS)
+              for token, kind in zip(tokens, kinds)]
+
+    def is_pair(left):
+        return (0 <= left < len(kinds) - 1 and joined[left]
+                and None not in kinds[left:left + 2] and kinds[left:left + 2] != ['uppercase'] * 2)
+
+    hints = []
+    for i, kind in enumerate(kinds):
+        if kind is None:
+            continue
+        starts_sentence = i == 0 or not joined[i - 1]
+        surname = _SURNAME_ENDING.search(tokens[i].strip(_TOKEN_PUNCTUATION + '.!?…:'))
+        if (is_pair(i - 1) or is_pair(i)
+                or (kind == 'capitalized' and (surname or not starts_sentence))):
+            hints.append(i)
+    return hints, len(tokens)
+
+
+def select_ner_lines(raw_lines, line_clues):
+    """
+    Choose the lines worth sending through NER in tiered mode.
+
+    Entities of types with context clues are kept only if a clue is in their line or the
+    previous one, so a line with a clue selects itself and the next line. Other entity types
+    are names, so a line with name words (see name_hints) selects itself, and the previous or
+    the next line if a name word is the first or the last word, as a name may go on there.
+
+    Args:
+        raw_lines (List[str]): Lines of the document before preprocessing (it lowercases them).
+        line_clues (List[LineClues]): Clue index of every preprocessed line.
+
+    Returns:
+        Set[int]: Indexes of the selected lines.
+    """
+    selected = set()
+    for i, (raw_line, clues) in enumerate(zip(raw_lines, line_clues)):
+        if clues.has_any():
+            selected.update((i, i + 1))
+        hints, token_count = name_hints(raw_line)
+        if hints:
+            selected.add(i)
+            if hints[0] == 0:
+                selected.add(i - 1)
+            if hints[-1] == token_count - 1:
+                selected.add(i + 1)
+    return {i for i in selected if 0 <= i < len(line_clues)}
+
+
+def _sentence_strings(text):
+    sentence_strings = []
+    for sentence in preprocess(text):
         if isinstance(sentence, list):
-            sentence_str = " ".join(sentence)
+            sentence_strings.append(" ".join(sentence))
         else:
-            sentence_str = sentence
+            sentence_strings.append(sentence)
+    return sentence_strings
 
-        personal_data_found.extend(analyze_text_by_regex(sentence_str, prev_str))
-        personal_data_found.extend(analyze_by_nlp_engine(analyzer, sentence_str, prev_str))
-        prev_str = sentence_str
 
-    return set(split_words_in_array(personal_data_found))
+@metrics.timed('ner')
+def analyze_lines_by_nlp_engine(analyzer, lines, batch_size=None, n_process=None):
+    """
+    Run NER on many lines through the batched spaCy pipeline.
+
+    Args:
+        analyzer: Engine analyzer
+        lines (List[str]): Lines to analyze.
+        batch_size (int): Number of lines passed to the spaCy pipeline at once.
+        n_process (int): Number of processes used by the spaCy pipeline.
+
+    Returns:
+        List[List[RecognizerResult]]: Recognizer results for every line, in the input order.
+    """
+    results = [[] for _ in lines]
+    # Пустые строки не отправляем в spaCy: сущностей в них нет
+    indexes = [i for i, line in enumerate(lines) if line]
+    if not indexes:
+        return results
+
+    from presidio_analyzer import BatchAnalyzerEngine  # pylint: disable=import-outside-toplevel
+    batch_analyzer = BatchAnalyzerEngine(analyzer_engine=analyzer)
+    batch_results = batch_analyzer.analyze_iterator(
+        [lines[i] for i in indexes],
+        language='ru',
+        batch_size=batch_size or NER_BATCH_SIZE,
+        n_process=n_process or NER_N_PROCESS,
+        score_threshold=0.9)
+    for i, line_results in zip(indexes, batch_results):
+        results[i] = line_results
+    return results
 
 
 def analyze_by_nlp_engine(analyzer, sentence_str, prev_line):
-    found_entities = []
     result = analyzer.analyze(text=sentence_str, language='ru', score_threshold=0.9)
+    return filter_nlp_results(result, sentence_str, prev_line)
+
+
+def filter_nlp_results(result, sentence_str, prev_line, line_clues=None, prev_line_clues=None):
+    """
+    Keep the NER results that are personal data: entities of types with context clues
+    are kept only if a clue is nearby.
+
+    Args:
+        result (List[RecognizerResult]): Results of the analyzer for the line.
+        sentence_str (str): The analyzed line.
+        prev_line (str): Previous line from document.
+        line_clues (LineClues): Clue index of the line, built if missing.
+        prev_line_clues (LineClues): Clue index of the previous line, built if missing.
+
+    Returns:
+        list: Texts of the kept entities.
+    """
+    found_entities = []
+    line_clues = line_clues or clue_matcher.index(sentence_str)
+    prev_line_clues = prev_line_clues or clue_matcher.index(prev_line)
 
     for obj in result:
-        entity = sentence_str[obj.to_dict()['start']:obj.to_dict()['end']]
-        entity_type = obj.to_dict()['entity_type']
+        entity = sentence_str[obj.start:obj.end]
+        entity_type = obj.entity_type
 
-        if entity_type not in context_clues:
+        if (entity_type not in context_clues
+                or clue_matcher.is_contextualized(entity_type, entity, line_clues, prev_line_clues)):
             found_entities.append(entity)
-        else:
-            clues = context_clues[entity_type]
-            contextualized_opt = contextualize(clues, entity, sentence_str, prev_line)
-
-            if contextualized_opt is not None:
-                found_entities.append(contextualized_opt)
 
     return found_entities
 
@@ -108,10 +369,13 @@ def contextualize(context_tips, context_element, context, prev_line):
     Returns:
         Optional[str]: The context element if found, otherwise None.
     """
+    context_lower = context.lower()
+    element_pattern = re.escape(context_element.lower())
     for clue in context_tips:
+        clue_pattern = re.escape(clue.lower())
 
-        if (re.search(rf'{clue.lower()}.{{0,50}}{context_element.lower()}', context.lower())
-                or re.search(rf'{context_element.lower()}.{{0,50}}{clue.lower()}', context.lower())
+        if (re.search(rf'{clue_pattern}.{{0,50}}{element_pattern}', context_lower)
+                or re.search(rf'{element_pattern}.{{0,50}}{clue_pattern}', context_lower)
                 or clue in context_element
                 or clue in prev_line):
             return context_element
@@ -119,23 +383,32 @@ def contextualize(context_tips, context_element, context, prev_line):
     return None
 
 
-def analyze_text_by_regex(text, prev_str):
+def analyze_text_by_regex(text, prev_str, line_clues=None, prev_line_clues=None):
+    """
+    Find personal data matching regex_patterns; a line without matches is scanned once.
+
+    Args:
+        text (str): The line to search.
+        prev_str (str): Previous line from document.
+        line_clues (LineClues): Clue index of the line, built if missing.
+        prev_line_clues (LineClues): Clue index of the previous line, built if missing.
+
+    Returns:
+        list: Matches of patterns without context clues and contextualized matches of the rest.
+    """
     matches_with_context = []
 
-    for pattern_name, pattern in regex_patterns.items():
-        matches = re.findall(pattern, text)
+    for pattern_name, match in compiled_regex_patterns.finditer(text):
+        matched_text = match.group()
 
         if pattern_name not in context_clues:
-            matches_with_context.extend(matches)
+            matches_with_context.append(matched_text)
             continue
 
-        clues = context_clues[pattern_name]
-
-        for match in matches:
-            contextualized_match_opt = contextualize(clues, match, text, prev_str)
-
-            if contextualized_match_opt is not None:
-                matches_with_context.append(match)
+        line_clues = line_clues or clue_matcher.index(text)
+        prev_line_clues = prev_line_clues or clue_matcher.index(prev_str)
+        if clue_matcher.is_contextualized(pattern_name, matched_text, line_clues, prev_line_clues):
+            matches_with_context.append(matched_text)
 
     return matches_with_context
 
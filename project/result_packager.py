@@ -0,0 +1,156 @@
+"""Packaging of anonymized raster pages into a single downloadable result.
+
+Pages are encoded one by one as they come out of the pipeline and written straight into
+the container, which is produced as a stream of byte chunks: the caller can send the chunks
+to the client or write them to a file, and no page is kept as a decoded image or written to
+a temporary file.
+
+RASTER_CONTAINER selects the container: ``zip`` (one image per page) or ``pdf`` (one
+multi-page PDF). RASTER_FORMAT selects the page encoding: ``jpeg``, ``png`` or ``webp``;
+RASTER_QUALITY is the JPEG/WebP quality. PDF pages cannot hold WebP, so the PDF container
+stores WebP pages as JPEG.
+"""
+
+import io
+import os
+import zipfile
+
+import cv2
+import fitz  # PyMuPDF
+
+import metrics
+
+RASTER_CONTAINER = os.environ.get('RASTER_CONTAINER', 'zip')
+RASTER_FORMAT = os.environ.get('RASTER_FORMAT', 'jpeg')
+RASTER_QUALITY = int(os.environ.get('RASTER_QUALITY', '90'))
+
+FORMATS = {
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'png': ('.png', None),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+}
+CONTAINERS = {
+    'zip': ('.zip', 'application/zip'),
+    'pdf': ('.pdf', 'application/pdf'),
+}
+
+
+def page_format(container=None, image_format=None):
+    """Return the page encoding used for the given container."""
+    image_format = image_format or RASTER_FORMAT
+    if (container or RASTER_CONTAINER) == 'pdf' and image_format == 'webp':
+        return 'jpeg'
+    return image_format
+
+
+@metrics.timed('encode_page')
+def encode_page(image, image_format=None, quality=None):
+    """
+    Encode an anonymized page.
+
+    Args:
+        image (np.ndarray): The BGR page.
+        image_format (str): ``jpeg``, ``png`` or ``webp``; defaults to page_format().
+        quality (int): JPEG/WebP quality; defaults to RASTER_QUALITY.
+
+    Returns:
+        bytes: The encoded page.
+    """
+    extension, quality_flag = FORMATS[image_format or page_format()]
+    params = [] if quality_flag is None else [quality_flag, quality or RASTER_QUALITY]
+    _, encoded = cv2.imencode(extension, image, params)
+    return encoded.tobytes()
+
+
+def extension(container=None):
+    """Return the file extension of the result, e.g. ``.zip``."""
+    return CONTAINERS[container or RASTER_CONTAINER][0]
+
+
+def mimetype(container=None):
+    """Return the MIME type of the result."""
+    return CONTAINERS[container or RASTER_CONTAINER][1]
+
+
+class _ChunkWriter(io.RawIOBase):
+    """Unseekable sink collecting the bytes written by zipfile until they are drained."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunk = b''.join(self._chunks)
+        self._chunks = []
+        return chunk
+
+
+def iter_zip(pages, image_format=None):
+    """
+    Write encoded pages into a zip archive and yield the archive as it grows.
+
+    Args:
+        pages (Iterable[bytes]): Encoded pages in page order.
+        image_format (str): Encoding of the pages, used for the member names.
+
+    Yields:
+        bytes: Consecutive chunks of the archive.
+    """
+    page_extension = FORMATS[image_format or page_format('zip')][0]
+    sink = _ChunkWriter()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for i, encoded_page in enumerate(pages):
+            with metrics.stage('package'):
+                archive.writestr(f'Image_{i}{page_extension}', encoded_page)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    yield sink.drain()
+
+
+def iter_pdf(pages, source_pdf_path):
+    """
+    Place encoded pages on the pages of a new PDF with the page sizes of the source PDF.
+
+    The PDF cross-reference table can only be written at the end, so the encoded pages are
+    collected in the document and it is yielded as one chunk.
+
+    Args:
+        pages (Iterable[bytes]): Encoded JPEG or PNG pages in page order.
+        source_pdf_path (str): The PDF the pages were rendered from.
+
+    Yields:
+        bytes: The PDF document.
+    """
+    with fitz.open(source_pdf_path) as source, fitz.open() as doc:
+        for source_page, encoded_page in zip(source, pages):
+            with metrics.stage('package'):
+                page = doc.new_page(width=source_page.rect.width, height=source_page.rect.height)
+                page.insert_image(page.rect, stream=encoded_page)
+        with metrics.stage('package'):
+            document = doc.tobytes(garbage=3, deflate=True)
+        yield document
+
+
+def iter_package(pages, source_pdf_path, container=None):
+    """
+    Package encoded pages into the configured container.
+
+    Args:
+        pages (Iterable[bytes]): Pages encoded with page_format(container).
+        source_pdf_path (str): The PDF the pages were rendered from.
+        container (str): ``zip`` or ``pdf``; defaults to RASTER_CONTAINER.
+
+    Yields:
+        bytes: Consecutive chunks of the result.
+    """
+    if (container or RASTER_CONTAINER) == 'pdf':
+        return iter_pdf(pages, source_pdf_path)
+    return iter_zip(pages, page_format('zip'))
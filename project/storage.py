@@ -0,0 +1,335 @@
+"""Scratch space and retention of the documents the service handles.
+
+Every request that has to put an upload on disk gets its own scratch folder under
+SCRATCH_DIR (point it to a tmpfs such as ``/dev/shm/anondoc`` to keep documents off the
+disk). Writes to the folder are counted against SCRATCH_REQUEST_MAX_BYTES per request and
+SCRATCH_MAX_BYTES for all scratch folders together, and the folder is removed with
+everything in it as soon as the request is processed, so uploads are not kept.
+
+Results that clients download later (``anonymized/``, job and bulk folders) are removed by
+a background janitor once they are older than RESULT_TTL seconds; if the retained results
+take more than STORAGE_MAX_BYTES, the oldest are removed first. Scratch folders left behind
+by a crashed worker are removed after the same TTL. Files are overwritten with zeros before
+they are unlinked (ocr_cache.secure_delete). Every gunicorn worker starts a janitor, but only
+the one holding the JANITOR_LOCK file lock sweeps; another takes over if that worker exits.
+Disk usage per area and eviction counts are exported through the metrics module; the usage
+gauges are measured by the worker that answers the scrape.
+
+The OCR cache is the one place where the recognized text of a document and the personal data
+found in it outlive the request. It is off by default; when it is enabled, its disk folder
+(OCR_CACHE_DIR) is one more area under the same TTL and quota, and the size of its in-memory
+tier is exported as the ``ocr_cache_memory`` area.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: нет блокировок файлов, каждый процесс убирает сам
+    fcntl = None
+
+import metrics
+import ocr_cache
+from ocr_cache import secure_delete
+
+SCRATCH_DIR = os.environ.get('SCRATCH_DIR', 'scratch/')
+SCRATCH_REQUEST_MAX_BYTES = int(os.environ.get('SCRATCH_REQUEST_MAX_BYTES', str(100 * 2**20)))
+SCRATCH_MAX_BYTES = int(os.environ.get('SCRATCH_MAX_BYTES', str(2 * 2**30)))
+STORAGE_MAX_BYTES = int(os.environ.get('STORAGE_MAX_BYTES', str(10 * 2**30)))
+RESULT_TTL = float(os.environ.get('RESULT_TTL', '3600'))
+JANITOR_INTERVAL = float(os.environ.get('JANITOR_INTERVAL', '60'))
+JANITOR_LOCK = os.environ.get('JANITOR_LOCK', os.path.join(tempfile.gettempdir(), 'anondoc-janitor.lock'))
+
+SCRATCH_AREA = 'scratch'
+CACHE_AREA = 'ocr_cache'
+CACHE_MEMORY_AREA = 'ocr_cache_memory'
+_CHUNK_SIZE = 1 << 20
+
+_janitor = None
+_janitor_lock = threading.Lock()
+
+
+class QuotaExceededError(Exception):
+    """Raised when a write would exceed a scratch space quota."""
+
+
+def usage(path: str) -> Tuple[int, int]:
+    """
+    Measure a file or a folder tree.
+
+    Args:
+        path (str): The path; a missing path has no usage.
+
+    Returns:
+        Tuple[int, int]: Bytes and number of files.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path), 1
+    size = files = 0
+    for folder, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(folder, name))
+                files += 1
+            except FileNotFoundError:
+                continue
+    return size, files
+
+
+def last_modified(path: str) -> float:
+    """Return the newest modification time of a file or of anything in a folder tree."""
+    try:
+        newest = os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0.0
+    for folder, folders, names in os.walk(path):
+        for name in folders + names:
+            try:
+                newest = max(newest, os.path.getmtime(os.path.join(folder, name)))
+            except FileNotFoundError:
+                continue
+    return newest
+
+
+def remove(path: str, area: str, reason: str):
+    """
+    Securely delete a file or a folder tree and count the eviction.
+
+    Args:
+        path (str): The file or folder. Missing paths are ignored.
+        area (str): Storage area label, e.g. ``results``.
+        reason (str): ``processed`` (deleted after processing), ``ttl`` or ``quota``.
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        for folder, _, names in os.walk(path, topdown=False):
+            for name in names:
+                secure_delete(os.path.join(folder, name))
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        secure_delete(path)
+    else:
+        return
+    metrics.inc(metrics.STORAGE_EVICTIONS, area=area, reason=reason)
+
+
+class Scratch:
+    """Private scratch folder of one request; close() deletes it with everything in it."""
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None,
+                 prefix: str = 'request-'):
+        """
+        Args:
+            root (str): Folder of all scratch folders. Defaults to SCRATCH_DIR.
+            max_bytes (int): Quota of this request. Defaults to SCRATCH_REQUEST_MAX_BYTES.
+            prefix (str): Prefix of the folder name.
+        """
+        self.root = root or SCRATCH_DIR
+        self.max_bytes = SCRATCH_REQUEST_MAX_BYTES if max_bytes is None else max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=self.root)
+        self.used = 0
+
+    def reserve(self, size: int):
+        """
+        Count ``size`` more bytes against the quota of the request.
+
+        Raises:
+            QuotaExceededError: If the request would use more than its quota.
+        """
+        self.check_quota(size)
+        self.used += size
+
+    def check_quota(self, size: int):
+        """
+        Check that ``size`` more bytes fit into the quota of the request.
+
+        Raises:
+            QuotaExceededError: If the request would use more than its quota.
+        """
+        if self.used + size > self.max_bytes:
+            metrics.inc(metrics.STORAGE_QUOTA_REJECTIONS, scope='request')
+            raise QuotaExceededError(f'Upload exceeds the scratch quota of {self.max_bytes} bytes')
+
+    def check_shared_quota(self, size: int):
+        """
+        Check that ``size`` more bytes fit into SCRATCH_MAX_BYTES with all scratch folders.
+
+        Raises:
+            QuotaExceededError: If the scratch space is full.
+        """
+        used = usage(self.root)[0]
+        if used + size > SCRATCH_MAX_BYTES:
+            metrics.inc(metrics.STORAGE_QUOTA_REJECTIONS, scope='global')
+            raise QuotaExceededError(f'Scratch space is full ({used} of {SCRATCH_MAX_BYTES} bytes)')
+
+    def save(self, file_storage, name: str, expected_size: Optional[int] = None) -> str:
+        """
+        Stream an uploaded file into the scratch folder, enforcing the quotas.
+
+        Args:
+            file_storage (werkzeug.datastructures.FileStorage): The uploaded file.
+            name (str): File name; only its last component is used.
+            expected_size (int): Size announced by the client (e.g. the request content
+                length), checked against the quotas before anything is written.
+
+        Returns:
+            str: Path to the saved file.
+
+        Raises:
+            QuotaExceededError: If the file does not fit into a quota.
+        """
+        self.check_quota(expected_size or 0)
+        self.check_shared_quota(expected_size or 0)
+        path = os.path.join(self.path, os.path.basename(name) or 'upload')
+        with open(path, 'wb') as file:
+            while True:
+                chunk = file_storage.stream.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.reserve(len(chunk))
+                file.write(chunk)
+        return path
+
+    def touch(self):
+        """Mark the folder as in use, so that the janitor does not take a long run for an
+        orphaned folder."""
+        os.utime(self.path)
+
+    def close(self):
+        """Delete the scratch folder."""
+        remove(self.path, SCRATCH_AREA, 'processed')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Janitor(threading.Thread):
+    """Background thread removing expired results and orphaned scratch folders."""
+
+    def __init__(self, areas: Dict[str, str], scratch_root: Optional[str] = None,
+                 ttl: float = RESULT_TTL, max_bytes: int = STORAGE_MAX_BYTES,
+                 interval: float = JANITOR_INTERVAL, lock_path: Optional[str] = None):
+        """
+        Args:
+            areas (Dict[str, str]): Folders of retained results by area name; every entry
+                directly inside a folder (a file or a job/run folder) is one result.
+            scratch_root (str): Folder of the scratch folders. Defaults to SCRATCH_DIR.
+            ttl (float): Seconds after the last modification of a result before it is removed.
+            max_bytes (int): Size of all results above which the oldest are removed.
+            interval (float): Seconds between sweeps.
+            lock_path (str): File locked by the one janitor that sweeps the folders.
+                Defaults to JANITOR_LOCK.
+        """
+        super().__init__(name='storage-janitor', daemon=True)
+        self.areas = dict(areas)
+        self.scratch_root = scratch_root or SCRATCH_DIR
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.lock_path = lock_path or JANITOR_LOCK
+        self._lock_file = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            if self.acquire():
+                self.sweep()
+
+    def acquire(self) -> bool:
+        """
+        Try to become the janitor that sweeps; the lock is held until the process exits.
+
+        Returns:
+            bool: True if this janitor holds the lock.
+        """
+        if self._lock_file is not None or fcntl is None:
+            return True
+        lock_file = open(self.lock_path, 'a', encoding='ascii')  # pylint: disable=consider-using-with
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def stop(self):
+        """Stop after the current sweep."""
+        self._stop_event.set()
+
+    def sweep(self) -> int:
+        """
+        Remove expired results and scratch folders, then the oldest results over the quota.
+
+        Returns:
+            int: Number of removed entries.
+        """
+        now = time.time()
+        removed = 0
+        kept = []
+        for area, folder in [*self.areas.items(), (SCRATCH_AREA, self.scratch_root)]:
+            try:
+                entries = [entry.path for entry in os.scandir(folder)]
+            except FileNotFoundError:
+                continue
+            for path in entries:
+                modified = last_modified(path)
+                if now - modified > self.ttl:
+                    remove(path, area, 'ttl')
+                    removed += 1
+                elif area != SCRATCH_AREA:
+                    # Папки запросов в работе не вытесняются по квоте: они живут не дольше запроса
+                    kept.append((modified, usage(path)[0], area, path))
+        total = sum(size for _, size, _, _ in kept)
+        for _, size, area, path in sorted(kept):
+            if total <= self.max_bytes:
+                break
+            remove(path, area, 'quota')
+            total -= size
+            removed += 1
+        return removed
+
+    def collect(self):
+        """Yield the storage gauges of every area, see metrics.register_collector."""
+        for area, folder in [*self.areas.items(), (SCRATCH_AREA, self.scratch_root)]:
+            size, files = usage(folder)
+            yield metrics.STORAGE_BYTES, {'area': area}, size
+            yield metrics.STORAGE_FILES, {'area': area}, files
+        cache = ocr_cache.get_cache()
+        if cache is not None:
+            size, records = cache.memory_usage()
+            yield metrics.STORAGE_BYTES, {'area': CACHE_MEMORY_AREA}, size
+            yield metrics.STORAGE_FILES, {'area': CACHE_MEMORY_AREA}, records
+
+
+def start_janitor(areas: Dict[str, str]) -> Janitor:
+    """
+    Start the janitor of this process once and export its storage gauges.
+
+    Every process may call this; the folders are swept by one of them at a time (see
+    Janitor.acquire). The disk folder of the OCR cache, if it is enabled, is added to the areas.
+
+    Args:
+        areas (Dict[str, str]): Folders of retained results by area name.
+
+    Returns:
+        Janitor: The running janitor.
+    """
+    global _janitor  # pylint: disable=global-statement
+    with _janitor_lock:
+        if _janitor is None:
+            areas = dict(areas)
+            if ocr_cache.CACHE_ENABLED and ocr_cache.CACHE_DIR:
+                areas[CACHE_AREA] = ocr_cache.CACHE_DIR
+            _janitor = Janitor(areas)
+            metrics.register_collector(_janitor.collect)
+            _janitor.start()
+        return _janitor
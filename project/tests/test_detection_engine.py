@@ -0,0 +1,88 @@
+"""Tests of the regex and context clue matchers of detection_engine."""
+
+import re
+
+from detection_engine import CLUE_DISTANCE, AhoCorasick, ClueMatcher, PatternSet
+from personal_data_recognizer import regex_patterns
+
+# Строки из образцов документов и строки, на которых шаблоны пересекаются
+LINES = [
+    'Пациент: Иванов Иван Петрович, дата рождения 01.02.1980',
+    'Паспорт 45 123456 выдан 12.03.2005',
+    'СНИЛС 123-456-789 01 234567',
+    'Полис ОМС 1234567890123456, тел. +7 (999) 123-45-67',
+    'e-mail: ivanov.ii@mail.ru',
+    'Диагноз: острый бронхит',
+    '',
+]
+
+
+def test_pattern_set_reports_every_pattern_like_separate_findall():
+    patterns = PatternSet(regex_patterns)
+    for line in LINES:
+        expected = [(name, text) for name, pattern in regex_patterns.items()
+                    for text in re.findall(pattern, line)]
+        assert [(name, match.group()) for name, match in patterns.finditer(line)] == expected
+
+
+def test_pattern_set_keeps_overlapping_matches():
+    patterns = PatternSet(regex_patterns)
+    matches = [(name, match.span()) for name, match in patterns.finditer('СНИЛС 123-456-789 01 234567')]
+    assert matches == [('PASSPORT', (18, 27)), ('SNILS', (6, 20))]
+
+
+def test_pattern_set_checks_word_boundaries_before_the_first_match():
+    # Первое совпадение объединения начинается внутри числа 123: \b там не выполняется
+    patterns = PatternSet({'DIGITS': r'\b\d{2}', 'TAIL': r'23 4'})
+    matches = [(name, match.group()) for name, match in patterns.finditer('a123 45')]
+    assert matches == [('DIGITS', '45'), ('TAIL', '23 4')]
+
+
+def test_aho_corasick_finds_overlapping_and_nested_occurrences():
+    automaton = AhoCorasick(['он', 'она', 'на', 'а'])
+    assert sorted(automaton.finditer('она')) == [(0, 2, 0), (0, 3, 1), (1, 3, 2), (2, 3, 3)]
+    assert sorted(automaton.finditer('нанана')) == [
+        (0, 2, 2), (1, 2, 3), (2, 4, 2), (3, 4, 3), (4, 6, 2), (5, 6, 3)]
+    assert list(automaton.finditer('кот')) == []
+
+
+def test_aho_corasick_follows_failure_links():
+    automaton = AhoCorasick(['абв', 'бвг'])
+    assert list(automaton.finditer('аабвг')) == [(1, 4, 0), (2, 5, 1)]
+
+
+def test_clue_index_is_case_insensitive_and_per_type():
+    matcher = ClueMatcher({'PERSON': ['ФИО', 'фио'], 'OMS': ['полис', 'ОМС']})
+    clues = matcher.index('Полис ОМС выдан, ФИО: Иванов')
+    assert clues.has('OMS') and clues.has('PERSON') and clues.has_any()
+    assert not matcher.index('Диагноз').has_any()
+
+
+def test_clue_must_be_within_distance_before_the_element():
+    matcher = ClueMatcher({'PERSON': ['фио']})
+    assert matcher.index('фио' + ' ' * CLUE_DISTANCE + 'Иванов').near('PERSON', 'Иванов')
+    assert not matcher.index('фио' + ' ' * (CLUE_DISTANCE + 1) + 'Иванов').near('PERSON', 'Иванов')
+
+
+def test_clue_must_be_within_distance_after_the_element():
+    matcher = ClueMatcher({'PERSON': ['фио']})
+    assert matcher.index('Иванов' + ' ' * CLUE_DISTANCE + 'фио').near('PERSON', 'Иванов')
+    assert not matcher.index('Иванов' + ' ' * (CLUE_DISTANCE + 1) + 'фио').near('PERSON', 'Иванов')
+
+
+def test_every_occurrence_of_the_element_is_checked():
+    matcher = ClueMatcher({'DATE': ['дата рождения']})
+    line = '01.02.1980' + ' ' * 60 + 'дата рождения 01.02.1980'
+    clues = matcher.index(line)
+    assert clues.near('DATE', '01.02.1980')
+    assert not clues.near('PERSON', '01.02.1980')
+    assert not clues.near('DATE', '')
+
+
+def test_is_contextualized_by_the_element_or_the_previous_line():
+    matcher = ClueMatcher({'PERSON': ['врач'], 'DATE': ['др']})
+    empty = matcher.index('')
+    assert matcher.is_contextualized('PERSON', 'врач-терапевт', empty, empty)
+    assert matcher.is_contextualized('DATE', '01.02.1980', matcher.index('01.02.1980'),
+                                     matcher.index('Др:'))
+    assert not matcher.is_contextualized('DATE', '01.02.1980', matcher.index('01.02.1980'), empty)
@@ -0,0 +1,106 @@
+"""Tests of matching detected phrases to the words of a page."""
+
+import numpy as np
+
+from word_matcher import PhraseMatcher, Word, find_boxes, merge_boxes, normalize, words_from_table
+from word_table import WordTable
+
+
+def page(*lines):
+    """Words of a page, 100 px per word and 50 px per line."""
+    words = []
+    for line_number, line in enumerate(lines):
+        for column, text in enumerate(line.split()):
+            words.append(Word(normalize(text), (line_number,),
+                              (column * 100, line_number * 50, column * 100 + 90, line_number * 50 + 40)))
+    return words
+
+
+def matched(phrases, *lines):
+    return sorted(PhraseMatcher(phrases, ignored=set()).match(page(*lines)))
+
+
+def test_normalize_strips_punctuation_and_folds_yo():
+    assert normalize('«Ёлкин»,') == 'елкин'
+    assert normalize('№') == ''
+
+
+def test_phrase_matches_a_run_of_words():
+    assert matched(['Иванов Иван'], 'Пациент: Иванов Иван, 45 лет') == [1, 2]
+
+
+def test_fuzzy_match_allows_one_edit_in_long_alphabetic_tokens():
+    assert matched(['Иванов'], 'Пациент Иванав') == [1]
+    assert matched(['Иванов'], 'Пациент Иванаф') == []
+    # Короткие слова и слова с цифрами сравниваются точно
+    assert matched(['Ким'], 'Пациент Кин') == []
+    assert matched(['12345'], 'код 12346') == []
+
+
+def test_fuzzy_match_finds_deletions_and_insertions():
+    assert matched(['Петрович'], 'Петрвич') == [0]
+    assert matched(['Петрович'], 'Петроович') == [0]
+
+
+def test_up_to_max_gap_ignorable_words_may_sit_inside_a_phrase():
+    assert matched(['Иванова Мария'], 'Иванова и Мария') == [0, 1, 2]
+    assert matched(['Иванова Мария'], 'Иванова и в Мария') == [0, 1, 2, 3]
+    # Три пропущенных слова — уже не одна фраза, а обе её части в одной строке
+    assert matched(['Иванова Мария'], 'Иванова и в с Мария') == [0, 4]
+
+
+def test_gap_words_must_be_ignorable():
+    assert PhraseMatcher(['Иванова Мария'], ignored={'дочь'}).match(
+        page('Иванова дочь Мария')) == {0, 1, 2}
+    assert matched(['Иванова Мария'], 'Иванова', 'сказала Мария') == []
+
+
+def test_fallback_redacts_only_lines_with_most_of_the_phrase():
+    lines = ('Пациент Иван Петров Иванов', 'Иван сказал', 'Иванов Петрович Иван')
+    assert matched(['Иванов Иван Петрович'], *lines) == [1, 3, 6, 7, 8]
+    # Фраза найдена как последовательность: одиночные слова в других строках не трогаются
+    assert matched(['Иванов Иван'], *lines) == [3, 4]
+
+
+def test_fallback_ignores_a_single_name_word():
+    assert matched(['Сидоров Пётр'], 'Сидоров принят', 'врач Петр') == []
+    # Перенос фразы на следующую строку не мешает найти её последовательностью
+    assert matched(['Сидоров Пётр'], 'принят Сидоров', 'Петр') == [1, 2]
+
+
+def test_merge_boxes_joins_consecutive_words_per_line():
+    words = page('Иванов Иван Петрович', 'Петрович')
+    assert merge_boxes(words, [0, 1, 2, 3]) == [(0, 0, 290, 40), (0, 50, 90, 90)]
+    assert merge_boxes(words, [0, 2]) == [(0, 0, 90, 40), (200, 0, 290, 40)]
+
+
+def test_find_boxes():
+    words = page('ФИО: Иванов Иван', 'Дата: 01.02.1980')
+    assert find_boxes(words, ['Иванов Иван', '01.02.1980'], PhraseMatcher(
+        ['Иванов Иван', '01.02.1980'], ignored=set())) == [(100, 0, 290, 40), (100, 50, 190, 90)]
+
+
+def table(*lines):
+    data = {key: [] for key in ('level', 'page_num', 'block_num', 'par_num', 'line_num',
+                                'word_num', 'left', 'top', 'width', 'height', 'conf', 'text')}
+    for line_number, line in enumerate(lines, start=1):
+        for word_number, text in enumerate(line.split(), start=1):
+            for key, value in zip(data, (5, 1, 1, 1, line_number, word_number,
+                                         (word_number - 1) * 100, line_number * 50, 90, 40, 90, text)):
+                data[key].append(value)
+    return WordTable.from_data(data)
+
+
+def test_select_on_a_word_table_agrees_with_match():
+    words = table('Пациент Иван Петров Иванов', 'Иван сказал', 'Иванов, Петрович Иван')
+    for phrases in (['Иванов Иван Петрович'], ['Иванов Иван'], ['Петрович']):
+        matcher = PhraseMatcher(phrases, ignored=set())
+        selection = matcher.select(words)
+        assert np.flatnonzero(selection).tolist() == sorted(matcher.match(words_from_table(words)))
+
+
+def test_select_returns_merged_spans():
+    words = table('ФИО: Иванов Иван', 'Иванов')
+    selection = PhraseMatcher(['Иванов Иван'], ignored=set()).select(words)
+    assert selection.tolist() == [False, True, True, False]
+    assert words.span_boxes(selection).tolist() == [[100, 50, 290, 90]]
@@ -0,0 +1,85 @@
+"""Tests of the columnar OCR word table."""
+
+import pickle
+
+import numpy as np
+import pytest
+
+from word_table import WordTable
+
+DATA = {
+    'level': [1, 5, 5, 5, 5, 5],
+    'page_num': [1, 1, 1, 1, 1, 1],
+    'block_num': [0, 1, 1, 1, 1, 2],
+    'par_num': [0, 1, 1, 1, 1, 1],
+    'line_num': [0, 1, 1, 1, 2, 1],
+    'word_num': [0, 1, 2, 3, 1, 1],
+    'left': [0, 10, 60, 0, 10, 10],
+    'top': [0, 20, 20, 0, 70, 150],
+    'width': [500, 40, 50, 0, 30, 60],
+    'height': [300, 20, 22, 0, 20, 20],
+    'conf': ['-1', '96.5', '91', '-1', '88', '90'],
+    'text': ['', 'Иванов', 'Иван', ' ', 'Иванов', 'ОМС'],
+}
+
+
+def test_from_data_keeps_non_empty_words_and_interns_them():
+    words = WordTable.from_data(DATA)
+    assert len(words) == 4
+    assert words.texts() == ['Иванов', 'Иван', 'Иванов', 'ОМС']
+    assert words.vocabulary == ('Иванов', 'Иван', 'ОМС')
+    assert words.rows['conf'].tolist() == [96.5, 91.0, 88.0, 90.0]
+    assert words.boxes().tolist() == [[10, 20, 50, 40], [60, 20, 110, 42],
+                                      [10, 70, 40, 90], [10, 150, 70, 170]]
+
+
+def test_line_ids_change_with_block_paragraph_and_line():
+    assert WordTable.from_data(DATA).line_ids.tolist() == [0, 0, 1, 2]
+
+
+def test_bytes_round_trip():
+    words = WordTable.from_data(DATA)
+    restored = WordTable.from_bytes(words.to_bytes())
+    assert restored.rows.tobytes() == words.rows.tobytes()
+    assert restored.vocabulary == words.vocabulary
+    assert restored.texts() == words.texts()
+    assert restored.to_data() == words.to_data()
+    assert not restored.rows.flags.writeable
+
+
+def test_bytes_round_trip_of_an_empty_table():
+    empty = WordTable.from_data({key: [] for key in DATA})
+    restored = WordTable.from_bytes(empty.to_bytes())
+    assert len(restored) == 0
+    assert restored.vocabulary == ()
+    assert restored.text() == ''
+
+
+def test_pickle_uses_the_byte_format():
+    words = WordTable.from_data(DATA)
+    assert pickle.loads(pickle.dumps(words)).texts() == words.texts()
+
+
+def test_from_bytes_rejects_other_payloads():
+    with pytest.raises(ValueError):
+        WordTable.from_bytes(b'XXXX' + bytes(8))
+
+
+def test_span_boxes_merge_consecutive_words_of_a_line():
+    words = WordTable.from_data(DATA)
+    assert words.span_boxes(np.array([True, True, True, False])).tolist() == [
+        [10, 20, 110, 42], [10, 70, 40, 90]]
+    assert words.span_boxes(np.array([True, False, False, True])).tolist() == [
+        [10, 20, 50, 40], [10, 150, 70, 170]]
+    assert words.span_boxes(np.zeros(4, dtype=bool)).shape == (0, 4)
+
+
+def test_scaled_rounds_outwards_and_clips():
+    words = WordTable.from_data(DATA).scaled(0.5, shape=(80, 50))
+    assert words.boxes().tolist() == [[5, 10, 25, 20], [30, 10, 50, 21],
+                                      [5, 35, 20, 45], [5, 75, 35, 80]]
+    assert words.vocabulary == WordTable.from_data(DATA).vocabulary
+
+
+def test_text_lays_out_lines_and_paragraphs():
+    assert WordTable.from_data(DATA).text() == 'Иванов Иван\nИванов\n\nОМС'
@@ -1,31 +1,60 @@
+import functools
 import re
 
-import nltk
+# NLTK импортируется и загружает свои данные при первом использовании. Данные (stopwords,
+# punkt_tab) ставятся заранее при сборке: python -m nltk.downloader stopwords punkt_tab,
+# во время работы сервис в сеть за ними не ходит.
+NLTK_RESOURCES = ('stopwords', 'punkt_tab')
+NLP_WORD_MINIMUM_LENGTH = 2
 
-from nltk.corpus import stopwords
+_SENTENCE_DOT = re.compile(r'\.(?=\s|$)')
+_STANDALONE_SYMBOLS = re.compile(r'(?<!\w)[^\w\s.-]+(?!\w)')
+_EDGE_SYMBOLS = re.compile(r'(?<!\w)[^\w\s.-]+|[^\w\s.-]+(?!\w)')
 
 
 def extract_sentences_by_newline(text):
     return text.split('\n')
 
 
+@functools.lru_cache(maxsize=None)
+def get_stop_words(lang='russian'):
+    """Return the NLTK stopwords of the language as a set, built once per language."""
+    from nltk.corpus import stopwords  # pylint: disable=import-outside-toplevel
+    return frozenset(stopwords.words(lang))
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(lang='russian'):
+    """Return the NLTK word tokenizer of the language; its punkt model is loaded once."""
+    from nltk.tokenize import word_tokenize  # pylint: disable=import-outside-toplevel
+    tokenize = functools.partial(word_tokenize, language=lang)
+    tokenize('')
+    return tokenize
+
+
+def warm_up(lang='russian'):
+    """Load the stopwords and the tokenizer of the language ahead of the first request."""
+    get_stop_words(lang)
+    get_tokenizer(lang)
+
+
 def preprocess(text, lang='russian'):
     rows = extract_sentences_by_newline(text)
     cleaned_rows = []
 
-    stop_words = stopwords.words(lang)
+    stop_words = get_stop_words(lang)
+    tokenize = get_tokenizer(lang)
 
     for row in rows:
-        row = re.sub(r'\.(?=\s|$)', '', row)
-        row = re.sub(r'(?<!\w)[^\w\s.-]+(?!\w)', '', row)
-        row = re.sub(r'(?<!\w)[^\w\s.-]+|[^\w\s.-]+(?!\w)', '', row)
+        row = _SENTENCE_DOT.sub('', row)
+        row = _STANDALONE_SYMBOLS.sub('', row)
+        row = _EDGE_SYMBOLS.sub('', row)
 
-        tokens = nltk.word_tokenize(row, lang)
+        tokens = tokenize(row)
         filtered_tokens = []
         for word in tokens:
-            nlp_word_minimum_length = 2
             word_lower = word.lower()
-            if (len(word_lower) <= nlp_word_minimum_length or word_lower in stop_words):
+            if (len(word_lower) <= NLP_WORD_MINIMUM_LENGTH or word_lower in stop_words):
                 continue
             filtered_tokens.append(word_lower)
 
@@ -1,48 +1,137 @@
 """Module to preprocess image and recognize text on it"""
 
-import platform
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple, Union
 
 import cv2
 import numpy as np
-import pytesseract
 
-# Проверяем, является ли операционная система Ubuntu
-if platform.system() == 'Linux':
-    pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
+import metrics
+import ocr_cache
+from ocr_backends import get_ocr_backend
+from word_table import WordTable
 
 TEMP_FOLDER = 'temp/'
 LOG_ON = False
+OCR_CONFIG = r'--oem 3 --psm 6'
+# Увеличивать при любом изменении preprocess_image: версия входит в ключ кеша OCR.
+PREPROCESS_VERSION = 1
+
+# 'page' распознаёт страницу целиком, 'regions' — только найденные текстовые блоки
+OCR_MODE = os.environ.get('OCR_MODE', 'page')
+OCR_REGION_WORKERS = int(os.environ.get('OCR_REGION_WORKERS', str(min(4, os.cpu_count() or 1))))
+BLOCK_PADDING = 5
+MIN_BLOCK_SIZE = 10
+# Доля тёмных пикселей: меньше — пустое поле, больше — фотография или печать
+MIN_INK_RATIO = 0.01
+MAX_INK_RATIO = 0.45
+# Во сколько раз уменьшать изображение для поиска текстовых блоков (1.0 — без уменьшения)
+LAYOUT_SCALE = float(os.environ.get('LAYOUT_SCALE', '0.5'))
+# Медианная высота символа в пикселях (для строчных букв это примерно x-height), к которой
+# приводится изображение перед OCR; 0 — распознавать в исходном разрешении.
+# Координаты слов возвращаются в исходном разрешении.
+OCR_TARGET_TEXT_HEIGHT = float(os.environ.get('OCR_TARGET_TEXT_HEIGHT', '20'))
+# Максимальное увеличение мелкого текста (1.0 — изображение только уменьшается)
+OCR_MAX_UPSCALE = float(os.environ.get('OCR_MAX_UPSCALE', '1'))
+MIN_OCR_SCALE = 0.25
+# Если высота текста отличается от целевой не больше чем в столько раз, масштаб не меняется
+RESAMPLE_TOLERANCE = 1.25
+# Высота текста оценивается на копии, у которой длинная сторона не больше стольких пикселей
+TEXT_HEIGHT_SAMPLE_SIDE = 1600
+MIN_TEXT_COMPONENTS = 20
+
+
+class OcrResult(NamedTuple):
+    """Result of a single Tesseract pass: the plain text and the word boxes."""
+    text: str
+    words: WordTable
+
+ImageSource = Union[str, np.ndarray]
+
+
+class Layout(NamedTuple):
+    """Text blocks of a page found on a downscaled copy of it."""
+    scale: float
+    contours: list
+    blocks: List[Tuple[int, int, int, int]]
+
+
+def load_image(image: ImageSource) -> np.ndarray:
+    """
+    Return the image as a BGR array, reading it from disk if a path is given.
+
+    Parameters:
+    image (str | np.ndarray): The file path to the image or the image itself.
+
+    Returns:
+    np.ndarray: The image.
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    loaded = cv2.imread(image)
+    if loaded is None:
+        raise FileNotFoundError(f"The image at path '{image}' could not be found.")
+    return loaded
+
+
+def create_log_folder(name: str) -> Optional[str]:
+    """
+    Create a scratch folder private to one call for debug images when LOG_ON is set.
+
+    Parameters:
+    name (str): A readable prefix for the folder, usually the file name.
+
+    Returns:
+    Optional[str]: The folder path, or None if logging is off.
+    """
+    if not LOG_ON:
+        return None
+    os.makedirs(TEMP_FOLDER, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f'{name}-', dir=TEMP_FOLDER)
 
-os.makedirs(TEMP_FOLDER, exist_ok=True)
 
-def preprocess_image(image_path: str) -> np.ndarray:
+def preprocess_image(image: ImageSource, debug_name: str = 'image') -> np.ndarray:
     """
     Preprocess the input image to enhance it for text recognition.
 
     Parameters:
-    image_path (str): The file path to the image to be preprocessed.
+    image (str | np.ndarray): The file path to the image or the BGR image to be preprocessed.
+    debug_name (str): Prefix of the debug folder used when LOG_ON is set.
 
     Returns:
     np.ndarray: The preprocessed image as a binary image.
     """
+    return preprocess_with_layout(image, debug_name)[0]
 
 
+@metrics.timed('preprocess')
+def preprocess_with_layout(image: ImageSource,
+                           debug_name: str = 'image') -> Tuple[np.ndarray, Layout]:
+    """
+    Preprocess the input image and return the layout analysis computed on the way.
 
-    filename = os.path.splitext(os.path.basename(image_path))[0]
-    file_folder = os.path.join(TEMP_FOLDER, filename)
-    os.makedirs(file_folder, exist_ok=True)
+    Parameters:
+    image (str | np.ndarray): The file path to the image or the BGR image to be preprocessed.
+    debug_name (str): Prefix of the debug folder used when LOG_ON is set.
 
-    orc_text = "";
-    image = cv2.imread(image_path)
-    base_image = cv2.imread(image_path)
-    log_image(image, filename, '0-image.jpg')
+    Returns:
+    Tuple[np.ndarray, Layout]: The preprocessed image and the text blocks of the grayscale image.
+    """
+    if isinstance(image, str):
+        debug_name = os.path.splitext(os.path.basename(image))[0]
+    image = load_image(image)
+    log_folder = create_log_folder(debug_name)
+
+    log_image(image, log_folder, '0-image.jpg')
     gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    log_image(gray_image, filename, '1-gray.jpg')
-    log_text(gray_image, filename, '1-gray-image-orc-text.txt')
+    log_image(gray_image, log_folder, '1-gray.jpg')
+    log_text(gray_image, log_folder, '1-gray-image-orc-text.txt')
     image = gray_image
+    layout = analyze_layout(image, log_folder=log_folder)
 
-    if bad_image_check(image, image_path):
+    if bad_image_check(image, log_folder, layout):
         threshold_image = cv2.adaptiveThreshold(
             image,
             255,
@@ -55,116 +144,355 @@ def preprocess_image(image_path: str) -> np.ndarray:
         #     0,
         #     255,
         #     cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
-        log_image(threshold_image, filename, '2-threshold_image.jpg')
+        log_image(threshold_image, log_folder, '2-threshold_image.jpg')
         kernel = np.ones((1, 1), np.uint8)
         dilate_image = cv2.dilate(threshold_image, kernel, iterations=1)
-        log_image(dilate_image, filename, '3-dilate_image.jpg')
+        log_image(dilate_image, log_folder, '3-dilate_image.jpg')
         kernel = np.ones((1, 1), np.uint8)
         erode_image = cv2.erode(dilate_image, kernel, iterations=1)
-        log_image(erode_image, filename, '4-erode_image.jpg')
+        log_image(erode_image, log_folder, '4-erode_image.jpg')
         morphologyEx_image = cv2.morphologyEx(erode_image, cv2.MORPH_CLOSE, kernel)
-        log_image(morphologyEx_image, filename, '5-morphologyEx_image.jpg')
+        log_image(morphologyEx_image, log_folder, '5-morphologyEx_image.jpg')
         medianBlur_image = cv2.medianBlur(morphologyEx_image, 1)
-        log_image(medianBlur_image, filename, '6-medianBlur_image.jpg')
-        log_text(medianBlur_image, filename, '6-medianBlur_image-orc-text.txt')
+        log_image(medianBlur_image, log_folder, '6-medianBlur_image.jpg')
+        log_text(medianBlur_image, log_folder, '6-medianBlur_image-orc-text.txt')
         image = medianBlur_image
     # else:
     #     _, binary_image = cv2.threshold(image, 140, 255, cv2.THRESH_BINARY)
-    #     log_image(binary_image, filename, '2-threshold_image.jpg')
-    #     log_text(binary_image, filename, '2-threshold-image-orc-text.txt')
+    #     log_image(binary_image, log_folder, '2-threshold_image.jpg')
+    #     log_text(binary_image, log_folder, '2-threshold-image-orc-text.txt')
     #     image = binary_image
 
-    text_boxes_image = find_text_boxes(image, image_path)
+    if log_folder is not None:
+        find_text_boxes(image, log_folder, layout)
 
-    return image
+    return image, layout
 
-def log_image(image, filename, image_name):
-    if LOG_ON:
-        cv2.imwrite(os.path.join(TEMP_FOLDER, filename, image_name), image)
+def log_image(image, log_folder, image_name):
+    if log_folder is not None:
+        cv2.imwrite(os.path.join(log_folder, image_name), image)
 
-def log_text(image, filename, text_name):
-    if LOG_ON:
-        text = pytesseract.image_to_string(image, lang='rus')
-        with open(os.path.join(TEMP_FOLDER, filename, text_name), "w", encoding="utf-8") as file:
+def log_text(image, log_folder, text_name):
+    if log_folder is not None:
+        text = get_ocr_backend().image_to_string(image, 'rus', OCR_CONFIG)
+        with open(os.path.join(log_folder, text_name), "w", encoding="utf-8") as file:
             file.write(text)
 
-def find_text_boxes(image, image_path):
-    base_image = image.copy()
-    blur = cv2.GaussianBlur(image, (7, 7), 0)
+def analyze_layout(image, scale=None, log_folder=None):
+    """
+    Find text blocks by dilating the thresholded image with a 35x60 kernel.
+
+    The blur, threshold, dilation and contour search run once on a copy downscaled by
+    ``scale``, with the kernels scaled accordingly; the result is shared by bad_image_check
+    and the text block detection.
+
+    Parameters:
+    image (np.ndarray): The grayscale or binary image.
+    scale (Optional[float]): Downscale factor, LAYOUT_SCALE by default.
+    log_folder (Optional[str]): Debug folder, see create_log_folder.
+
+    Returns:
+    Layout: Contours in downscaled coordinates and block boxes (x, y, w, h) in full-resolution
+        coordinates, sorted from top to bottom.
+    """
+    scale = LAYOUT_SCALE if scale is None else scale
+    small = image
+    if scale < 1:
+        small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    blur_size = max(1, int(7 * scale)) | 1
+    blur = cv2.GaussianBlur(small, (blur_size, blur_size), 0)
     thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
-    kernal = cv2.getStructuringElement(cv2.MORPH_RECT, (35, 60))
+    kernal = cv2.getStructuringElement(
+        cv2.MORPH_RECT, (max(1, round(35 * scale)), max(1, round(60 * scale))))
     dilate = cv2.dilate(thresh, kernal, iterations=1)
-    cv2.imwrite("temp/find_text_boxes/dilate.jpg", dilate)
+    log_image(dilate, log_folder, 'layout-dilate.jpg')
 
     cnts = cv2.findContours(dilate, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     cnts = cnts[0] if len(cnts) == 2 else cnts[1]
-    cnts = sorted(cnts, key=lambda x: cv2.boundingRect(x)[1])
-    for c in cnts:
-        x, y, w, h = cv2.boundingRect(c)
-        roi = image[y:y + h, x:x + w]
-        cv2.rectangle(base_image, (x, y), (x + w, y + h), (36, 255, 12), 2)
 
-    filename = os.path.splitext(os.path.basename(image_path))[0]
-    file_folder = os.path.join(TEMP_FOLDER, filename, 'find_text_boxes')
-    os.makedirs(file_folder, exist_ok=True)
-    cv2.imwrite(os.path.join(file_folder, 'image_with_border.jpg'), base_image)
-    return roi
+    height, width = image.shape[:2]
+    small_height, small_width = small.shape[:2]
+    fx, fy = width / small_width, height / small_height
+    blocks = []
+    for cnt in cnts:
+        x, y, w, h = cv2.boundingRect(cnt)
+        left, top = int(x * fx), int(y * fy)
+        right, bottom = min(int(np.ceil((x + w) * fx)), width), min(int(np.ceil((y + h) * fy)), height)
+        blocks.append((left, top, right - left, bottom - top))
+    blocks.sort(key=lambda box: box[1])
+    return Layout(scale=scale, contours=list(cnts), blocks=blocks)
+
+
+def find_text_boxes(image, log_folder=None, layout=None):
+    layout = layout or analyze_layout(image, log_folder=log_folder)
+    if log_folder is not None:
+        base_image = image.copy()
+        for x, y, w, h in layout.blocks:
+            cv2.rectangle(base_image, (x, y), (x + w, y + h), (36, 255, 12), 2)
+        log_image(base_image, log_folder, 'find_text_boxes-image_with_border.jpg')
+    if not layout.blocks:
+        return None
+    x, y, w, h = layout.blocks[-1]
+    return image[y:y + h, x:x + w]
+
+
+def select_text_blocks(image, blocks):
+    """
+    Drop blocks that are not worth recognizing: specks, blank areas and dense dark areas
+    such as photos and stamps.
 
+    Parameters:
+    image (np.ndarray): The preprocessed grayscale or binary image.
+    blocks (List[Tuple[int, int, int, int]]): Bounding boxes from analyze_layout.
 
-def bad_image_check(image, image_path):
-    blur = cv2.GaussianBlur(image, (7, 7), 0)
-    thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
-    kernal = cv2.getStructuringElement(cv2.MORPH_RECT, (35, 60))
-    dilate = cv2.dilate(thresh, kernal, iterations=1)
-    filename = os.path.splitext(os.path.basename(image_path))[0]
-    file_folder = os.path.join(TEMP_FOLDER, filename, 'find_text_boxes')
-    os.makedirs(file_folder, exist_ok=True)
-    cv2.imwrite(os.path.join(file_folder, 'bad_image_check_dilate.jpg'), dilate)
+    Returns:
+    List[Tuple[int, int, int, int]]: The blocks that probably contain text.
+    """
+    selected = []
+    for x, y, w, h in blocks:
+        if w < MIN_BLOCK_SIZE or h < MIN_BLOCK_SIZE:
+            continue
+        ink_ratio = np.count_nonzero(image[y:y + h, x:x + w] < 128) / (w * h)
+        if MIN_INK_RATIO <= ink_ratio <= MAX_INK_RATIO:
+            selected.append((x, y, w, h))
+    return selected
+
+
+def recognize_regions(image: np.ndarray, lang: str = 'rus',
+                      layout: Optional[Layout] = None) -> dict:
+    """
+    Recognize only the text blocks of a preprocessed image, in parallel, and return the words
+    in page coordinates. Falls back to the whole page if no block is found.
 
-    cnts = cv2.findContours(dilate, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    cnts = cnts[0] if len(cnts) == 2 else cnts[1]
-    cnts = sorted(cnts, key=lambda x: cv2.boundingRect(x)[1])
+    Parameters:
+    image (np.ndarray): The preprocessed image.
+    lang (str): The language code to be used by Tesseract OCR.
+    layout (Optional[Layout]): Layout of the same page; computed from the image if omitted.
 
-    max_contour = max(cnts, key=cv2.contourArea)
+    Returns:
+    dict: The pytesseract data dictionary; every block gets its own block_num.
+    """
+    layout = layout or analyze_layout(image)
+    blocks = select_text_blocks(image, layout.blocks)
+    if not blocks:
+        return get_ocr_backend().image_to_data(image, lang, OCR_CONFIG)
+
+    height, width = image.shape[:2]
+    crops = []
+    for x, y, w, h in blocks:
+        left, top = max(x - BLOCK_PADDING, 0), max(y - BLOCK_PADDING, 0)
+        right, bottom = min(x + w + BLOCK_PADDING, width), min(y + h + BLOCK_PADDING, height)
+        crops.append((left, top, image[top:bottom, left:right]))
+
+    backend = get_ocr_backend()
+    with ThreadPoolExecutor(max_workers=min(OCR_REGION_WORKERS, len(crops))) as executor:
+        block_data = list(executor.map(
+            lambda crop: backend.image_to_data(crop[2], lang, OCR_CONFIG), crops))
+
+    data = {}
+    for block_num, ((left, top, _), region) in enumerate(zip(crops, block_data), start=1):
+        for key, values in region.items():
+            if key == 'left':
+                values = [value + left for value in values]
+            elif key == 'top':
+                values = [value + top for value in values]
+            elif key == 'block_num':
+                values = [block_num] * len(values)
+            data.setdefault(key, []).extend(values)
+    return data
+
+
+def bad_image_check(image, log_folder=None, layout=None):
+    layout = layout or analyze_layout(image, log_folder=log_folder)
+    if not layout.contours:
+        return False
+
+    max_contour = max(layout.contours, key=cv2.contourArea)
     perimeter = cv2.arcLength(max_contour, True)
     approx = cv2.approxPolyDP(max_contour, 0.02 * perimeter, True)
 
     return len(approx) < 5
 
-def extract_text_from_image(image_path: str, lang: str = 'rus') -> str:
+def extract_text_from_image(image: ImageSource, lang: str = 'rus') -> str:
     """
     Extract text from the input image using Tesseract OCR.
 
     Parameters:
-    image_path (str): The file path to the image from which text needs to be extracted.
+    image (str | np.ndarray): The file path to the image or the BGR image from which text needs
+        to be extracted.
     lang (str): The language code to be used by Tesseract OCR. Default is 'rus' (Russian).
 
     Returns:
     str: The extracted text from the image.
     """
-    preprocessed_image = preprocess_image(image_path)
-    cv2.imwrite("temp/preprocessed_image.jpg", preprocessed_image)
-    custom_config = r'--oem 3 --psm 6'
-    ocr_text = pytesseract.image_to_string(preprocessed_image, lang=lang, config=custom_config)
+    ocr_image, _ = resample_for_ocr(load_image(image))
+    preprocessed_image = preprocess_image(ocr_image, _debug_name(image))
+    ocr_text = get_ocr_backend().image_to_string(preprocessed_image, lang, OCR_CONFIG)
     return ocr_text
 
 
-def extract_data_from_image(image_path: str, lang: str = 'rus') -> dict:
+def _debug_name(image: ImageSource) -> str:
+    if isinstance(image, str):
+        return os.path.splitext(os.path.basename(image))[0]
+    return 'image'
+
+
+def estimate_text_height(image: np.ndarray) -> Optional[float]:
+    """
+    Estimate the height of the text as the median height of the character-like connected
+    components of the binarized image.
+
+    Parameters:
+    image (np.ndarray): The BGR or grayscale image.
+
+    Returns:
+    Optional[float]: The median character height in pixels of the image, or None if too few
+        components look like characters (blank page, photo).
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    factor = min(1.0, TEXT_HEIGHT_SAMPLE_SIDE / max(gray.shape[:2]))
+    if factor < 1:
+        gray = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    # Символы: не точки и не линии таблиц, не слишком вытянуты и не сплошные пятна
+    is_character = ((heights >= 4) & (heights <= gray.shape[0] * 0.05)
+                    & (widths >= heights * 0.15) & (widths <= heights * 2.5)
+                    & (areas >= 0.1 * widths * heights) & (areas <= 0.95 * widths * heights))
+    if np.count_nonzero(is_character) < MIN_TEXT_COMPONENTS:
+        return None
+    return float(np.median(heights[is_character])) / factor
+
+
+def ocr_scale(image: np.ndarray) -> float:
+    """
+    Choose the factor that brings the text of the image to OCR_TARGET_TEXT_HEIGHT.
+
+    Parameters:
+    image (np.ndarray): The BGR or grayscale image.
+
+    Returns:
+    float: The resize factor, 1.0 if the text height is close to the target or unknown.
+    """
+    if OCR_TARGET_TEXT_HEIGHT <= 0:
+        return 1.0
+    text_height = estimate_text_height(image)
+    if text_height is None:
+        return 1.0
+    scale = OCR_TARGET_TEXT_HEIGHT / text_height
+    if 1 / RESAMPLE_TOLERANCE <= scale <= RESAMPLE_TOLERANCE:
+        return 1.0
+    return min(max(scale, MIN_OCR_SCALE), max(OCR_MAX_UPSCALE, 1.0))
+
+
+@metrics.timed('resample')
+def resample_for_ocr(image: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Resize the image so that its text has the height Tesseract recognizes best.
+
+    Parameters:
+    image (np.ndarray): The BGR image.
+
+    Returns:
+    Tuple[np.ndarray, float]: The image to recognize and the factor it was resized by.
+    """
+    scale = ocr_scale(image)
+    metrics.observe(metrics.OCR_SCALE, scale)
+    if scale == 1.0:
+        return image, scale
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation), scale
+
+
+def ocr_settings(lang: str = 'rus') -> tuple:
+    """Return every setting that changes the OCR result, for use in cache keys."""
+    return (get_ocr_backend().name, OCR_MODE, LAYOUT_SCALE, OCR_TARGET_TEXT_HEIGHT, OCR_MAX_UPSCALE,
+            lang, OCR_CONFIG, PREPROCESS_VERSION)
+
+
+def extract_words(image: ImageSource, lang: str = 'rus') -> WordTable:
+    """
+    Recognize the words of the input image using Tesseract OCR.
+
+    Parameters:
+    image (str | np.ndarray): The file path to the image or the BGR image to be recognized.
+    lang (str): The language code to be used by Tesseract OCR. Default is 'rus' (Russian).
+
+    Returns:
+    WordTable: The recognized words, with the boxes in the coordinates of the input image even
+        if it was resampled for OCR. The serialized table is what the OCR cache stores.
+    """
+    cache = ocr_cache.get_cache()
+    cache_key = None
+    if cache is not None:
+        digest = (ocr_cache.array_digest(image) if isinstance(image, np.ndarray)
+                  else ocr_cache.file_digest(image))
+        cache_key = ocr_cache.make_key(digest, 'ocr_words', *ocr_settings(lang))
+        payload = cache.get(cache_key)
+        if payload is not None:
+            return WordTable.from_bytes(payload)
+
+    original = load_image(image)
+    ocr_image, scale = resample_for_ocr(original)
+    preprocessed_image, layout = preprocess_with_layout(ocr_image, _debug_name(image))
+    with metrics.stage('ocr'):
+        if OCR_MODE == 'regions':
+            data = recognize_regions(preprocessed_image, lang, layout)
+        else:
+            data = get_ocr_backend().image_to_data(preprocessed_image, lang, OCR_CONFIG)
+    words = WordTable.from_data(data)
+    if scale != 1.0:
+        words = words.scaled(1 / scale, original.shape)
+    metrics.observe(metrics.IMAGE_PIXELS, preprocessed_image.shape[0] * preprocessed_image.shape[1])
+    metrics.observe(metrics.OCR_WORDS, len(words))
+
+    if cache is not None:
+        cache.put(cache_key, words.to_bytes())
+    return words
+
+
+def extract_data_from_image(image: ImageSource, lang: str = 'rus') -> dict:
     """
     Extract data as a pytesseract dictionary from the input image using Tesseract OCR.
 
     Parameters:
-    image_path (str): The file path to the image from which data needs to be extracted.
+    image (str | np.ndarray): The file path to the image or the BGR image from which data needs
+        to be extracted.
     lang (str): The language code to be used by Tesseract OCR. Default is 'rus' (Russian).
 
     Returns:
-    dict: The extracted data as a pytesseract dictionary from the image.
-    """
-    preprocessed_image = preprocess_image(image_path)
-    cv2.imwrite("temp/preprocessed_image.jpg", preprocessed_image)
-    custom_config = r'--oem 3 --psm 6'
-    return pytesseract.image_to_data(
-        preprocessed_image,
-        lang=lang,
-        config=custom_config,
-        output_type=pytesseract.Output.DICT)
+    dict: The word rows of extract_words as a pytesseract dictionary.
+    """
+    return extract_words(image, lang).to_data()
+
+
+def recognize_image(image: ImageSource, lang: str = 'rus') -> OcrResult:
+    """
+    Run preprocessing and Tesseract once and return both the text and the word boxes.
+
+    Parameters:
+    image (str | np.ndarray): The file path to the image or the BGR image to be recognized.
+    lang (str): The language code to be used by Tesseract OCR. Default is 'rus' (Russian).
+
+    Returns:
+    OcrResult: The text assembled from the recognized words and the word table.
+    """
+    words = extract_words(image, lang=lang)
+    return OcrResult(text=words.text(), words=words)
+
+
+def text_from_data(data: dict) -> str:
+    """
+    Assemble plain text from a pytesseract data dictionary the way image_to_string lays it out:
+    words of a line are joined by spaces, lines by newlines and paragraphs by an empty line.
+
+    Parameters:
+    data (dict): The pytesseract data dictionary.
+
+    Returns:
+    str: The recognized text.
+    """
+    return WordTable.from_data(data).text()
@@ -0,0 +1,284 @@
+"""Matching of detected personal data to the recognized words of a page.
+
+Detected entities are phrases taken from the preprocessed text, which is lowercased and has
+stopwords and tokens of up to two characters removed. The words of a page (from
+an OCR word table or the PDF text layer) are normalized the same way and kept in reading
+order; a phrase matches a run of words token by token, allowing up to MAX_GAP dropped words
+between its tokens and, for alphabetic tokens of at least FUZZY_MIN_LENGTH characters, up
+to MATCH_MAX_DISTANCE edits caused by OCR noise. Fuzzy candidates are looked up in an index
+of single-character deletions, so matching is linear in the number of page words and phrase
+tokens. The boxes of every match are merged into one rectangle per line.
+
+A phrase that cannot be found as a sequence (e.g. OCR split or reordered its words) falls
+back to matching its significant tokens one by one, but only on the lines that hold most of
+them, so a single name word elsewhere on the page is not redacted on its own.
+"""
+
+import os
+from typing import Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from word_table import WordTable
+
+MATCH_MAX_DISTANCE = int(os.environ.get('MATCH_MAX_DISTANCE', '1'))
+FUZZY_MIN_LENGTH = 5
+MAX_GAP = 2
+SHORT_TOKEN_LENGTH = 2
+
+EDGE_PUNCTUATION = '.,;:!?()[]{}<>«»"\'“”„‘’`—–-_/\\|*#№'
+
+Box = Tuple[float, float, float, float]
+
+
+class Word(NamedTuple):
+    """A normalized word of the page with its line and box (x0, y0, x1, y1)."""
+    text: str
+    line: tuple
+    box: Box
+
+
+def normalize(word: str) -> str:
+    """Lowercase a word, replace ё with е and strip the punctuation around it."""
+    return word.lower().replace('ё', 'е').strip(EDGE_PUNCTUATION)
+
+
+def words_from_table(table: WordTable) -> List[Word]:
+    """
+    Build the word stream of a page from an OCR word table.
+
+    Args:
+        table (WordTable): The recognized words.
+
+    Returns:
+        List[Word]: Non-empty words in reading order.
+    """
+    line_ids = table.line_ids.tolist()
+    words = []
+    for text, line, box in zip(table.texts(), line_ids, table.boxes().tolist()):
+        text = normalize(text)
+        if text:
+            words.append(Word(text, (line,), tuple(box)))
+    return words
+
+
+def words_from_pdf(page_words: Iterable[tuple]) -> List[Word]:
+    """
+    Build the word stream of a page from PyMuPDF ``page.get_text('words')``.
+
+    Args:
+        page_words (Iterable[tuple]): Tuples (x0, y0, x1, y1, word, block_no, line_no, word_no).
+
+    Returns:
+        List[Word]: Non-empty words in reading order.
+    """
+    words = []
+    for x0, y0, x1, y1, text, block_no, line_no, _ in sorted(
+            page_words, key=lambda word: (word[5], word[6], word[7])):
+        text = normalize(text)
+        if text:
+            words.append(Word(text, (block_no, line_no), (x0, y0, x1, y1)))
+    return words
+
+
+def within_distance(first: str, second: str, max_distance: int) -> bool:
+    """Return True if the Levenshtein distance of the strings is at most max_distance."""
+    if abs(len(first) - len(second)) > max_distance:
+        return False
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, start=1):
+        current = [i]
+        for j, second_char in enumerate(second, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (first_char != second_char)))
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+def _deletions(token: str, max_distance: int) -> Set[str]:
+    variants = {token}
+    for _ in range(max_distance):
+        variants |= {variant[:i] + variant[i + 1:] for variant in variants for i in range(len(variant))}
+    return variants
+
+
+def _is_fuzzy(token: str) -> bool:
+    return len(token) >= FUZZY_MIN_LENGTH and token.isalpha()
+
+
+class PhraseMatcher:
+    """Matches a set of phrases against word streams."""
+
+    def __init__(self, phrases: Iterable[str], max_distance: int = MATCH_MAX_DISTANCE,
+                 ignored: Optional[Set[str]] = None):
+        """
+        Args:
+            phrases (Iterable[str]): Detected entities; multi-word entities are kept whole.
+            max_distance (int): Edits allowed in long alphabetic tokens.
+            ignored (Set[str]): Words the preprocessing drops (stopwords); they may appear
+                between the tokens of a phrase. Defaults to the Russian NLTK stopwords.
+        """
+        if ignored is None:
+            import text_preprocessor  # pylint: disable=import-outside-toplevel
+            ignored = text_preprocessor.get_stop_words()
+        self.max_distance = max_distance
+        self.ignored = ignored
+        self.phrases = list(dict.fromkeys(
+            tokens for tokens in (tuple(filter(None, map(normalize, phrase.split())))
+                                  for phrase in phrases) if tokens))
+        self._by_first_token = {}
+        for index, tokens in enumerate(self.phrases):
+            self._by_first_token.setdefault(tokens[0], []).append(index)
+        vocabulary = {token for tokens in self.phrases for token in tokens}
+        self._vocabulary = vocabulary
+        self._deletion_index = {}
+        if max_distance > 0:
+            for token in vocabulary:
+                if _is_fuzzy(token):
+                    for variant in _deletions(token, max_distance):
+                        self._deletion_index.setdefault(variant, set()).add(token)
+
+    def _candidates(self, text: str) -> Set[str]:
+        candidates = {text} & self._vocabulary
+        if self._deletion_index and _is_fuzzy(text):
+            for variant in _deletions(text, self.max_distance):
+                for token in self._deletion_index.get(variant, ()):
+                    if token not in candidates and within_distance(text, token, self.max_distance):
+                        candidates.add(token)
+        return candidates
+
+    def _is_ignorable(self, text: str) -> bool:
+        return len(text) <= SHORT_TOKEN_LENGTH or text in self.ignored
+
+    def _extend(self, texts, candidates, start, tokens):
+        position = start
+        for token in tokens[1:]:
+            position += 1
+            skipped = 0
+            while (position < len(texts) and token not in candidates[position]
+                   and skipped < MAX_GAP and self._is_ignorable(texts[position])):
+                position += 1
+                skipped += 1
+            if position >= len(texts) or token not in candidates[position]:
+                return None
+        return position
+
+    def _match(self, texts, lines, candidates):
+        matched = set()
+        found_phrases = set()
+        for start, word_candidates in enumerate(candidates):
+            for token in word_candidates:
+                for phrase_index in self._by_first_token.get(token, ()):
+                    end = self._extend(texts, candidates, start, self.phrases[phrase_index])
+                    if end is not None:
+                        matched.update(range(start, end + 1))
+                        found_phrases.add(phrase_index)
+
+        missing = [index for index in range(len(self.phrases)) if index not in found_phrases]
+        if missing:
+            matched.update(self._match_on_lines(lines, candidates, missing))
+        return matched
+
+    def _match_on_lines(self, lines, candidates, phrase_indexes):
+        # Значимые слова фразы закрашиваются только в строках, где их большинство
+        phrase_tokens = [{token for token in self.phrases[index] if not self._is_ignorable(token)}
+                         for index in phrase_indexes]
+        wanted = set().union(*phrase_tokens)
+        positions = {}
+        for position, word_candidates in enumerate(candidates):
+            for token in word_candidates & wanted:
+                positions.setdefault(token, []).append(position)
+
+        matched = set()
+        for tokens in phrase_tokens:
+            by_line = {}
+            for token in tokens:
+                for position in positions.get(token, ()):
+                    line_tokens, line_positions = by_line.setdefault(lines[position], (set(), []))
+                    line_tokens.add(token)
+                    line_positions.append(position)
+            for line_tokens, line_positions in by_line.values():
+                if 2 * len(line_tokens) > len(tokens):
+                    matched.update(line_positions)
+        return matched
+
+    def match(self, words: List[Word]) -> Set[int]:
+        """
+        Find the words covered by the phrases.
+
+        Args:
+            words (List[Word]): The word stream of a page.
+
+        Returns:
+            Set[int]: Indexes of the matched words, including dropped words inside a phrase.
+        """
+        return self._match([word.text for word in words], [word.line for word in words],
+                           [self._candidates(word.text) for word in words])
+
+    def select(self, table: WordTable) -> np.ndarray:
+        """
+        Find the words of a word table covered by the phrases.
+
+        Candidates are computed once per distinct word of the table's vocabulary.
+
+        Args:
+            table (WordTable): The words of a page.
+
+        Returns:
+            np.ndarray: Boolean selection over the rows of the table.
+        """
+        normalized = [normalize(token) for token in table.vocabulary]
+        vocabulary_candidates = [self._candidates(text) if text else set() for text in normalized]
+        tokens = table.rows['token']
+        has_text = np.array([bool(text) for text in normalized], dtype=bool)
+        rows = np.flatnonzero(has_text[tokens])
+        row_tokens = tokens[rows].tolist()
+        matched = self._match([normalized[token] for token in row_tokens],
+                              table.line_ids[rows].tolist(),
+                              [vocabulary_candidates[token] for token in row_tokens])
+        selection = np.zeros(len(table), dtype=bool)
+        selection[rows[sorted(matched)]] = True
+        return selection
+
+
+def merge_boxes(words: List[Word], indexes: Iterable[int]) -> List[Box]:
+    """
+    Merge the boxes of consecutive matched words on the same line.
+
+    Args:
+        words (List[Word]): The word stream of a page.
+        indexes (Iterable[int]): Indexes of the matched words.
+
+    Returns:
+        List[Box]: One rectangle per run of matched words per line.
+    """
+    boxes = []
+    previous = None
+    for index in sorted(indexes):
+        word = words[index]
+        if previous is not None and index == previous + 1 and words[previous].line == word.line:
+            x0, y0, x1, y1 = boxes[-1]
+            boxes[-1] = (min(x0, word.box[0]), min(y0, word.box[1]),
+                         max(x1, word.box[2]), max(y1, word.box[3]))
+        else:
+            boxes.append(word.box)
+        previous = index
+    return boxes
+
+
+def find_boxes(words: List[Word], phrases: Iterable[str], matcher: PhraseMatcher = None) -> List[Box]:
+    """
+    Find the rectangles to redact on a page.
+
+    Args:
+        words (List[Word]): The word stream of a page.
+        phrases (Iterable[str]): Detected entities.
+        matcher (PhraseMatcher): A matcher built for the phrases, to reuse it across pages.
+
+    Returns:
+        List[Box]: Rectangles covering the matched phrases, merged per line.
+    """
+    matcher = matcher or PhraseMatcher(phrases)
+    return merge_boxes(words, matcher.match(words))
@@ -0,0 +1,193 @@
+"""Columnar table of the words recognized on a page.
+
+A WordTable keeps the word rows of a pytesseract data dictionary in one NumPy structured
+array (box, confidence, page/block/paragraph/line/word numbers and a token id) and the
+distinct word strings once, in an interned vocabulary. Selections over the words are
+boolean arrays, boxes are computed for all words at once, and the table serializes to a
+compact byte string (a small header, the raw rows and the vocabulary) that is stored in
+the OCR cache and sent between processes instead of the dictionary of Python lists.
+"""
+
+import struct
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ROW_DTYPE = np.dtype([
+    ('left', '<i4'), ('top', '<i4'), ('width', '<i4'), ('height', '<i4'), ('conf', '<f4'),
+    ('page_num', '<i4'), ('block_num', '<i4'), ('par_num', '<i4'), ('line_num', '<i4'),
+    ('word_num', '<i4'), ('token', '<i4'),
+])
+LINE_COLUMNS = ('page_num', 'block_num', 'par_num', 'line_num')
+DATA_KEYS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+             'left', 'top', 'width', 'height', 'conf', 'text')
+
+_MAGIC = b'WTB1'
+_HEADER = struct.Struct('<4sII')
+_SEPARATOR = '\x00'
+_WORD_LEVEL = 5
+
+
+class WordTable:
+    """The words of one OCR pass; rows are in reading order."""
+
+    __slots__ = ('rows', 'vocabulary', '_line_ids')
+
+    def __init__(self, rows: np.ndarray, vocabulary: Sequence[str]):
+        """
+        Args:
+            rows (np.ndarray): Array of ROW_DTYPE, one row per word.
+            vocabulary (Sequence[str]): Distinct word strings; ``rows['token']`` indexes it.
+        """
+        self.rows = rows
+        self.vocabulary = tuple(vocabulary)
+        self._line_ids = None
+
+    @classmethod
+    def from_data(cls, data: dict) -> 'WordTable':
+        """
+        Build the table from a pytesseract data dictionary, keeping only non-empty words.
+
+        Args:
+            data (dict): Result of image_to_data.
+
+        Returns:
+            WordTable: The words of the dictionary.
+        """
+        indexes = [i for i, text in enumerate(data['text']) if str(text).strip()]
+        rows = np.empty(len(indexes), dtype=ROW_DTYPE)
+        for column in ROW_DTYPE.names:
+            if column == 'token':
+                continue
+            values = data[column]
+            # pytesseract старых версий отдаёт conf строками
+            cast = float if column == 'conf' else int
+            rows[column] = [cast(values[i]) for i in indexes]
+        tokens = {}
+        rows['token'] = [tokens.setdefault(str(data['text'][i]), len(tokens)) for i in indexes]
+        return cls(rows, tokens)
+
+    def to_data(self) -> dict:
+        """Return the words as a pytesseract data dictionary (word level rows only)."""
+        data = {column: self.rows[column].tolist() for column in ROW_DTYPE.names
+                if column != 'token'}
+        data['level'] = [_WORD_LEVEL] * len(self)
+        data['text'] = self.texts()
+        return {key: data[key] for key in DATA_KEYS}
+
+    def to_bytes(self) -> bytes:
+        """Serialize the table: header, raw rows, then the vocabulary as UTF-8."""
+        vocabulary = _SEPARATOR.join(self.vocabulary).encode('utf-8')
+        return b''.join((_HEADER.pack(_MAGIC, len(self.rows), len(self.vocabulary)),
+                         np.ascontiguousarray(self.rows).tobytes(), vocabulary))
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> 'WordTable':
+        """
+        Restore a table written by to_bytes. The rows are a read-only view of the payload.
+
+        Args:
+            payload (bytes): The serialized table.
+
+        Returns:
+            WordTable: The table.
+
+        Raises:
+            ValueError: If the payload is not a serialized table.
+        """
+        magic, row_count, vocabulary_size = _HEADER.unpack_from(payload)
+        if magic != _MAGIC:
+            raise ValueError('Not a serialized word table')
+        rows = np.frombuffer(payload, dtype=ROW_DTYPE, count=row_count, offset=_HEADER.size)
+        vocabulary = bytes(payload[_HEADER.size + rows.nbytes:]).decode('utf-8')
+        return cls(rows, vocabulary.split(_SEPARATOR) if vocabulary_size else ())
+
+    def __reduce__(self):
+        return WordTable.from_bytes, (self.to_bytes(),)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def texts(self) -> List[str]:
+        """Return the word strings in row order."""
+        return [self.vocabulary[token] for token in self.rows['token'].tolist()]
+
+    @property
+    def line_ids(self) -> np.ndarray:
+        """Id of the run of rows sharing a (page, block, paragraph, line), in row order."""
+        if self._line_ids is None:
+            keys = np.stack([self.rows[column] for column in LINE_COLUMNS], axis=1)
+            changed = np.ones(len(self), dtype=bool)
+            changed[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+            self._line_ids = np.cumsum(changed) - 1
+        return self._line_ids
+
+    def boxes(self) -> np.ndarray:
+        """Return the boxes of all words as an (n, 4) array of x0, y0, x1, y1."""
+        left, top = self.rows['left'], self.rows['top']
+        return np.stack([left, top, left + self.rows['width'], top + self.rows['height']], axis=1)
+
+    def span_boxes(self, selection: np.ndarray) -> np.ndarray:
+        """
+        Merge the boxes of consecutive selected words on the same line.
+
+        Args:
+            selection (np.ndarray): Boolean array over the rows.
+
+        Returns:
+            np.ndarray: (k, 4) array with one box x0, y0, x1, y1 per run of selected words.
+        """
+        indexes = np.flatnonzero(selection)
+        if not len(indexes):
+            return np.zeros((0, 4), dtype=np.int32)
+        line_ids = self.line_ids[indexes]
+        starts = np.ones(len(indexes), dtype=bool)
+        starts[1:] = (np.diff(indexes) != 1) | (line_ids[1:] != line_ids[:-1])
+        run_starts = np.flatnonzero(starts)
+        boxes = self.boxes()[indexes]
+        return np.stack([np.minimum.reduceat(boxes[:, 0], run_starts),
+                         np.minimum.reduceat(boxes[:, 1], run_starts),
+                         np.maximum.reduceat(boxes[:, 2], run_starts),
+                         np.maximum.reduceat(boxes[:, 3], run_starts)], axis=1)
+
+    def scaled(self, factor: float, shape: Optional[Tuple[int, ...]] = None) -> 'WordTable':
+        """
+        Return a copy with the boxes mapped to another resolution.
+
+        Args:
+            factor (float): Coordinates are multiplied by it.
+            shape (Tuple[int, ...]): Shape of the target image; boxes are clipped to it.
+
+        Returns:
+            WordTable: The rescaled table sharing the vocabulary.
+        """
+        boxes = self.boxes().astype(np.float64) * factor
+        x0, y0 = np.floor(boxes[:, 0]), np.floor(boxes[:, 1])
+        x1, y1 = np.ceil(boxes[:, 2]), np.ceil(boxes[:, 3])
+        if shape is not None:
+            height, width = shape[:2]
+            x0, x1 = np.minimum(x0, width), np.minimum(x1, width)
+            y0, y1 = np.minimum(y0, height), np.minimum(y1, height)
+        rows = self.rows.copy()
+        rows['left'], rows['top'] = x0, y0
+        rows['width'], rows['height'] = x1 - x0, y1 - y0
+        return WordTable(rows, self.vocabulary)
+
+    def text(self) -> str:
+        """
+        Assemble plain text the way image_to_string lays it out: words of a line are joined by
+        spaces, lines by newlines and paragraphs by an empty line.
+        """
+        paragraphs = []
+        lines = {}
+        paragraph_columns = LINE_COLUMNS[:3]
+        keys = zip(*(self.rows[column].tolist() for column in paragraph_columns),
+                   self.rows['line_num'].tolist())
+        for (page_num, block_num, par_num, line_num), word in zip(keys, self.texts()):
+            paragraph_key = (page_num, block_num, par_num)
+            if not paragraphs or paragraphs[-1] != paragraph_key:
+                paragraphs.append(paragraph_key)
+            lines.setdefault(paragraph_key, {}).setdefault(line_num, []).append(word)
+        return '\n\n'.join(
+            '\n'.join(' '.join(words) for words in lines[key].values())
+            for key in paragraphs)